@@ -1,49 +1,163 @@
 import datetime
-import importlib
-import ipaddress
-import re
+import math
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import warnings
 
 from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth import login, logout
+from django.contrib.auth import alogin, alogout, get_user_model, login, logout
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.http import HttpResponseForbidden
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from ipware import get_client_ip
 
-from .models import AuthLink
+from .filters import KeyFilter, get_key_filter
+from .metrics import start_timer
+from .ratelimit import get_rate_limiter
+from .signals import ADDRESS_MISMATCH
+from .storage import get_storage
+from .utils import (
+    cached_until_setting_changed,
+    generate_authlink_keys,
+    import_attribute,
+    normalize_ipaddress,
+    parse_ipaddress,
+)
+from .whitelist import get_url_whitelist
 
 
 class DefaultAuthLinkAdapter:
     """
     Most application logic should live here, such that it becomes
     easily overridable.
+
+    A single instance is shared by every request and thread (see
+    `get_adapter`), so adapters must not keep per-request state on `self`.
     """
 
+    # where failures are reported unless AUTHLINK_FAILURE_REPORTING is "messages"
+    failure_parameter = "authlink_error"
+    failure_cookie_salt = "authlink.adapter.failure"
+    failure_cookie_max_age = 60
+
     def create(self, **kwargs):
         request = kwargs.pop("request")
-        if not request.user.is_authenticated:
+        timer = start_timer("created")
+        authlink = self.build(request, request.user, **kwargs)
+        timer.mark("build")
+        self.get_storage().save(authlink)
+        timer.mark("save")
+        timer.send("created", type(self), request=request, authlinks=[authlink])
+        return authlink
+
+    async def acreate(self, **kwargs):
+        request = kwargs.pop("request")
+        timer = start_timer("created")
+        authlink = self.build(request, await request.auser(), **kwargs)
+        timer.mark("build")
+        await self.get_storage().asave(authlink)
+        timer.mark("save")
+        await timer.asend("created", type(self), request=request, authlinks=[authlink])
+        return authlink
+
+    def build(self, request, user, **kwargs):
+        if not user.is_authenticated:
             raise RuntimeError(
                 "User not authenticated, cannot create AuthLink. Check for this in view."
             )
-        authlink = AuthLink(**kwargs)
-        authlink.user = request.user
+        authlink = self.get_storage().build(**kwargs)
+        authlink.user = user
         authlink.ipaddress = self.extract_ipaddress(request)
         authlink.expires = self.calculate_expiry(authlink.created)
-        authlink.save()
         return authlink
 
+    def bulk_create(self, links, request=None, batch_size=None):
+        """
+        Create many authlinks at once, e.g. one per recipient of a campaign.
+
+        `links` are dicts of `AuthLink` field values, at least `url`. The
+        `user` and `ipaddress` default to those of `request`, if given.
+        Raises ValidationError, creating nothing, if any URL is not
+        whitelisted.
+        """
+        timer = start_timer("created")
+        user = request.user if request is not None else None
+        authlinks = self.build_many(links, request, user)
+        timer.mark("build")
+        self.get_storage().bulk_save(authlinks, batch_size=batch_size)
+        timer.mark("save")
+        timer.send("created", type(self), request=request, authlinks=authlinks)
+        return authlinks
+
+    async def abulk_create(self, links, request=None, batch_size=None):
+        timer = start_timer("created")
+        user = await request.auser() if request is not None else None
+        authlinks = self.build_many(links, request, user)
+        timer.mark("build")
+        await self.get_storage().abulk_save(authlinks, batch_size=batch_size)
+        timer.mark("save")
+        await timer.asend("created", type(self), request=request, authlinks=authlinks)
+        return authlinks
+
+    def build_many(self, links, request, user):
+        links = [dict(link) for link in links]
+        self.validate_urls(link["url"] for link in links)
+        defaults = {}
+        if request is not None:
+            defaults = {"user": user, "ipaddress": self.extract_ipaddress(request)}
+        storage = self.get_storage()
+        keys = generate_authlink_keys(len(links))
+        authlinks = []
+        for key, link in zip(keys, links):
+            fields = {"key": key, **defaults, **link}
+            if "ipaddress" in link:
+                fields["ipaddress"] = normalize_ipaddress(link["ipaddress"])
+            if fields.get("user") is None or not fields["user"].is_authenticated:
+                raise RuntimeError("User not authenticated, cannot create AuthLink.")
+            authlink = storage.build(**fields)
+            authlink.expires = self.calculate_expiry(authlink.created)
+            authlinks.append(authlink)
+        return authlinks
+
+    def validate_urls(self, urls):
+        rejected = sorted(url for url in set(urls) if not self.in_url_whitelist(url))
+        if rejected:
+            raise ValidationError(
+                [
+                    ValidationError(
+                        _("URL specified is not whitelisted: %(url)s"),
+                        code="not_whitelisted",
+                        params={"url": url},
+                    )
+                    for url in rejected
+                ]
+            )
+
+    def get_storage(self):
+        return get_storage()
+
+    def get_database(self):
+        return self.get_storage().get_database()
+
     def calculate_expiry(self, created):
         return created + datetime.timedelta(seconds=getattr(settings, "AUTHLINK_TTL_SECONDS", 60))
 
     def extract_ipaddress(self, request):
+        """
+        The normalised IP address of `request`, worked out once per request.
+        """
+        try:
+            return request._authlink_ipaddress
+        except AttributeError:
+            pass
         # only trust non-routable addresses when in DEBUG, mirroring the
         # behaviour of the legacy ipware get_real_ip/get_ip functions
         client_ip, is_routable = get_client_ip(request)
-        if is_routable or settings.DEBUG:
-            return client_ip
-        return None
+        client_ip = normalize_ipaddress(client_ip) if is_routable or settings.DEBUG else None
+        request._authlink_ipaddress = client_ip
+        return client_ip
 
     def add_message(self, request, level, message):
         messages.add_message(request, level, message)
@@ -54,6 +168,60 @@ class DefaultAuthLinkAdapter:
     def error(self, request, message):
         self.add_message(request, messages.ERROR, message)
 
+    def get_failure_reporting(self):
+        reporting = getattr(settings, "AUTHLINK_FAILURE_REPORTING", "messages")
+        if reporting not in ("messages", "query", "cookie"):
+            raise ImproperlyConfigured(
+                "AUTHLINK_FAILURE_REPORTING must be 'messages', 'query' or 'cookie', "
+                f"not {reporting!r}."
+            )
+        return reporting
+
+    def report_failure(self, request, response, reason, message):
+        """
+        Tell the user why their link could not be used, as set by
+        `AUTHLINK_FAILURE_REPORTING`: with `message` through the messages
+        framework, or with the `reason` code in a query parameter of, or a
+        signed cookie set by, the redirect `response`. Only the first needs
+        a session.
+        """
+        reporting = self.get_failure_reporting()
+        if reporting == "query" and response.has_header("Location"):
+            scheme, netloc, path, query, fragment = urlsplit(response["Location"])
+            query = urlencode(
+                parse_qsl(query, keep_blank_values=True) + [(self.failure_parameter, reason)]
+            )
+            response["Location"] = urlunsplit((scheme, netloc, path, query, fragment))
+        elif reporting == "cookie":
+            response.set_signed_cookie(
+                self.failure_parameter,
+                reason,
+                salt=self.failure_cookie_salt,
+                max_age=self.failure_cookie_max_age,
+                httponly=True,
+                samesite="Lax",
+            )
+        elif reporting == "messages":
+            self.error(request, message)
+        return response
+
+    def get_failure_reason(self, request):
+        """
+        For the page failed authlinks redirect to, the reason code reported
+        by `report_failure` if not using messages, else None.
+        """
+        reporting = self.get_failure_reporting()
+        if reporting == "query":
+            return request.GET.get(self.failure_parameter)
+        if reporting == "cookie":
+            return request.get_signed_cookie(
+                self.failure_parameter,
+                default=None,
+                salt=self.failure_cookie_salt,
+                max_age=self.failure_cookie_max_age,
+            )
+        return None
+
     def login(self, request, authlink):
         """
         Mark the user session as having use AuthLinkBackend
@@ -67,22 +235,242 @@ class DefaultAuthLinkAdapter:
         logout(request)
 
     def use(self, authlink):
-        authlink.used = timezone.now()
-        authlink.save()
+        """
+        Deprecated: consuming a link no longer calls this, as `claim` marks
+        it used. Filter `get_queryset` to restrict which links can be claimed.
+        """
+        warnings.warn(
+            "DefaultAuthLinkAdapter.use() is not called when consuming links and will be "
+            "removed; claim() marks them used.",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        self.get_storage().use(authlink, timezone.now())
+
+    def get_authlink(self, key, queryset=None):
+        return self.get_storage().get(key, queryset=queryset)
+
+    def check_key(self, key):
+        """
+        Without touching storage, return the `KeyFilter` reason `key` can't
+        be consumed if that is already known, else None.
+        """
+        if not self.get_storage().is_valid_key(key):
+            return KeyFilter.MISSING
+        key_filter = get_key_filter()
+        return key_filter.get(key) if key_filter else None
+
+    def remember_key(self, key, reason, authlink=None):
+        """
+        Record why `key` can't be consumed, for `check_key`. Used links are
+        remembered until they expire.
+        """
+        key_filter = get_key_filter()
+        if key_filter:
+            key_filter.set(key, reason, self.get_key_filter_timeout(reason, authlink))
+
+    def get_key_filter_timeout(self, reason, authlink):
+        if reason == KeyFilter.USED:
+            return max(math.ceil((authlink.expires - timezone.now()).total_seconds()), 1)
+        return None
+
+    def check_rate_limit(self, request, scope, user=None, cost=1):
+        """
+        Count `request`, as `cost` hits, against the
+        `AUTHLINK_RATELIMIT_<SCOPE>` limit for `scope`, "create" or
+        "consume", of `user` if given, else its IP address. Returns the
+        seconds to wait if over the limit, else None. Requests whose IP
+        address can't be told aren't limited, rather than all sharing one
+        limit.
+        """
+        limiter = get_rate_limiter(scope)
+        if limiter is None:
+            return None
+        key = self.get_rate_limit_key(request, scope, user)
+        return None if key is None else limiter.check(key, cost)
+
+    def get_rate_limit_key(self, request, scope, user=None):
+        if user is not None:
+            return f"{scope}:user:{user.pk}"
+        ipaddress = self.extract_ipaddress(request)
+        return f"{scope}:ip:{ipaddress}" if ipaddress else None
+
+    def get_queryset(self):
+        """
+        The authlinks to claim from, where kept in the database. Override to
+        change what is joined in or loaded along with them, or filter it to
+        restrict which links can be claimed.
+        """
+        return self.get_storage().get_queryset()
+
+    def peek(self, key, queryset=None):
+        """
+        The authlink for `key` as it was created, if the storage can tell
+        without a database query, else None. See `BaseAuthLinkStorage.peek`.
+
+        When consuming deletes links, it is otherwise read from storage,
+        through `queryset` if given: a deleted link can't be put back
+        without a moment in which it seems missing, so its address is best
+        checked before it is claimed.
+        """
+        storage = self.get_storage()
+        snapshot = storage.peek(key)
+        if snapshot is None and storage.delete_on_consume():
+            snapshot = storage.get(key, queryset=queryset)
+        return snapshot
+
+    def check_snapshot(self, request, authlink):
+        """
+        Return the reason an authlink returned by `peek` can't be consumed by
+        `request`, if that's known without claiming it, else None. Used
+        links are left for the claim to fail on.
+        """
+        if self.is_expired(authlink):
+            return KeyFilter.EXPIRED
+        if self.is_used(authlink):
+            return None
+        if not self.ipaddress_matches(request, authlink):
+            return ADDRESS_MISMATCH
+        return None
+
+    def claim(self, key, queryset=None):
+        """
+        Atomically mark the authlink for `key` as used if it is neither
+        used nor expired, returning it, else None. Concurrent consumers
+        cannot both succeed.
+        """
+        return self.get_storage().claim(key, timezone.now(), queryset=queryset)
+
+    def release(self, authlink):
+        """
+        Undo a claim, for when a check that can only happen after claiming
+        (such as the IP address comparison) fails.
+        """
+        self.get_storage().release(authlink)
 
     def is_expired(self, authlink):
+        """
+        Whether `authlink` has expired. `claim` only claims links that have
+        not reached `expires`, but a link it claims is still turned away if
+        this says it has expired, so overrides can shorten expiry, not
+        extend it.
+        """
         return authlink.expires <= timezone.now()
 
     def is_used(self, authlink):
+        """
+        Whether `authlink` has been used, to tell why it could not be
+        claimed. Whether it can be is decided by `claim` alone.
+        """
         return authlink.used
 
+    def get_ipaddress_match_prefix(self, version):
+        """
+        How many leading bits of the addresses a link was created and is
+        consumed from must agree, per `AUTHLINK_IP_MATCH_PREFIX`: a pair of
+        IPv4 and IPv6 prefix lengths, or just the former.
+        """
+        prefixes = getattr(settings, "AUTHLINK_IP_MATCH_PREFIX", (32, 128))
+        if isinstance(prefixes, int):
+            prefixes = (prefixes, 128)
+        try:
+            ipv4_prefix, ipv6_prefix = prefixes
+        except (TypeError, ValueError):
+            ipv4_prefix = ipv6_prefix = None
+        if not (
+            isinstance(ipv4_prefix, int)
+            and isinstance(ipv6_prefix, int)
+            and 0 <= ipv4_prefix <= 32
+            and 0 <= ipv6_prefix <= 128
+        ):
+            raise ImproperlyConfigured(
+                "AUTHLINK_IP_MATCH_PREFIX must be an IPv4 prefix length of 0 to 32, or a pair "
+                f"of that and an IPv6 one of 0 to 128, not {prefixes!r}."
+            )
+        return ipv4_prefix if version == 4 else ipv6_prefix
+
     def ipaddress_matches(self, request, authlink):
-        # leverage python standard lib to properly compare the two addresses as
-        # string comparison can be unreliable
-        request_ip = self.extract_ipaddress(request)
-        request_ip = ipaddress.ip_address(request_ip) if request_ip else request_ip
-        expected_ip = ipaddress.ip_address(authlink.ipaddress)
-        return request_ip == expected_ip
+        # compare parsed addresses as string comparison can be unreliable,
+        # masking both to the configured prefix by shifting their integers
+        request_ip = parse_ipaddress(self.extract_ipaddress(request))
+        expected_ip = parse_ipaddress(authlink.ipaddress)
+        if request_ip is None or expected_ip is None or request_ip.version != expected_ip.version:
+            return False
+        shift = request_ip.max_prefixlen - self.get_ipaddress_match_prefix(request_ip.version)
+        return int(request_ip) >> shift == int(expected_ip) >> shift
+
+    # Async counterparts, for use by AsyncAuthLinkView. Those with no I/O
+    # defer to their synchronous versions so overriding those suffices.
+
+    async def aget_authlink(self, key, queryset=None):
+        return await self.get_storage().aget(key, queryset=queryset)
+
+    async def acheck_key(self, key):
+        if not self.get_storage().is_valid_key(key):
+            return KeyFilter.MISSING
+        key_filter = get_key_filter()
+        return await key_filter.aget(key) if key_filter else None
+
+    async def aremember_key(self, key, reason, authlink=None):
+        key_filter = get_key_filter()
+        if key_filter:
+            await key_filter.aset(key, reason, self.get_key_filter_timeout(reason, authlink))
+
+    async def acheck_rate_limit(self, request, scope, user=None, cost=1):
+        limiter = get_rate_limiter(scope)
+        if limiter is None:
+            return None
+        key = self.get_rate_limit_key(request, scope, user)
+        return None if key is None else await limiter.acheck(key, cost)
+
+    async def apeek(self, key, queryset=None):
+        storage = self.get_storage()
+        snapshot = await storage.apeek(key)
+        if snapshot is None and storage.delete_on_consume():
+            snapshot = await storage.aget(key, queryset=queryset)
+        return snapshot
+
+    async def acheck_snapshot(self, request, authlink):
+        return self.check_snapshot(request, authlink)
+
+    async def aclaim(self, key, queryset=None, authlink=None):
+        return await self.get_storage().aclaim(
+            key, timezone.now(), queryset=queryset, authlink=authlink
+        )
+
+    async def arelease(self, authlink):
+        await self.get_storage().arelease(authlink)
+
+    async def ause(self, authlink):
+        warnings.warn(
+            "DefaultAuthLinkAdapter.ause() is not called when consuming links and will be "
+            "removed; aclaim() marks them used.",
+            DeprecationWarning,
+            stacklevel=2,
+        )
+        await self.get_storage().ause(authlink, timezone.now())
+
+    async def ais_expired(self, authlink):
+        return self.is_expired(authlink)
+
+    async def ais_used(self, authlink):
+        return self.is_used(authlink)
+
+    async def aipaddress_matches(self, request, authlink):
+        return self.ipaddress_matches(request, authlink)
+
+    async def aget_user(self, authlink):
+        if type(authlink).user.is_cached(authlink):
+            return authlink.user
+        return await get_user_model()._default_manager.aget(pk=authlink.user_id)
+
+    async def alogin(self, request, authlink):
+        user = await self.aget_user(authlink)
+        user.backend = "authlink.auth_backends.AuthLinkBackend"
+        await alogin(request, user)
+
+    async def alogout(self, request):
+        await alogout(request)
 
     def get_full_url(self, authlink):
         return getattr(settings, "AUTHLINK_URL_TEMPLATE", "/authlink/{key}").format(
@@ -90,11 +478,7 @@ class DefaultAuthLinkAdapter:
         )
 
     def in_url_whitelist(self, url):
-        whitelist = getattr(settings, "AUTHLINK_URL_WHITELIST", [])
-        for url_re in whitelist:
-            if re.match(url_re, url):
-                return True
-        return False
+        return get_url_whitelist().match(url)
 
     def get_whitelist_failure_response(self, request):
         return HttpResponseForbidden(
@@ -102,9 +486,28 @@ class DefaultAuthLinkAdapter:
         )
 
 
-def get_adapter():
+def load_adapter():
     class_path = getattr(settings, "AUTHLINK_ADAPTER_CLASS", None)
-    if class_path:
-        pkg, attr = class_path.rsplit(".", 1)
-        return getattr(importlib.import_module(pkg), attr)()
-    return DefaultAuthLinkAdapter()
+    if not class_path:
+        return DefaultAuthLinkAdapter()
+    adapter_class = import_attribute(class_path)
+    # consuming no longer calls these, so overrides would silently be skipped
+    for name in ("use", "ause"):
+        if getattr(adapter_class, name) is not getattr(DefaultAuthLinkAdapter, name):
+            warnings.warn(
+                f"{class_path}.{name}() is not called when consuming links, which claim() "
+                "marks used. Filter get_queryset() to restrict which links can be claimed, or "
+                "receive the authlink_consumed signal to act on links once used.",
+                DeprecationWarning,
+                stacklevel=3,
+            )
+    return adapter_class()
+
+
+@cached_until_setting_changed("AUTHLINK_ADAPTER_CLASS")
+def get_adapter():
+    """
+    Return the process-wide adapter instance, resolving
+    `AUTHLINK_ADAPTER_CLASS` on first use only.
+    """
+    return load_adapter()
@@ -0,0 +1,197 @@
+import json
+
+from django.http import JsonResponse
+from django.utils.translation import gettext_lazy as _
+from django.views.generic import View
+
+from ...adapter import get_adapter
+from ...forms import AuthLinkBulkForm, AuthLinkForm
+
+
+class AuthLinkCreateView(View):
+    """
+    Plain Django equivalent of the REST framework `AuthLinkCreateView`,
+    accepting the same request and giving the same responses without the
+    overhead of content negotiation and serializers.
+
+    # Request #
+
+        POST /v1/auth/link
+        {
+            "url": "/some/whitelisted/path?q=s"
+        }
+
+    # Response #
+
+        HTTP 201 Created
+        Content-Type: application/json
+        Location: https://configurable/url/structure/auth/link/k6s1fhv3a6e99liamatxqrn1m6nynn1krbtzw47wxckhyiahwohp4f7bb8del6hf
+        {
+            "url": "/some/whitelisted/path?q=s"
+        }
+
+    Requests are authenticated by Django's own machinery, so requests using a
+    session must pass CSRF protection.
+    """
+
+    http_method_names = ["post", "options"]
+    form_class = AuthLinkForm
+
+    def post(self, request):
+        if not request.user.is_authenticated:
+            return self.on_not_authenticated(request)
+        retry_after = get_adapter().check_rate_limit(request, "create", user=request.user)
+        if retry_after is not None:
+            return self.on_rate_limited(request, retry_after)
+        form = self.get_form(request)
+        if form is None:
+            return self.on_parse_error(request)
+        if not form.is_valid():
+            return self.on_invalid(request, form)
+        # the request itself was counted before its links were known
+        cost = self.get_rate_limit_cost(form) - 1
+        if cost > 0:
+            retry_after = get_adapter().check_rate_limit(
+                request, "create", user=request.user, cost=cost
+            )
+            if retry_after is not None:
+                return self.on_rate_limited(request, retry_after)
+        return self.on_success(request, self.perform_create(request, form))
+
+    def get_rate_limit_cost(self, form):
+        """
+        How many hits against `AUTHLINK_RATELIMIT_CREATE` the links `form`
+        asks for count as, one for each.
+        """
+        return 1
+
+    def perform_create(self, request, form):
+        return get_adapter().create(request=request, **form.cleaned_data)
+
+    def get_form(self, request):
+        if request.content_type == "application/json":
+            try:
+                data = json.loads(request.body)
+            except ValueError:
+                return None
+            if not isinstance(data, dict):
+                return None
+        else:
+            data = request.POST
+        return self.form_class(data)
+
+    def on_not_authenticated(self, request):
+        return JsonResponse(
+            {"detail": _("Authentication credentials were not provided.")}, status=403
+        )
+
+    def on_rate_limited(self, request, retry_after):
+        # as REST framework's Throttled
+        return JsonResponse(
+            {"detail": _("Request was throttled.")},
+            status=429,
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    def on_parse_error(self, request):
+        return JsonResponse({"detail": _("Malformed request.")}, status=400)
+
+    def on_invalid(self, request, form):
+        # mirror REST framework's {"field": ["message", ...]} shape
+        return JsonResponse(
+            {
+                field: [error["message"] for error in errors]
+                for field, errors in form.errors.get_json_data().items()
+            },
+            status=400,
+        )
+
+    def on_success(self, request, authlink):
+        return JsonResponse(
+            {"url": authlink.url},
+            status=201,
+            headers={"Location": get_adapter().get_full_url(authlink)},
+        )
+
+
+class AsyncAuthLinkCreateView(AuthLinkCreateView):
+    """
+    `AuthLinkCreateView` for ASGI deployments.
+    """
+
+    async def post(self, request):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return self.on_not_authenticated(request)
+        retry_after = await get_adapter().acheck_rate_limit(request, "create", user=user)
+        if retry_after is not None:
+            return self.on_rate_limited(request, retry_after)
+        form = self.get_form(request)
+        if form is None:
+            return self.on_parse_error(request)
+        if not form.is_valid():
+            return self.on_invalid(request, form)
+        cost = self.get_rate_limit_cost(form) - 1
+        if cost > 0:
+            retry_after = await get_adapter().acheck_rate_limit(
+                request, "create", user=user, cost=cost
+            )
+            if retry_after is not None:
+                return self.on_rate_limited(request, retry_after)
+        return self.on_success(request, await self.aperform_create(request, form))
+
+    async def aperform_create(self, request, form):
+        return await get_adapter().acreate(request=request, **form.cleaned_data)
+
+
+class BulkCreateMixin:
+    """
+    Turns the views above into ones creating a link to each of several URLs.
+
+    # Request #
+
+        POST /v1/auth/links
+        {
+            "urls": ["/some/whitelisted/path?q=s", "/another/whitelisted/path"]
+        }
+
+    # Response #
+
+        HTTP 201 Created
+        Content-Type: application/json
+        {
+            "locations": [
+                "https://configurable/url/structure/auth/link/k6s1fhv3a6e99liamatxqrn1m6nynn1krbtzw47wxckhyiahwohp4f7bb8del6hf",
+                "https://configurable/url/structure/auth/link/1c4uegcpmi6x5f2nk0qd2ghbq9gxv5ynt7d3cj6u2u1oyyb8dbmzcw1b0cvsr7ax"
+            ]
+        }
+    """
+
+    form_class = AuthLinkBulkForm
+
+    def get_links(self, form):
+        return [{"url": url} for url in form.cleaned_data["urls"]]
+
+    def get_rate_limit_cost(self, form):
+        return len(form.cleaned_data["urls"])
+
+    def perform_create(self, request, form):
+        return get_adapter().bulk_create(self.get_links(form), request=request)
+
+    async def aperform_create(self, request, form):
+        return await get_adapter().abulk_create(self.get_links(form), request=request)
+
+    def on_success(self, request, authlinks):
+        adapter = get_adapter()
+        return JsonResponse(
+            {"locations": [adapter.get_full_url(authlink) for authlink in authlinks]},
+            status=201,
+        )
+
+
+class AuthLinkBulkCreateView(BulkCreateMixin, AuthLinkCreateView):
+    pass
+
+
+class AsyncAuthLinkBulkCreateView(BulkCreateMixin, AsyncAuthLinkCreateView):
+    pass
@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 
 from rest_framework import serializers
@@ -20,3 +22,24 @@ class AuthLinkSerializer(serializers.ModelSerializer):
         data = self.validated_data
         data["request"] = request._request
         return get_adapter().create(**data)
+
+
+class AuthLinkBulkSerializer(serializers.Serializer):
+    urls = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+
+    def validate_urls(self, value):
+        max_urls = getattr(settings, "AUTHLINK_BULK_CREATE_MAX_URLS", 100)
+        if len(value) > max_urls:
+            raise serializers.ValidationError(
+                _("No more than %(max_urls)s URLs may be given.") % {"max_urls": max_urls}
+            )
+        try:
+            get_adapter().validate_urls(value)
+        except ValidationError as e:
+            raise serializers.ValidationError(e.messages)
+        return value
+
+    def save(self, request):
+        return get_adapter().bulk_create(
+            [{"url": url} for url in self.validated_data["urls"]], request=request._request
+        )
@@ -0,0 +1,19 @@
+from rest_framework.throttling import BaseThrottle
+
+from ...adapter import get_adapter
+
+
+class AuthLinkCreateThrottle(BaseThrottle):
+    """
+    Applies `AUTHLINK_RATELIMIT_CREATE` to each authenticated user, through
+    the adapter, alongside any throttles REST framework is configured with.
+    """
+
+    retry_after = None
+
+    def allow_request(self, request, view):
+        self.retry_after = get_adapter().check_rate_limit(request, "create", user=request.user)
+        return self.retry_after is None
+
+    def wait(self):
+        return self.retry_after
@@ -1,8 +1,11 @@
-from rest_framework.generics import CreateAPIView
+from rest_framework import status
+from rest_framework.generics import CreateAPIView, GenericAPIView
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 
 from ...adapter import get_adapter
-from .serializers import AuthLinkSerializer
+from .serializers import AuthLinkBulkSerializer, AuthLinkSerializer
+from .throttling import AuthLinkCreateThrottle
 
 
 class AuthLinkCreateView(CreateAPIView):
@@ -40,9 +43,68 @@ class AuthLinkCreateView(CreateAPIView):
     serializer_class = AuthLinkSerializer
     permission_classes = (IsAuthenticated,)
 
+    def get_throttles(self):
+        return [*super().get_throttles(), AuthLinkCreateThrottle()]
+
     def perform_create(self, serializer):
         self.authlink = serializer.save(self.request)
 
     def get_success_headers(self, data):
         """Return the URL of our authenticated link."""
         return {"Location": get_adapter().get_full_url(self.authlink)}
+
+
+class AuthLinkBulkCreateView(GenericAPIView):
+    """
+    Authenticated view that takes several URLs and creates a link to each
+    for the current user, in one go.
+
+    # Request #
+
+        POST /v1/auth/links
+        {
+            "urls": ["/some/whitelisted/path?q=s", "/another/whitelisted/path"]
+        }
+
+    # Response #
+
+        HTTP 201 Created
+        Content-Type: application/json
+        {
+            "locations": [
+                "https://configurable/url/structure/auth/link/k6s1fhv3a6e99liamatxqrn1m6nynn1krbtzw47wxckhyiahwohp4f7bb8del6hf",
+                "https://configurable/url/structure/auth/link/1c4uegcpmi6x5f2nk0qd2ghbq9gxv5ynt7d3cj6u2u1oyyb8dbmzcw1b0cvsr7ax"
+            ]
+        }
+
+    # Server Configuration Hints #
+
+    * as for `AuthLinkCreateView`.
+    * at most `AUTHLINK_BULK_CREATE_MAX_URLS` URLs may be given; default 100.
+    """
+
+    allowed_methods = ("POST",)
+    serializer_class = AuthLinkBulkSerializer
+    permission_classes = (IsAuthenticated,)
+
+    def get_throttles(self):
+        return [*super().get_throttles(), AuthLinkCreateThrottle()]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        adapter = get_adapter()
+        # each link counts against the limit, the first as the request did
+        cost = len(serializer.validated_data["urls"]) - 1
+        if cost > 0:
+            retry_after = adapter.check_rate_limit(request, "create", user=request.user, cost=cost)
+            if retry_after is not None:
+                self.throttled(request, retry_after)
+        return Response(
+            {
+                "locations": [
+                    adapter.get_full_url(authlink) for authlink in serializer.save(request)
+                ]
+            },
+            status=status.HTTP_201_CREATED,
+        )
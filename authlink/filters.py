@@ -0,0 +1,109 @@
+from collections import OrderedDict
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .utils import cached_until_setting_changed
+
+
+class KeyFilter:
+    """
+    Remembers why recently seen keys could not be consumed, so that replays
+    of used links and guesses at unknown ones can be turned away without
+    touching storage.
+
+    Entries are held in a bounded in-process LRU and, if `cache_alias` is
+    given, in that cache so that all processes benefit.
+    """
+
+    MISSING = "missing"
+    EXPIRED = "expired"
+    USED = "used"
+
+    key_prefix = "authlink:filter"
+
+    def __init__(self, max_entries=10000, timeout=60, cache_alias=None):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.cache_alias = cache_alias
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    def cache_key(self, key):
+        return f"{self.key_prefix}:{key}"
+
+    def get_local(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            reason, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return reason
+
+    def set_local(self, key, reason, timeout):
+        with self.lock:
+            self.entries[key] = (reason, time.monotonic() + timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get(self, key):
+        """
+        Return the reason `key` was last rejected, or None if unknown.
+        """
+        reason = self.get_local(key)
+        if reason is None and self.cache is not None:
+            reason = self.cache.get(self.cache_key(key))
+            if reason is not None:
+                self.set_local(key, reason, self.timeout)
+        return reason
+
+    def set(self, key, reason, timeout=None):
+        timeout = timeout or self.timeout
+        self.set_local(key, reason, timeout)
+        if self.cache is not None:
+            self.cache.set(self.cache_key(key), reason, timeout)
+
+    async def aget(self, key):
+        reason = self.get_local(key)
+        if reason is None and self.cache is not None:
+            reason = await self.cache.aget(self.cache_key(key))
+            if reason is not None:
+                self.set_local(key, reason, self.timeout)
+        return reason
+
+    async def aset(self, key, reason, timeout=None):
+        timeout = timeout or self.timeout
+        self.set_local(key, reason, timeout)
+        if self.cache is not None:
+            await self.cache.aset(self.cache_key(key), reason, timeout)
+
+
+@cached_until_setting_changed(
+    "AUTHLINK_KEY_FILTER",
+    "AUTHLINK_KEY_FILTER_MAX_ENTRIES",
+    "AUTHLINK_KEY_FILTER_TIMEOUT",
+    "AUTHLINK_KEY_FILTER_CACHE_ALIAS",
+)
+def get_key_filter():
+    """
+    Return the process-wide `KeyFilter`, or None unless `AUTHLINK_KEY_FILTER`
+    is enabled.
+    """
+    if not getattr(settings, "AUTHLINK_KEY_FILTER", False):
+        return None
+    return KeyFilter(
+        max_entries=getattr(settings, "AUTHLINK_KEY_FILTER_MAX_ENTRIES", 10000),
+        timeout=getattr(settings, "AUTHLINK_KEY_FILTER_TIMEOUT", 60),
+        cache_alias=getattr(settings, "AUTHLINK_KEY_FILTER_CACHE_ALIAS", None),
+    )
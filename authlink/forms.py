@@ -0,0 +1,31 @@
+from django import forms
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+
+from .adapter import get_adapter
+
+
+class AuthLinkForm(forms.Form):
+    url = forms.CharField()
+
+    def clean_url(self):
+        value = self.cleaned_data["url"]
+        if not get_adapter().in_url_whitelist(value):
+            raise forms.ValidationError(_("URL specified is not whitelisted"))
+        return value
+
+
+class AuthLinkBulkForm(forms.Form):
+    urls = forms.Field(widget=forms.MultipleHiddenInput)
+
+    def clean_urls(self):
+        value = self.cleaned_data["urls"]
+        if not isinstance(value, list) or not all(isinstance(url, str) and url for url in value):
+            raise forms.ValidationError(_("Expected a list of URLs."))
+        max_urls = getattr(settings, "AUTHLINK_BULK_CREATE_MAX_URLS", 100)
+        if len(value) > max_urls:
+            raise forms.ValidationError(
+                _("No more than %(max_urls)s URLs may be given."), params={"max_urls": max_urls}
+            )
+        get_adapter().validate_urls(value)
+        return value
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from authlink.storage import hash_authlinks
+
+
+class Command(BaseCommand):
+    help = "Move authlinks that can still be used to HashedAuthLink."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Maximum number of authlinks to move per transaction.",
+        )
+
+    def handle(self, *args, **options):
+        count = hash_authlinks(batch_size=options["batch_size"])
+        self.stdout.write(f"Moved {count} authlinks.")
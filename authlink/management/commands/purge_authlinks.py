@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from authlink.models import AuthLink, HashedAuthLink
+from authlink.purge import purge_authlinks
+from authlink.storage import get_storage
+
+
+class Command(BaseCommand):
+    help = "Delete expired and used authlinks in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Maximum number of authlinks to delete per statement.",
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0,
+            help="Seconds to pause between batches.",
+        )
+        parser.add_argument(
+            "--max-runtime",
+            type=float,
+            default=None,
+            help="Stop starting new batches after this many seconds.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the authlinks that would be deleted.",
+        )
+
+    def get_models(self):
+        # both tables, as links left in AuthLink by hash_authlinks hold keys
+        return dict.fromkeys([get_storage().model, AuthLink, HashedAuthLink])
+
+    def handle(self, *args, **options):
+        max_runtime = options["max_runtime"]
+        deadline = time.monotonic() + max_runtime if max_runtime else None
+        count = 0
+        for model in self.get_models():
+            remaining = deadline - time.monotonic() if deadline else None
+            if remaining is not None and remaining <= 0:
+                break
+            count += purge_authlinks(
+                batch_size=options["batch_size"],
+                sleep=options["sleep"],
+                max_runtime=remaining,
+                dry_run=options["dry_run"],
+                model=model,
+            )
+        if options["dry_run"]:
+            self.stdout.write(f"{count} authlinks would be deleted.")
+        else:
+            self.stdout.write(f"Deleted {count} authlinks.")
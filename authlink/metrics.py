@@ -0,0 +1,238 @@
+from collections import Counter, defaultdict
+import logging
+import math
+import socket
+import threading
+import time
+
+from django.conf import settings
+
+from .signals import authlink_consumed, authlink_created, authlink_rejected
+from .utils import cached_until_setting_changed, import_attribute
+
+
+logger = logging.getLogger(__name__)
+
+
+SIGNALS = {
+    "created": authlink_created,
+    "consumed": authlink_consumed,
+    "rejected": authlink_rejected,
+}
+
+
+class BaseMetricsSink:
+    """
+    Somewhere to send the timings of each stage of creating and consuming
+    authlinks, and counts of the outcomes, set by `AUTHLINK_METRICS_SINK`.
+    """
+
+    def timing(self, name, seconds, tags=None):
+        raise NotImplementedError
+
+    def increment(self, name, tags=None):
+        raise NotImplementedError
+
+    def record(self, event, timings, reason=None):
+        tags = {"reason": reason} if reason else None
+        self.increment(event, tags)
+        for stage, seconds in timings.items():
+            self.timing(f"{event}.{stage}", seconds, tags)
+
+
+class StatsdMetricsSink(BaseMetricsSink):
+    """
+    Sends metrics over UDP in the StatsD format, with tags in the DogStatsD
+    style that Datadog, Telegraf and Prometheus' statsd_exporter all read.
+    Each event goes out in a single packet and delivery is never waited on.
+
+    The host is only looked up once there is something to send, and a
+    failed lookup is retried no more than every `resolve_retry_seconds`,
+    metrics being dropped meanwhile.
+    """
+
+    resolve_retry_seconds = 60
+
+    def __init__(self, host="localhost", port=8125, prefix="authlink"):
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.socket = self.address = self.failed_at = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """
+        Return the socket to send metrics through, opening it on first use,
+        or None while the host can't be resolved.
+        """
+        with self.lock:
+            if self.socket is not None:
+                return self.socket
+            now = time.monotonic()
+            if self.failed_at is not None and now - self.failed_at < self.resolve_retry_seconds:
+                return None
+            try:
+                family, _, _, _, address = socket.getaddrinfo(
+                    self.host, self.port, type=socket.SOCK_DGRAM
+                )[0]
+                sock = socket.socket(family, socket.SOCK_DGRAM)
+            except OSError:
+                self.failed_at = now
+                logger.warning("Could not resolve StatsD host %s.", self.host, exc_info=True)
+                return None
+            sock.setblocking(False)
+            self.socket, self.address = sock, address
+            return sock
+
+    def format(self, name, value, kind, tags):
+        metric = f"{self.prefix}.{name}:{value}|{kind}"
+        if tags:
+            metric += "|#" + ",".join(f"{key}:{value}" for key, value in tags.items())
+        return metric
+
+    def format_timing(self, name, seconds, tags):
+        return self.format(name, f"{seconds * 1000:.3f}", "ms", tags)
+
+    def send(self, *metrics):
+        sock = self.connect()
+        if sock is None:
+            return
+        try:
+            sock.sendto("\n".join(metrics).encode(), self.address)
+        except OSError:
+            # metrics must never fail a request
+            pass
+
+    def timing(self, name, seconds, tags=None):
+        self.send(self.format_timing(name, seconds, tags))
+
+    def increment(self, name, tags=None):
+        self.send(self.format(name, 1, "c", tags))
+
+    def record(self, event, timings, reason=None):
+        tags = {"reason": reason} if reason else None
+        self.send(
+            self.format(event, 1, "c", tags),
+            *(
+                self.format_timing(f"{event}.{stage}", seconds, tags)
+                for stage, seconds in timings.items()
+            ),
+        )
+
+
+class MemoryMetricsSink(BaseMetricsSink):
+    """
+    Keeps metrics in memory, keyed by name and any tags as in
+    "rejected.total,reason=used", for tests and ad hoc profiling.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.timings = defaultdict(list)
+            self.counters = Counter()
+
+    def key(self, name, tags):
+        return name + "".join(f",{key}={value}" for key, value in sorted((tags or {}).items()))
+
+    def timing(self, name, seconds, tags=None):
+        with self.lock:
+            self.timings[self.key(name, tags)].append(seconds)
+
+    def increment(self, name, tags=None):
+        with self.lock:
+            self.counters[self.key(name, tags)] += 1
+
+    def percentile(self, name, percent):
+        """
+        The `percent`th percentile of the timings kept for `name`, by the
+        nearest rank method, or None if there are none.
+        """
+        timings = sorted(self.timings.get(name, ()))
+        if not timings:
+            return None
+        return timings[max(math.ceil(percent / 100 * len(timings)) - 1, 0)]
+
+
+@cached_until_setting_changed("AUTHLINK_METRICS_SINK", "AUTHLINK_METRICS_SINK_OPTIONS")
+def get_metrics_sink():
+    """
+    Return the process-wide metrics sink, or None unless
+    `AUTHLINK_METRICS_SINK` is set.
+    """
+    class_path = getattr(settings, "AUTHLINK_METRICS_SINK", None)
+    if not class_path:
+        return None
+    return import_attribute(class_path)(**getattr(settings, "AUTHLINK_METRICS_SINK_OPTIONS", {}))
+
+
+class Timer:
+    """
+    Times the stages of creating or consuming an authlink, then reports
+    them through the matching signal and the metrics sink.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.start = self.last = time.monotonic()
+
+    def mark(self, stage):
+        """
+        Record the time since the previous mark as that taken by `stage`.
+        """
+        now = time.monotonic()
+        self.timings[stage] = now - self.last
+        self.last = now
+
+    def send(self, event, sender, **kwargs):
+        """
+        Report the timings for `event`. Failing receivers and sinks are
+        logged rather than raised, so that reporting never fails a request.
+        """
+        self.timings["total"] = time.monotonic() - self.start
+        SIGNALS[event].send_robust(sender=sender, timings=self.timings, **kwargs)
+        self.record(event, kwargs.get("reason"))
+
+    async def asend(self, event, sender, **kwargs):
+        self.timings["total"] = time.monotonic() - self.start
+        await SIGNALS[event].asend_robust(sender=sender, timings=self.timings, **kwargs)
+        self.record(event, kwargs.get("reason"))
+
+    def record(self, event, reason):
+        sink = get_metrics_sink()
+        if sink is None:
+            return
+        try:
+            sink.record(event, self.timings, reason=reason)
+        except Exception:
+            logger.exception("Could not record authlink_%s metrics.", event)
+
+
+class NullTimer:
+    """
+    Stands in for `Timer` when nothing is listening.
+    """
+
+    def mark(self, stage):
+        pass
+
+    def send(self, event, sender, **kwargs):
+        pass
+
+    async def asend(self, event, sender, **kwargs):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def start_timer(*events):
+    """
+    Return a `Timer` if any of `events` will be reported, else `NULL_TIMER`.
+    """
+    if get_metrics_sink() is not None or any(SIGNALS[event].receivers for event in events):
+        return Timer()
+    return NULL_TIMER
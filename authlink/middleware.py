@@ -1,10 +1,11 @@
+from django.conf import settings
 from django.contrib.auth import BACKEND_SESSION_KEY
 from django.core.exceptions import ImproperlyConfigured
+from django.utils.crypto import constant_time_compare, salted_hmac
 
-from authlink.adapter import get_adapter
-
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 
-adapter = get_adapter()
+from authlink.adapter import get_adapter
 
 
 class AuthLinkWhitelistMiddleware:
@@ -12,21 +13,130 @@ class AuthLinkWhitelistMiddleware:
     Only allow access to whitelisted URLs for sessions that are
     established using the authlink authentication mechanism.
 
+    The session is only loaded for requests that could belong to such a
+    session: those with a session key, and without a marker cookie
+    vouching that their session was not established with an authlink (see
+    `AUTHLINK_SESSION_MARKER_COOKIE`).
+
+    Under ASGI it runs natively on the event loop, reading the session
+    with its async API.
+
     Note: if you want the user to be able to access everything
     then don't use this middleware!
     """
 
+    sync_capable = True
+    async_capable = True
+
+    backend = "authlink.auth_backends.AuthLinkBackend"
+    marker_salt = "authlink.middleware.AuthLinkWhitelistMiddleware"
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        self.check_session_middleware(request)
+        if self.is_authlink_session(request):
+            response = self.check_whitelist(request)
+            if response is not None:
+                return response
+        response = self.get_response(request)
+        if self.get_marker_cookie_name() and request.session.accessed:
+            self.update_marker(request, response)
+        return response
+
+    async def __acall__(self, request):
+        self.check_session_middleware(request)
+        if await self.ais_authlink_session(request):
+            response = self.check_whitelist(request)
+            if response is not None:
+                return response
+        response = await self.get_response(request)
+        # the session is loaded by now, so reading it needs no I/O
+        if self.get_marker_cookie_name() and request.session.accessed:
+            self.update_marker(request, response)
+        return response
+
+    def check_session_middleware(self, request):
         if not hasattr(request, "session"):
             raise ImproperlyConfigured(
                 "Please ensure you place AuthLinkWhitelistMiddleware "
                 "middleware after your session middlware."
             )
-        backend = request.session.get(BACKEND_SESSION_KEY)
-        if backend and backend == "authlink.auth_backends.AuthLinkBackend":
-            if not adapter.in_url_whitelist(request.path):
-                return adapter.get_whitelist_failure_response(request)
-        return self.get_response(request)
+
+    def check_whitelist(self, request):
+        """
+        Return the response refusing an authlink session access to the path
+        of `request`, or None if it is whitelisted.
+        """
+        adapter = get_adapter()
+        if not adapter.in_url_whitelist(request.path):
+            return adapter.get_whitelist_failure_response(request)
+        return None
+
+    def is_authlink_session(self, request):
+        if self.is_known_non_authlink_session(request):
+            return False
+        return request.session.get(BACKEND_SESSION_KEY) == self.backend
+
+    async def ais_authlink_session(self, request):
+        if self.is_known_non_authlink_session(request):
+            return False
+        return await request.session.aget(BACKEND_SESSION_KEY) == self.backend
+
+    def is_known_non_authlink_session(self, request):
+        """
+        Whether the session of `request` can be told not to have been
+        established with an authlink without loading it. The key is taken
+        from the session store rather than the cookie, wherever the session
+        middleware found it.
+        """
+        session_key = request.session.session_key
+        if not session_key:
+            return True
+        marker = request.COOKIES.get(self.get_marker_cookie_name() or "")
+        return bool(marker) and constant_time_compare(marker, self.get_marker(session_key))
+
+    def get_marker_cookie_name(self):
+        return getattr(settings, "AUTHLINK_SESSION_MARKER_COOKIE", None)
+
+    def get_marker(self, session_key):
+        return salted_hmac(self.marker_salt, session_key, algorithm="sha256").hexdigest()
+
+    def update_marker(self, request, response):
+        """
+        Once the session has been loaded anyway, mark it as not established
+        with an authlink, or drop the marker if it now is one. Logging in
+        with an authlink keeps the session key when the same user was
+        already logged in, so this must happen after the response.
+        """
+        name = self.get_marker_cookie_name()
+        if request.session.get(BACKEND_SESSION_KEY) == self.backend:
+            if name in request.COOKIES:
+                response.delete_cookie(
+                    name,
+                    path=settings.SESSION_COOKIE_PATH,
+                    domain=settings.SESSION_COOKIE_DOMAIN,
+                    samesite=settings.SESSION_COOKIE_SAMESITE,
+                )
+            return
+        session_key = request.session.session_key
+        if not session_key:
+            return
+        marker = self.get_marker(session_key)
+        if request.COOKIES.get(name) != marker:
+            response.set_cookie(
+                name,
+                marker,
+                max_age=settings.SESSION_COOKIE_AGE,
+                path=settings.SESSION_COOKIE_PATH,
+                domain=settings.SESSION_COOKIE_DOMAIN,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite=settings.SESSION_COOKIE_SAMESITE,
+            )
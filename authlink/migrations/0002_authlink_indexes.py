@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Creating indexes concurrently avoids locking out writes on large tables,
+# but is PostgreSQL only and cannot run inside a transaction.
+CONCURRENTLY = getattr(settings, "AUTHLINK_MIGRATIONS_CONCURRENT_INDEXES", False)
+
+if CONCURRENTLY:
+    from django.contrib.postgres.operations import AddIndexConcurrently as AddIndex
+else:
+    AddIndex = migrations.AddIndex
+
+
+class Migration(migrations.Migration):
+    atomic = not CONCURRENTLY
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("authlink", "0001_initial"),
+    ]
+
+    operations = [
+        AddIndex(
+            model_name="authlink",
+            index=models.Index(
+                condition=models.Q(used__isnull=True),
+                fields=["expires"],
+                name="authlink_unused_expires_idx",
+            ),
+        ),
+        AddIndex(
+            model_name="authlink",
+            index=models.Index(fields=["user", "created"], name="authlink_user_created_idx"),
+        ),
+    ]
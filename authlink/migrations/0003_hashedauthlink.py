@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.db import migrations, models
+
+import authlink.models
+import authlink.utils
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("authlink", "0002_authlink_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HashedAuthLink",
+            fields=[
+                ("url", models.TextField()),
+                ("ipaddress", models.GenericIPAddressField()),
+                (
+                    "created",
+                    models.DateTimeField(default=authlink.utils.get_timezone_now),
+                ),
+                ("expires", models.DateTimeField()),
+                ("used", models.DateTimeField(null=True, blank=True)),
+                (
+                    "digest",
+                    authlink.models.DigestField(max_length=32, serialize=False, primary_key=True),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(to=settings.AUTH_USER_MODEL, on_delete=models.CASCADE),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(used__isnull=True),
+                        fields=["expires"],
+                        name="hashedauthlink_unused_exp_idx",
+                    ),
+                    models.Index(fields=["user", "created"], name="hashedauthlink_user_crea_idx"),
+                ],
+            },
+        ),
+    ]
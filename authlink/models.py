@@ -1,10 +1,215 @@
 from django.conf import settings
-from django.db import models
+from django.db import connections, models, router
 
-from .utils import generate_authlink_key, get_timezone_now
+from .utils import generate_authlink_key, get_timezone_now, hash_authlink_key
 
 
-class AuthLink(models.Model):
+def supports_update_returning(connection):
+    """
+    Whether `UPDATE ... RETURNING`, or `DELETE ... RETURNING`, can be used
+    to claim an authlink in a single statement on this connection.
+    """
+    return (
+        connection.vendor in ("postgresql", "sqlite")
+        and connection.features.can_return_columns_from_insert
+    )
+
+
+class AuthLinkQuerySet(models.QuerySet):
+    def claimable(self, now):
+        return self.filter(used__isnull=True, expires__gt=now)
+
+    def claim(self, pk, now, delete=False):
+        """
+        Atomically mark the authlink identified by `pk` as used at `now`,
+        provided it is neither used nor expired, and return it. Returns
+        None when no such authlink could be claimed. With `delete`, the
+        authlink is deleted instead, and returned with `used` set all the
+        same.
+
+        The authlink is loaded as this queryset would load it, joining in
+        related objects for `select_related` and leaving out fields for
+        `only` or `defer`, though never `used`. Only an authlink this
+        queryset's own filters match can be claimed.
+        """
+        db = self._db or router.db_for_write(self.model)
+        if supports_update_returning(connections[db]):
+            authlink = self._claim_returning(db, pk, now, delete)
+        elif delete:
+            authlink = self._claim_delete(db, pk, now)
+        elif self.using(db).claimable(now).filter(pk=pk).update(used=now):
+            return self._with_used(self.using(db).get(pk=pk), now)
+        else:
+            return None
+        if delete and authlink is not None:
+            # the row was read as it was before being deleted
+            authlink.used = now
+        return authlink
+
+    async def aclaim(self, pk, now, delete=False, authlink=None):
+        """
+        Async counterpart of `claim`, made through Django's async ORM. That
+        has nothing like the raw `RETURNING` statement, so the authlink is
+        claimed by a guarded update, or delete, and read on its own unless
+        given as `authlink`, having already been read through this queryset.
+        """
+        db = self._db or router.db_for_write(self.model)
+        claimable = self.using(db).claimable(now).filter(pk=pk)
+        if delete:
+            if authlink is None:
+                authlink = await claimable.afirst()
+                if authlink is None:
+                    return None
+            deleted, _ = await claimable.adelete()
+            if not deleted:
+                return None
+        elif not await claimable.aupdate(used=now):
+            return None
+        elif authlink is None:
+            return self._with_used(await self.using(db).filter(pk=pk).afirst(), now)
+        authlink.used = now
+        return authlink
+
+    def _claim_delete(self, db, pk, now):
+        # whoever's guarded delete removes the row has claimed it
+        authlink = self.using(db).claimable(now).filter(pk=pk).first()
+        if authlink is None:
+            return None
+        deleted, _ = self.using(db).claimable(now).filter(pk=pk).delete()
+        return authlink if deleted else None
+
+    def _claim_returning(self, db, pk, now, delete=False):
+        # Directly related rows this queryset would join in with
+        # select_related are fetched by subqueries in the RETURNING clause,
+        # honouring any only() or defer(), so the claim is one statement.
+        connection = connections[db]
+        opts = self.model._meta
+        quote_name = connection.ops.quote_name
+        table = quote_name(opts.db_table)
+        used = quote_name(opts.get_field("used").column)
+        select_mask = self.query.get_select_mask()
+        # whatever only() or defer() say, the claim has just set used
+        fields = [
+            field
+            for field in opts.concrete_fields
+            if not select_mask or field in select_mask or field.primary_key or field.name == "used"
+        ]
+        columns = [f"{table}.{quote_name(field.column)}" for field in fields]
+        related = []
+        for relation in self._related_fields():
+            related_opts = relation.related_model._meta
+            related_fields = self._masked_fields(related_opts, select_mask.get(relation))
+            related_table = quote_name(related_opts.db_table)
+            columns += [
+                f"(SELECT {related_table}.{quote_name(field.column)} FROM {related_table} "
+                f"WHERE {related_table}.{quote_name(relation.target_field.column)} = "
+                f"{table}.{quote_name(relation.column)})"
+                for field in related_fields
+            ]
+            related.append((relation, related_fields))
+        if delete:
+            statement, params = "DELETE FROM {table}", [pk, now]
+        else:
+            statement, params = "UPDATE {table} SET {used} = %s", [now, pk, now]
+        params = [connection.ops.adapt_unknown_value(value) for value in params]
+        pk_column = quote_name(opts.pk.column)
+        sql = (statement + " WHERE {pk} = %s AND {used} IS NULL AND {expires} > %s").format(
+            table=table,
+            used=used,
+            pk=pk_column,
+            expires=quote_name(opts.get_field("expires").column),
+        )
+        if self.query.has_filters():
+            # filters may span relations, so apply them as a subquery
+            filtered, filtered_params = self._filtered_pks(db, pk)
+            sql += f" AND {pk_column} IN ({filtered})"
+            params += filtered_params
+        sql += " RETURNING " + ", ".join(columns)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        authlink = self._from_db(connection, db, self.model, fields, row[: len(fields)])
+        offset = len(fields)
+        for relation, related_fields in related:
+            values = row[offset : offset + len(related_fields)]
+            offset += len(related_fields)
+            if getattr(authlink, relation.attname) is not None:
+                relation.set_cached_value(
+                    authlink,
+                    self._from_db(connection, db, relation.related_model, related_fields, values),
+                )
+        return authlink
+
+    def _filtered_pks(self, db, pk):
+        query = self.using(db).filter(pk=pk).values("pk").query
+        return query.get_compiler(db).as_sql()
+
+    def _related_fields(self):
+        # only the first level of select_related, deeper ones load lazily
+        opts = self.model._meta
+        if self.query.select_related is True:
+            return [field for field in opts.concrete_fields if field.is_relation and not field.null]
+        return [opts.get_field(name) for name in self.query.select_related or ()]
+
+    @staticmethod
+    def _with_used(authlink, now):
+        # rather than leaving it for only() or defer() to load again
+        if authlink is not None and "used" in authlink.get_deferred_fields():
+            authlink.used = now
+        return authlink
+
+    @staticmethod
+    def _masked_fields(opts, select_mask):
+        return [field for field in opts.concrete_fields if not select_mask or field in select_mask]
+
+    @staticmethod
+    def _from_db(connection, db, model, fields, values):
+        converted = []
+        for field, value in zip(fields, values):
+            expression = field.get_col(model._meta.db_table)
+            converters = connection.ops.get_db_converters(expression)
+            for converter in converters + field.get_db_converters(connection):
+                value = converter(value, expression, connection)
+            converted.append(value)
+        return model.from_db(db, [field.attname for field in fields], converted)
+
+
+class DigestField(models.BinaryField):
+    """
+    A `BinaryField` of at most `max_length` bytes that can be a primary
+    key: MySQL and Oracle refuse their BLOB types, which `BinaryField`
+    otherwise uses, as keys, so it is a bounded column type there.
+    """
+
+    def db_type(self, connection):
+        if connection.vendor == "mysql":
+            return f"varbinary({self.max_length})"
+        if connection.vendor == "oracle":
+            return f"RAW({self.max_length})"
+        return super().db_type(connection)
+
+
+class AbstractAuthLink(models.Model):
+    """
+    What every stored authlink has, whatever its primary key.
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    url = models.TextField()
+    ipaddress = models.GenericIPAddressField()
+    created = models.DateTimeField(default=get_timezone_now)
+    expires = models.DateTimeField()
+    used = models.DateTimeField(null=True, blank=True)
+
+    objects = AuthLinkQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+
+class AuthLink(AbstractAuthLink):
     """
     Storage for a pre-authenticated link
     """
@@ -15,9 +220,49 @@ class AuthLink(models.Model):
         editable=False,
         max_length=getattr(settings, "AUTHLINK_KEY_LENGTH", 64),
     )
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
-    url = models.TextField()
-    ipaddress = models.GenericIPAddressField()
-    created = models.DateTimeField(default=get_timezone_now)
-    expires = models.DateTimeField()
-    used = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # live links by expiry, for purging and expiry scans
+            models.Index(
+                fields=["expires"],
+                condition=models.Q(used__isnull=True),
+                name="authlink_unused_expires_idx",
+            ),
+            # a user's links, newest last
+            models.Index(fields=["user", "created"], name="authlink_user_created_idx"),
+        ]
+
+
+class HashedAuthLink(AbstractAuthLink):
+    """
+    Storage for a pre-authenticated link keyed by a digest of its key, so
+    that neither the table nor its backups hold usable keys and the primary
+    key index stays narrow. See `HashedModelAuthLinkStorage`.
+
+    The key itself is only known when it was just generated or has been
+    looked up by, otherwise `key` is None.
+    """
+
+    digest = DigestField(primary_key=True, max_length=32)
+
+    _key = None
+
+    @property
+    def key(self):
+        return self._key
+
+    @key.setter
+    def key(self, key):
+        self._key = key
+        self.digest = hash_authlink_key(key)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["expires"],
+                condition=models.Q(used__isnull=True),
+                name="hashedauthlink_unused_exp_idx",
+            ),
+            models.Index(fields=["user", "created"], name="hashedauthlink_user_crea_idx"),
+        ]
@@ -0,0 +1,48 @@
+import time
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import AuthLink
+from .routers import get_read_database
+
+
+def get_purgeable(model=AuthLink, now=None):
+    """
+    Authlinks that can no longer be used: expired or already used.
+    """
+    now = now or timezone.now()
+    return model.objects.filter(Q(expires__lte=now) | Q(used__isnull=False))
+
+
+def purge_authlinks(batch_size=1000, sleep=0, max_runtime=None, dry_run=False, model=AuthLink):
+    """
+    Delete expired and used authlinks in primary key ordered batches of at
+    most `batch_size`, sleeping `sleep` seconds between batches and giving up
+    once `max_runtime` seconds have passed, so that no single statement holds
+    locks for long. Returns the number of authlinks deleted, or that would be
+    deleted when `dry_run` is set.
+
+    Batches are found on `AUTHLINK_READ_DATABASE`, if set, and deleted from
+    the database authlinks are written to.
+    """
+    purgeable = get_purgeable(model)
+    scan = purgeable.using(get_read_database(model))
+    if dry_run:
+        return scan.count()
+
+    deadline = time.monotonic() + max_runtime if max_runtime else None
+    deleted = 0
+    batch = scan.order_by("pk")
+    while True:
+        keys = list(batch.values_list("pk", flat=True)[:batch_size])
+        if not keys:
+            break
+        # re-check the conditions in case a link was released meanwhile
+        deleted += purgeable.filter(pk__in=keys).delete()[0]
+        if len(keys) < batch_size or (deadline and time.monotonic() >= deadline):
+            break
+        batch = scan.filter(pk__gt=keys[-1]).order_by("pk")
+        if sleep:
+            time.sleep(sleep)
+    return deleted
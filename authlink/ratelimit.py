@@ -0,0 +1,200 @@
+from collections import OrderedDict
+import math
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+from .utils import cached_until_setting_changed
+
+
+RATE_RE = re.compile(r"^(\d+)/([1-9]\d*)?([smhd])$")
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """
+    Turn a rate such as "10/m" or "100/5m" into a number of hits and a
+    period in seconds.
+    """
+    match = RATE_RE.match(rate)
+    if match is None:
+        raise ImproperlyConfigured(f"Invalid rate {rate!r}, expected e.g. '10/m' or '100/5m'.")
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * PERIODS[unit]
+
+
+class LocalRateLimitStore:
+    """
+    Keeps counters in a bounded in-process LRU, so limits apply to each
+    process separately.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def incr(self, key, timeout, delta=1):
+        """
+        Add `delta` to the counter for `key`, starting it at zero for
+        `timeout` seconds if it doesn't exist, and return its new value.
+        """
+        now = time.monotonic()
+        with self.lock:
+            value, expires_at = self.entries.get(key, (0, 0))
+            if expires_at <= now:
+                value, expires_at = 0, now + timeout
+            self.entries[key] = (value + delta, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value + delta
+
+    def get(self, key):
+        with self.lock:
+            value, expires_at = self.entries.get(key, (0, 0))
+        return value if expires_at > time.monotonic() else 0
+
+    async def aincr(self, key, timeout, delta=1):
+        return self.incr(key, timeout, delta)
+
+    async def aget(self, key):
+        return self.get(key)
+
+
+class CacheRateLimitStore:
+    """
+    Keeps counters in a Django cache, shared by every process using it,
+    relying on the atomicity of `cache.incr` as the backends for Redis and
+    Memcached provide.
+    """
+
+    def __init__(self, cache_alias):
+        self.cache_alias = cache_alias
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def incr(self, key, timeout, delta=1):
+        self.cache.add(key, 0, timeout)
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:
+            # expired between add and incr
+            self.cache.add(key, delta, timeout)
+            return delta
+
+    def get(self, key):
+        return self.cache.get(key, 0)
+
+    async def aincr(self, key, timeout, delta=1):
+        await self.cache.aadd(key, 0, timeout)
+        try:
+            return await self.cache.aincr(key, delta)
+        except ValueError:
+            await self.cache.aadd(key, delta, timeout)
+            return delta
+
+    async def aget(self, key):
+        return await self.cache.aget(key, 0)
+
+
+class RateLimiter:
+    """
+    Allows `rate` hits, e.g. "10/m", for each key over a sliding window.
+
+    The window is approximated from the counts of the current and previous
+    fixed periods, weighting the previous by how much of it still falls in
+    the window, so each hit costs one increment and at most one read.
+    Hits over the limit still count, so that clients must back off.
+    """
+
+    key_prefix = "authlink:ratelimit"
+
+    def __init__(self, rate, store):
+        self.limit, self.period = parse_rate(rate)
+        self.store = store
+
+    def windows(self, key, now):
+        period, elapsed = divmod(now, self.period)
+        return (
+            f"{self.key_prefix}:{key}:{int(period)}",
+            f"{self.key_prefix}:{key}:{int(period) - 1}",
+            elapsed / self.period,
+        )
+
+    def estimate(self, count, previous, elapsed):
+        return previous * (1 - elapsed) + count
+
+    def retry_after(self, count, previous, elapsed):
+        """
+        Seconds until another hit would be within the limit, given the counts
+        of the current and previous periods, if none are made meanwhile.
+        """
+        spare = self.limit - count - 1
+        if previous and spare >= 0:
+            # later in this period, once enough of the previous has slid out
+            wait = 1 - spare / previous - elapsed
+        else:
+            # in the next period, once enough of this one has slid out
+            wait = 1 - elapsed + max(1 - (self.limit - 1) / count, 0)
+        return max(math.ceil(wait * self.period), 1)
+
+    def check(self, key, cost=1):
+        """
+        Count `cost` hits for `key`, returning None if they are within the
+        limit, else the seconds to wait before the next one would be.
+        """
+        current, previous, elapsed = self.windows(key, time.time())
+        count = self.store.incr(current, self.period * 2, cost)
+        if count > self.limit:
+            return self.retry_after(count, 0, elapsed)
+        previous = self.store.get(previous)
+        if self.estimate(count, previous, elapsed) <= self.limit:
+            return None
+        return self.retry_after(count, previous, elapsed)
+
+    async def acheck(self, key, cost=1):
+        current, previous, elapsed = self.windows(key, time.time())
+        count = await self.store.aincr(current, self.period * 2, cost)
+        if count > self.limit:
+            return self.retry_after(count, 0, elapsed)
+        previous = await self.store.aget(previous)
+        if self.estimate(count, previous, elapsed) <= self.limit:
+            return None
+        return self.retry_after(count, previous, elapsed)
+
+    def hit(self, key):
+        """
+        Count a hit for `key`, returning whether it is within the limit.
+        """
+        return self.check(key) is None
+
+    async def ahit(self, key):
+        return await self.acheck(key) is None
+
+
+@cached_until_setting_changed(
+    "AUTHLINK_RATELIMIT_CREATE", "AUTHLINK_RATELIMIT_CONSUME", "AUTHLINK_RATELIMIT_CACHE_ALIAS"
+)
+def get_rate_limiters():
+    cache_alias = getattr(settings, "AUTHLINK_RATELIMIT_CACHE_ALIAS", None)
+    store = CacheRateLimitStore(cache_alias) if cache_alias else LocalRateLimitStore()
+    rates = {
+        "create": getattr(settings, "AUTHLINK_RATELIMIT_CREATE", None),
+        "consume": getattr(settings, "AUTHLINK_RATELIMIT_CONSUME", None),
+    }
+    return {scope: RateLimiter(rate, store) for scope, rate in rates.items() if rate}
+
+
+def get_rate_limiter(scope):
+    """
+    Return the process-wide `RateLimiter` for `scope`, "create" or
+    "consume", or None unless `AUTHLINK_RATELIMIT_<SCOPE>` is set.
+    """
+    return get_rate_limiters().get(scope)
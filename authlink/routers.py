@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.db import router
+
+
+class AuthLinkRouter:
+    """
+    Keeps the models of `authlink` on `AUTHLINK_DATABASE`, reads and writes
+    alike, and migrates them only there. Add it to `DATABASE_ROUTERS` ahead
+    of your own routers. Reads that can tolerate replication lag, such as
+    purge scans, are sent to `AUTHLINK_READ_DATABASE` by the code making
+    them instead.
+    """
+
+    app_label = "authlink"
+
+    def get_database(self):
+        return getattr(settings, "AUTHLINK_DATABASE", None)
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return self.get_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_read(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # authlinks point at users, wherever those live
+        if self.app_label in (obj1._meta.app_label, obj2._meta.app_label):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        database = self.get_database()
+        if app_label == self.app_label and database:
+            return db == database
+        return None
+
+
+def get_read_database(model):
+    """
+    The database alias to send reads of `model` that can tolerate lag to:
+    `AUTHLINK_READ_DATABASE` if set, else wherever routers send reads.
+    """
+    return getattr(settings, "AUTHLINK_READ_DATABASE", None) or router.db_for_read(model)
@@ -0,0 +1,20 @@
+from django.dispatch import Signal
+
+
+# Sent once an authlink, or a batch of them, has been created, with the
+# `request` if any, the `authlinks` and the `timings` of each stage in
+# seconds, by stage name.
+authlink_created = Signal()
+
+# Sent when an authlink has been consumed and its user logged in, with the
+# `request`, the `authlink` and the `timings`.
+authlink_consumed = Signal()
+
+# Sent when an authlink could not be consumed, with the `request`, the
+# `authlink` (None if it was never looked up), the `timings` and the
+# `reason`, one of "missing", "expired", "used", "address_mismatch" or
+# "rate_limited".
+authlink_rejected = Signal()
+
+ADDRESS_MISMATCH = "address_mismatch"
+RATE_LIMITED = "rate_limited"
@@ -0,0 +1,705 @@
+import datetime
+import logging
+import math
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.db import IntegrityError, router, transaction
+from django.utils import timezone
+
+from asgiref.sync import sync_to_async
+
+from .models import AuthLink, HashedAuthLink
+from .utils import (
+    cached_until_setting_changed,
+    generate_authlink_key,
+    hash_authlink_key,
+    import_attribute,
+    is_valid_authlink_key,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class BaseAuthLinkStorage:
+    """
+    Where authlinks are kept between creation and consumption.
+
+    Whatever the backend, authlinks are handed around as `AuthLink`
+    instances; backends other than the database simply never save them.
+    """
+
+    model = AuthLink
+
+    def build(self, **kwargs):
+        return self.model(**kwargs)
+
+    def is_valid_key(self, key):
+        """
+        Cheaply tell whether `key` could possibly be one of ours.
+        """
+        return is_valid_authlink_key(key)
+
+    def save(self, authlink):
+        raise NotImplementedError
+
+    def bulk_save(self, authlinks, batch_size=None):
+        for authlink in authlinks:
+            self.save(authlink)
+
+    def get(self, key, queryset=None):
+        """
+        Return the authlink for `key`, used or not, or None. Database backed
+        storages read it from `queryset` if given.
+        """
+        raise NotImplementedError
+
+    def peek(self, key):
+        """
+        Return the authlink for `key` as it was created, if that can be had
+        without a round trip to the database, else None. Only fields that
+        never change can be relied on, `used` being unknown.
+        """
+        return None
+
+    def delete_on_consume(self):
+        """
+        Whether claiming an authlink deletes it rather than marking it used.
+        """
+        return False
+
+    def get_database(self):
+        """
+        The database alias authlinks are written to, or None if they are
+        not kept in the database. Database backed storages also read from
+        it, wherever routers send other reads, so that a link is never
+        looked up on a replica that lags behind.
+        """
+        return router.db_for_write(self.model)
+
+    def get_manager(self):
+        return self.model.objects.db_manager(self.get_database())
+
+    def get_queryset(self):
+        """
+        The authlinks database backed storages `claim` from, by default
+        joining in the user whom the link will log in.
+        """
+        return self.get_manager().select_related("user")
+
+    def claim(self, key, now, queryset=None):
+        """
+        Atomically mark the authlink for `key` as used at `now` if it is
+        neither used nor expired and return it, else return None. Database
+        backed storages claim from `queryset` if given, else `get_queryset`.
+        """
+        raise NotImplementedError
+
+    def release(self, authlink):
+        """
+        Undo a successful `claim`.
+        """
+        raise NotImplementedError
+
+    def use(self, authlink, now):
+        """
+        Unconditionally mark an authlink as used.
+        """
+        raise NotImplementedError
+
+    # Async counterparts of the above, run in a thread unless overridden.
+
+    async def asave(self, authlink):
+        await sync_to_async(self.save)(authlink)
+
+    async def abulk_save(self, authlinks, batch_size=None):
+        await sync_to_async(self.bulk_save)(authlinks, batch_size=batch_size)
+
+    async def aget(self, key, queryset=None):
+        return await sync_to_async(self.get)(key, queryset=queryset)
+
+    async def aclaim(self, key, now, queryset=None, authlink=None):
+        """
+        Async counterpart of `claim`. Database backed storages return
+        `authlink`, the link for `key` as already read from `queryset`, if
+        given, rather than reading it again once claimed.
+        """
+        return await sync_to_async(self.claim)(key, now, queryset=queryset)
+
+    async def apeek(self, key):
+        # storages able to peek override this too, so skip the thread hop
+        return None
+
+    async def arelease(self, authlink):
+        await sync_to_async(self.release)(authlink)
+
+    async def ause(self, authlink, now):
+        await sync_to_async(self.use)(authlink, now)
+
+
+class ModelAuthLinkStorage(BaseAuthLinkStorage):
+    """
+    Keeps authlinks as rows of the `AuthLink` model.
+
+    With `AUTHLINK_DELETE_ON_CONSUME`, claiming a link deletes its row
+    instead of marking it used, so the table only ever holds live links.
+    A tombstone of its user, expiry and time of use can then be kept until
+    it would have expired, in the cache set by
+    `AUTHLINK_TOMBSTONE_CACHE_ALIAS`, for `get` to still tell a used link
+    from an unknown one. Links are deleted as loaded by the claim, so must
+    be claimed with all their fields to be released again.
+    """
+
+    tombstone_prefix = "authlink:tombstone"
+
+    def delete_on_consume(self):
+        return getattr(settings, "AUTHLINK_DELETE_ON_CONSUME", False)
+
+    @property
+    def tombstones(self):
+        alias = getattr(settings, "AUTHLINK_TOMBSTONE_CACHE_ALIAS", None)
+        return caches[alias] if alias else None
+
+    def tombstone_key(self, pk):
+        return f"{self.tombstone_prefix}:{pk}"
+
+    def to_tombstone(self, authlink):
+        if authlink.get_deferred_fields() & {"user_id", "expires"}:
+            return None, None
+        remaining = authlink.expires - authlink.used
+        timeout = max(math.ceil(remaining / datetime.timedelta(seconds=1)), 1)
+        return (authlink.user_id, authlink.expires, authlink.used), timeout
+
+    def from_tombstone(self, pk, tombstone):
+        if tombstone is None:
+            return None
+        user_id, expires, used = tombstone
+        return self.model(pk=pk, user_id=user_id, expires=expires, used=used)
+
+    def bury(self, authlink):
+        # written straight away rather than on commit, as tombstones are
+        # only read for links without a row, which a rolled back claim has
+        tombstone, timeout = self.to_tombstone(authlink)
+        if self.tombstones is None or tombstone is None:
+            return
+        try:
+            self.tombstones.set(self.tombstone_key(authlink.pk), tombstone, timeout)
+        except Exception:
+            logger.warning("Could not cache authlink tombstone.", exc_info=True)
+
+    def exhume(self, pk):
+        if self.tombstones is None:
+            return None
+        try:
+            tombstone = self.tombstones.get(self.tombstone_key(pk))
+        except Exception:
+            logger.warning("Could not read authlink tombstone.", exc_info=True)
+            return None
+        return self.from_tombstone(pk, tombstone)
+
+    def save(self, authlink):
+        authlink.save()
+
+    def bulk_save(self, authlinks, batch_size=None):
+        self.get_manager().bulk_create(authlinks, batch_size=batch_size)
+
+    def get(self, key, queryset=None):
+        if queryset is None:
+            queryset = self.get_manager()
+        try:
+            return queryset.get(pk=key)
+        except self.model.DoesNotExist:
+            return self.exhume(key)
+
+    def claim(self, key, now, queryset=None):
+        if queryset is None:
+            queryset = self.get_queryset()
+        if not self.delete_on_consume():
+            return queryset.claim(key, now)
+        authlink = queryset.claim(key, now, delete=True)
+        if authlink is not None:
+            self.bury(authlink)
+        return authlink
+
+    def release(self, authlink):
+        if self.delete_on_consume():
+            authlink.used = None
+            authlink.save(force_insert=True, using=self.get_database())
+            return
+        self.get_manager().filter(pk=authlink.pk, used=authlink.used).update(used=None)
+        authlink.used = None
+
+    def use(self, authlink, now):
+        authlink.used = now
+        if self.delete_on_consume():
+            self.get_manager().filter(pk=authlink.pk).delete()
+            self.bury(authlink)
+            return
+        authlink.save()
+
+    async def asave(self, authlink):
+        await authlink.asave()
+
+    async def abulk_save(self, authlinks, batch_size=None):
+        await self.get_manager().abulk_create(authlinks, batch_size=batch_size)
+
+    async def aget(self, key, queryset=None):
+        if queryset is None:
+            queryset = self.get_manager()
+        try:
+            return await queryset.aget(pk=key)
+        except self.model.DoesNotExist:
+            return await self.aexhume(key)
+
+    async def aexhume(self, pk):
+        if self.tombstones is None:
+            return None
+        try:
+            tombstone = await self.tombstones.aget(self.tombstone_key(pk))
+        except Exception:
+            logger.warning("Could not read authlink tombstone.", exc_info=True)
+            return None
+        return self.from_tombstone(pk, tombstone)
+
+    async def aclaim(self, key, now, queryset=None, authlink=None):
+        if queryset is None:
+            queryset = self.get_queryset()
+        if not self.delete_on_consume():
+            return await queryset.aclaim(key, now, authlink=authlink)
+        authlink = await queryset.aclaim(key, now, delete=True, authlink=authlink)
+        if authlink is not None:
+            await self.abury(authlink)
+        return authlink
+
+    async def abury(self, authlink):
+        tombstone, timeout = self.to_tombstone(authlink)
+        if self.tombstones is None or tombstone is None:
+            return
+        try:
+            await self.tombstones.aset(self.tombstone_key(authlink.pk), tombstone, timeout)
+        except Exception:
+            logger.warning("Could not cache authlink tombstone.", exc_info=True)
+
+    async def arelease(self, authlink):
+        if self.delete_on_consume():
+            authlink.used = None
+            await authlink.asave(force_insert=True, using=self.get_database())
+            return
+        await self.get_manager().filter(pk=authlink.pk, used=authlink.used).aupdate(used=None)
+        authlink.used = None
+
+    async def ause(self, authlink, now):
+        authlink.used = now
+        if self.delete_on_consume():
+            await self.get_manager().filter(pk=authlink.pk).adelete()
+            await self.abury(authlink)
+            return
+        await authlink.asave()
+
+
+class HashedModelAuthLinkStorage(ModelAuthLinkStorage):
+    """
+    Keeps authlinks as rows of the `HashedAuthLink` model, which are keyed
+    by a digest of the key rather than the key itself. Run the
+    `hash_authlinks` management command after switching to this storage to
+    bring across links created before.
+    """
+
+    model = HashedAuthLink
+
+    def build(self, **kwargs):
+        kwargs.setdefault("key", generate_authlink_key())
+        return super().build(**kwargs)
+
+    def with_key(self, authlink, key):
+        if authlink is not None:
+            authlink.key = key
+        return authlink
+
+    def tombstone_key(self, pk):
+        return super().tombstone_key(bytes(pk).hex())
+
+    def get(self, key, queryset=None):
+        return self.with_key(super().get(hash_authlink_key(key), queryset), key)
+
+    def claim(self, key, now, queryset=None):
+        return self.with_key(super().claim(hash_authlink_key(key), now, queryset), key)
+
+    async def aget(self, key, queryset=None):
+        return self.with_key(await super().aget(hash_authlink_key(key), queryset), key)
+
+    async def aclaim(self, key, now, queryset=None, authlink=None):
+        return self.with_key(
+            await super().aclaim(hash_authlink_key(key), now, queryset, authlink), key
+        )
+
+
+def hash_authlinks(batch_size=1000):
+    """
+    Move authlinks that can still be used from `AuthLink` to
+    `HashedAuthLink` in batches of at most `batch_size`, returning how many
+    were moved. Used and expired links are left for `purge_authlinks`.
+    """
+    db = router.db_for_write(AuthLink)
+    moved = 0
+    while True:
+        with transaction.atomic(using=db):
+            authlinks = list(
+                AuthLink.objects.using(db)
+                .claimable(timezone.now())
+                .select_for_update()
+                .order_by("pk")[:batch_size]
+            )
+            if not authlinks:
+                break
+            HashedAuthLink.objects.using(db).bulk_create(
+                [
+                    HashedAuthLink(
+                        key=authlink.key,
+                        **{
+                            field.attname: getattr(authlink, field.attname)
+                            for field in AuthLink._meta.concrete_fields
+                            if not field.primary_key
+                        },
+                    )
+                    for authlink in authlinks
+                ],
+                ignore_conflicts=True,
+            )
+            AuthLink.objects.using(db).filter(
+                pk__in=[authlink.pk for authlink in authlinks]
+            ).delete()
+        moved += len(authlinks)
+    return moved
+
+
+class CacheRecordsMixin:
+    """
+    Keeps the fields of authlinks that never change once they are created
+    as compact tuples in the cache set by `AUTHLINK_STORAGE_CACHE_ALIAS`,
+    for `grace_seconds` beyond their expiry.
+    """
+
+    fields = ("user_id", "url", "ipaddress", "created", "expires")
+    key_prefix = "authlink"
+    grace_seconds = 60
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, "AUTHLINK_STORAGE_CACHE_ALIAS", "default")]
+
+    def record_key(self, key):
+        return f"{self.key_prefix}:{key}"
+
+    def timeout(self, authlink, now=None):
+        remaining = authlink.expires - (now or timezone.now())
+        return max(math.ceil(remaining / datetime.timedelta(seconds=1)), 0) + self.grace_seconds
+
+    def to_record(self, authlink):
+        return tuple(getattr(authlink, field) for field in self.fields)
+
+    def from_record(self, key, record, used=None):
+        return self.build(key=key, used=used, **dict(zip(self.fields, record)))
+
+    def group_records(self, authlinks):
+        now = timezone.now()
+        grouped = {}
+        for authlink in authlinks:
+            grouped.setdefault(self.timeout(authlink, now), {})[self.record_key(authlink.key)] = (
+                self.to_record(authlink)
+            )
+        return grouped
+
+
+class CacheAuthLinkStorage(CacheRecordsMixin, BaseAuthLinkStorage):
+    """
+    Keeps authlinks in a Django cache, set by `AUTHLINK_STORAGE_CACHE_ALIAS`,
+    so that they never touch the database and expire by themselves.
+
+    Entries are kept for `grace_seconds` beyond their expiry so that expired
+    links can still be told apart from unknown ones. Claims rely on the
+    atomicity of `cache.add`, which all of Django's cache backends provide.
+    """
+
+    def get_database(self):
+        return None
+
+    def used_key(self, key):
+        return f"{self.key_prefix}:{key}:used"
+
+    def save(self, authlink):
+        # the database would enforce these, so we have to
+        authlink.clean_fields(exclude=("key", "user"))
+        if not self.cache.add(
+            self.record_key(authlink.key), self.to_record(authlink), self.timeout(authlink)
+        ):
+            raise IntegrityError(f"An authlink with key {authlink.key} already exists.")
+
+    def bulk_save(self, authlinks, batch_size=None):
+        # keys are random, so unlike `save` don't pay for an add per link
+        for timeout, records in self.group_records(authlinks).items():
+            self.cache.set_many(records, timeout)
+
+    def group_records(self, authlinks):
+        for authlink in authlinks:
+            authlink.clean_fields(exclude=("key", "user"))
+        return super().group_records(authlinks)
+
+    def get(self, key, queryset=None):
+        record_key, used_key = self.record_key(key), self.used_key(key)
+        found = self.cache.get_many([record_key, used_key])
+        if record_key not in found:
+            return None
+        return self.from_record(key, found[record_key], found.get(used_key))
+
+    def peek(self, key):
+        # a claim can't be rolled back, so the address must be checked first
+        record = self.cache.get(self.record_key(key))
+        return None if record is None else self.from_record(key, record)
+
+    def claim(self, key, now, queryset=None):
+        record = self.cache.get(self.record_key(key))
+        if record is None:
+            return None
+        authlink = self.from_record(key, record)
+        if authlink.expires <= now:
+            return None
+        if not self.cache.add(self.used_key(key), now, self.timeout(authlink, now)):
+            return None
+        authlink.used = now
+        return authlink
+
+    def release(self, authlink):
+        self.cache.delete(self.used_key(authlink.key))
+        authlink.used = None
+
+    def use(self, authlink, now):
+        self.cache.set(self.used_key(authlink.key), now, self.timeout(authlink, now))
+        authlink.used = now
+
+    async def asave(self, authlink):
+        authlink.clean_fields(exclude=("key", "user"))
+        if not await self.cache.aadd(
+            self.record_key(authlink.key), self.to_record(authlink), self.timeout(authlink)
+        ):
+            raise IntegrityError(f"An authlink with key {authlink.key} already exists.")
+
+    async def abulk_save(self, authlinks, batch_size=None):
+        for timeout, records in self.group_records(authlinks).items():
+            await self.cache.aset_many(records, timeout)
+
+    async def aget(self, key, queryset=None):
+        record_key, used_key = self.record_key(key), self.used_key(key)
+        found = await self.cache.aget_many([record_key, used_key])
+        if record_key not in found:
+            return None
+        return self.from_record(key, found[record_key], found.get(used_key))
+
+    async def apeek(self, key):
+        record = await self.cache.aget(self.record_key(key))
+        return None if record is None else self.from_record(key, record)
+
+    async def aclaim(self, key, now, queryset=None, authlink=None):
+        record = await self.cache.aget(self.record_key(key))
+        if record is None:
+            return None
+        authlink = self.from_record(key, record)
+        if authlink.expires <= now:
+            return None
+        if not await self.cache.aadd(self.used_key(key), now, self.timeout(authlink, now)):
+            return None
+        authlink.used = now
+        return authlink
+
+    async def arelease(self, authlink):
+        await self.cache.adelete(self.used_key(authlink.key))
+        authlink.used = None
+
+    async def ause(self, authlink, now):
+        await self.cache.aset(self.used_key(authlink.key), now, self.timeout(authlink, now))
+        authlink.used = now
+
+
+class SignedAuthLinkStorage(CacheAuthLinkStorage):
+    """
+    Stores nothing up front: the key handed out is itself a signed payload
+    of the user, url, IP address and expiry, so validating it needs no
+    lookup at all. Single use is enforced by remembering, in the cache set
+    by `AUTHLINK_STORAGE_CACHE_ALIAS`, which tokens have been used until
+    they expire.
+
+    Keys contain `.`, `:` and `-` as well as word characters, which your URL
+    pattern must allow.
+    """
+
+    salt = "authlink.storage.SignedAuthLinkStorage"
+    grace_seconds = 0
+    max_key_length = 2048
+
+    @property
+    def signer(self):
+        return signing.Signer(salt=self.salt)
+
+    def is_valid_key(self, key):
+        return len(key) <= self.max_key_length and self.signer.sep in key
+
+    def used_key(self, key):
+        # the signature is unique to the token and a fraction of its length
+        return f"{self.key_prefix}:{key.rsplit(self.signer.sep, 1)[-1]}:used"
+
+    def save(self, authlink):
+        authlink.clean_fields(exclude=("key", "user"))
+        authlink.expires = authlink.expires.replace(microsecond=0)
+        authlink.key = self.signer.sign_object(
+            [
+                str(authlink.user_id),
+                authlink.url,
+                authlink.ipaddress,
+                int(authlink.expires.timestamp()),
+                # distinguishes otherwise identical links
+                secrets.token_urlsafe(6),
+            ],
+            compress=True,
+        )
+
+    def unsign(self, key):
+        try:
+            user_id, url, ipaddress, expires, _ = self.signer.unsign_object(key)
+        except (signing.BadSignature, ValueError):
+            return None
+        return self.build(
+            key=key,
+            user_id=self.model._meta.get_field("user").to_python(user_id),
+            url=url,
+            ipaddress=ipaddress,
+            expires=datetime.datetime.fromtimestamp(expires, tz=datetime.timezone.utc),
+        )
+
+    def get(self, key, queryset=None):
+        authlink = self.unsign(key)
+        if authlink is not None:
+            authlink.used = self.cache.get(self.used_key(key))
+        return authlink
+
+    def peek(self, key):
+        return self.unsign(key)
+
+    def claim(self, key, now, queryset=None):
+        authlink = self.unsign(key)
+        if authlink is None or authlink.expires <= now:
+            return None
+        if not self.cache.add(self.used_key(key), now, self.timeout(authlink, now)):
+            return None
+        authlink.used = now
+        return authlink
+
+    def bulk_save(self, authlinks, batch_size=None):
+        for authlink in authlinks:
+            self.save(authlink)
+
+    async def asave(self, authlink):
+        self.save(authlink)
+
+    async def abulk_save(self, authlinks, batch_size=None):
+        self.bulk_save(authlinks)
+
+    async def aget(self, key, queryset=None):
+        authlink = self.unsign(key)
+        if authlink is not None:
+            authlink.used = await self.cache.aget(self.used_key(key))
+        return authlink
+
+    async def apeek(self, key):
+        return self.unsign(key)
+
+    async def aclaim(self, key, now, queryset=None, authlink=None):
+        authlink = self.unsign(key)
+        if authlink is None or authlink.expires <= now:
+            return None
+        if not await self.cache.aadd(self.used_key(key), now, self.timeout(authlink, now)):
+            return None
+        authlink.used = now
+        return authlink
+
+
+class CachedModelAuthLinkStorage(CacheRecordsMixin, ModelAuthLinkStorage):
+    """
+    `ModelAuthLinkStorage` writing a snapshot of each authlink through to
+    the cache set by `AUTHLINK_STORAGE_CACHE_ALIAS` once it is committed, so
+    that consuming it can turn away expired links and mismatched IP
+    addresses, and tell a failed claim was for a used link, without reading
+    it from the database. Only the claim itself always goes to the database.
+
+    Snapshots hold only the fields that never change once a link is
+    created, never whether it has been used. Changes made to a link in the
+    database afterwards, such as to its expiry, go unseen until its snapshot
+    expires `grace_seconds` after the link. Should the cache fail, links are
+    consumed from the database alone.
+    """
+
+    key_prefix = "authlink:snapshot"
+
+    def save(self, authlink):
+        super().save(authlink)
+        self.cache_on_commit([authlink])
+
+    def bulk_save(self, authlinks, batch_size=None):
+        super().bulk_save(authlinks, batch_size=batch_size)
+        self.cache_on_commit(authlinks)
+
+    def cache_on_commit(self, authlinks):
+        # a snapshot of a link rolled back would be mistaken for a used one
+        transaction.on_commit(lambda: self.cache_records(authlinks), using=self.get_database())
+
+    def cache_records(self, authlinks):
+        try:
+            for timeout, records in self.group_records(authlinks).items():
+                self.cache.set_many(records, timeout)
+        except Exception:
+            logger.warning("Could not cache authlink snapshots.", exc_info=True)
+
+    def peek(self, key):
+        try:
+            record = self.cache.get(self.record_key(key))
+        except Exception:
+            logger.warning("Could not read authlink snapshot.", exc_info=True)
+            return None
+        return None if record is None else self.from_record(key, record)
+
+    # Django has no async transactions, so snapshots are written straight away
+
+    async def asave(self, authlink):
+        await super().asave(authlink)
+        await self.acache_records([authlink])
+
+    async def abulk_save(self, authlinks, batch_size=None):
+        await super().abulk_save(authlinks, batch_size=batch_size)
+        await self.acache_records(authlinks)
+
+    async def acache_records(self, authlinks):
+        try:
+            for timeout, records in self.group_records(authlinks).items():
+                await self.cache.aset_many(records, timeout)
+        except Exception:
+            logger.warning("Could not cache authlink snapshots.", exc_info=True)
+
+    async def apeek(self, key):
+        try:
+            record = await self.cache.aget(self.record_key(key))
+        except Exception:
+            logger.warning("Could not read authlink snapshot.", exc_info=True)
+            return None
+        return None if record is None else self.from_record(key, record)
+
+
+@cached_until_setting_changed("AUTHLINK_STORAGE_CLASS")
+def get_storage():
+    """
+    Return the process-wide storage backend set by `AUTHLINK_STORAGE_CLASS`.
+    """
+    return import_attribute(
+        getattr(settings, "AUTHLINK_STORAGE_CLASS", "authlink.storage.ModelAuthLinkStorage")
+    )()
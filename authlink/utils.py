@@ -1,8 +1,14 @@
+import functools
+import hashlib
+import importlib
+import ipaddress
+import os
 import string
+import threading
 
 from django.conf import settings
+from django.core.signals import setting_changed
 from django.utils import timezone
-from django.utils.crypto import get_random_string
 
 
 # we use this so we can easily mock timezone.now() on model fields
@@ -12,8 +18,179 @@ def get_timezone_now():
     return timezone.now()
 
 
+def import_attribute(path):
+    pkg, attr = path.rsplit(".", 1)
+    return getattr(importlib.import_module(pkg), attr)
+
+
+def cached_until_setting_changed(*setting_names):
+    """
+    Cache the result of a no-argument factory for the life of the process,
+    throwing it away when any of `setting_names` change.
+    """
+
+    def decorator(factory):
+        cache = {}
+        lock = threading.Lock()
+
+        @functools.wraps(factory)
+        def wrapper():
+            try:
+                return cache["value"]
+            except KeyError:
+                with lock:
+                    if "value" not in cache:
+                        cache["value"] = factory()
+                    return cache["value"]
+
+        def reset(*, setting, **kwargs):
+            if setting in setting_names:
+                cache.clear()
+
+        setting_changed.connect(reset, weak=False)
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
+
+
 VALID_KEY_CHARS = string.ascii_lowercase + string.digits
+VALID_KEY_CHARSET = frozenset(VALID_KEY_CHARS)
+
+# Random bytes are mapped onto VALID_KEY_CHARS modulo its length, discarding
+# the bytes at the top of the range that would otherwise favour some
+# characters, so each character is exactly as likely as with secrets.choice.
+KEY_BYTE_LIMIT = 256 - 256 % len(VALID_KEY_CHARS)
+KEY_BYTE_TABLE = bytes(ord(VALID_KEY_CHARS[b % len(VALID_KEY_CHARS)]) for b in range(256))
+KEY_BYTE_REJECTS = bytes(range(KEY_BYTE_LIMIT, 256))
+
+
+def random_authlink_keys(count, length=None):
+    """
+    Generate `count` random keys of `length` characters from as few reads
+    of the OS random number generator as possible.
+    """
+    length = length or getattr(settings, "AUTHLINK_KEY_LENGTH", 64)
+    needed = count * length
+    chars = bytearray()
+    while len(chars) < needed:
+        missing = needed - len(chars)
+        # over-read slightly so a second read is rarely needed
+        block = os.urandom(missing + missing // 32 + 16)
+        chars += block.translate(KEY_BYTE_TABLE, KEY_BYTE_REJECTS)
+    return [chars[i : i + length].decode("ascii") for i in range(0, needed, length)]
+
+
+class KeyPool:
+    """
+    Thread-safe pool of keys generated `size` at a time, so that creating a
+    link rarely needs to read from the OS random number generator at all.
+
+    The pool is discarded in forked children, which must never hand out the
+    same keys as their parent.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.keys = []
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def get_many(self, count):
+        if count <= 0:
+            # as keys[-0:] would be the whole pool
+            return []
+        with self.lock:
+            if self.pid != os.getpid():
+                self.keys, self.pid = [], os.getpid()
+            if len(self.keys) < count:
+                self.keys += random_authlink_keys(max(self.size, count - len(self.keys)))
+            keys, self.keys = self.keys[-count:], self.keys[:-count]
+            return keys
+
+    def get(self):
+        return self.get_many(1)[0]
+
+
+@cached_until_setting_changed("AUTHLINK_KEY_GENERATOR")
+def get_key_generator():
+    """
+    Return the function set by `AUTHLINK_KEY_GENERATOR`, or None.
+    """
+    generator = getattr(settings, "AUTHLINK_KEY_GENERATOR", None)
+    return import_attribute(generator) if generator else None
+
+
+@cached_until_setting_changed(
+    "AUTHLINK_KEY_GENERATOR", "AUTHLINK_KEY_POOL_SIZE", "AUTHLINK_KEY_LENGTH"
+)
+def get_key_pool():
+    """
+    Return the process-wide `KeyPool`, or None unless `AUTHLINK_KEY_POOL_SIZE`
+    is set and no `AUTHLINK_KEY_GENERATOR` replaces the built-in generator.
+    """
+    size = getattr(settings, "AUTHLINK_KEY_POOL_SIZE", 0)
+    if size and not getattr(settings, "AUTHLINK_KEY_GENERATOR", None):
+        return KeyPool(size)
+    return None
+
+
+def generate_authlink_keys(count):
+    """
+    Generate `count` keys at once, using `AUTHLINK_KEY_GENERATOR` if set.
+    """
+    generator = get_key_generator()
+    if generator is not None:
+        return [generator() for _ in range(count)]
+    pool = get_key_pool()
+    if pool is not None:
+        return pool.get_many(count)
+    return random_authlink_keys(count)
 
 
 def generate_authlink_key():
-    return get_random_string(getattr(settings, "AUTHLINK_KEY_LENGTH", 64), VALID_KEY_CHARS)
+    return generate_authlink_keys(1)[0]
+
+
+def is_valid_authlink_key(key):
+    """
+    Whether `key` could have come from `generate_authlink_key`.
+    """
+    length = getattr(settings, "AUTHLINK_KEY_LENGTH", 64)
+    if getattr(settings, "AUTHLINK_KEY_GENERATOR", None):
+        return 0 < len(key) <= length
+    return len(key) == length and set(key) <= VALID_KEY_CHARSET
+
+
+def hash_authlink_key(key):
+    """
+    The digest `HashedAuthLink` stores in place of `key`: its SHA-256,
+    truncated to `AUTHLINK_KEY_DIGEST_SIZE` bytes. Keys are long and
+    random, so a fast unsalted hash is all that's needed.
+    """
+    return hashlib.sha256(key.encode()).digest()[
+        : getattr(settings, "AUTHLINK_KEY_DIGEST_SIZE", 32)
+    ]
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_ipaddress(value):
+    """
+    Parse `value` into an IPv4 or IPv6 address, unwrapping IPv4-mapped IPv6
+    addresses, or return None if it is not one. Memoised, as the same
+    addresses are compared over and over.
+    """
+    try:
+        address = ipaddress.ip_address(value)
+    except ValueError:
+        return None
+    return getattr(address, "ipv4_mapped", None) or address
+
+
+def normalize_ipaddress(value):
+    """
+    The canonical form of the IP address `value`, so that equal addresses
+    are stored alike, or `value` itself if it is not one.
+    """
+    address = parse_ipaddress(value)
+    return str(address) if address else value
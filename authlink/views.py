@@ -1,55 +1,184 @@
+from contextlib import nullcontext
+
 from django.conf import settings
 from django.db import transaction
-from django.http import HttpResponseRedirect
-from django.shortcuts import get_object_or_404
+from django.http import Http404, HttpResponse, HttpResponseRedirect
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import View
 
 from .adapter import get_adapter
-from .models import AuthLink
+from .filters import KeyFilter
+from .metrics import NULL_TIMER, start_timer
+from .signals import ADDRESS_MISMATCH, RATE_LIMITED
 
 
 class AuthLinkView(View):
     """
     An endpoint that can be used to consume an
     authenticated link.
+
+    Each stage is timed and reported through the `authlink_consumed` and
+    `authlink_rejected` signals and the metrics sink, if anything is
+    listening.
     """
 
-    @transaction.atomic
+    timer = NULL_TIMER
+
+    def dispatch(self, request, *args, **kwargs):
+        self.timer = start_timer("consumed", "rejected")
+        return super().dispatch(request, *args, **kwargs)
+
     def get(self, request, key):
-        authlink = get_object_or_404(AuthLink, key=key)
         adapter = get_adapter()
-        if adapter.is_expired(authlink):
-            return self.on_expired(request, authlink)
+        retry_after = adapter.check_rate_limit(request, "consume")
+        if retry_after is not None:
+            self.rejected(request, RATE_LIMITED)
+            return self.on_rate_limited(request, retry_after)
+        rejection = adapter.check_key(key)
+        self.timer.mark("check")
+        if rejection is not None:
+            self.rejected(request, rejection)
+            return self.on_rejected_key(request, key, rejection)
+        return self.consume(request, key)
 
-        if adapter.is_used(authlink):
-            return self.on_used(request, authlink)
+    def consume(self, request, key):
+        adapter = get_adapter()
+        snapshot = adapter.peek(key)
+        if snapshot is not None:
+            response = self.check_snapshot(request, key, snapshot)
+            if response is not None:
+                return response
+        using = adapter.get_database()
+        # storages outside the database have no transaction to claim within
+        with nullcontext() if using is None else transaction.atomic(using=using):
+            authlink = adapter.claim(key, queryset=self.get_queryset())
+            self.timer.mark("claim")
+            if authlink is None:
+                return self.on_claim_failure(request, key, snapshot)
+
+            response = self.check_claimed(request, authlink)
+            if response is not None:
+                return response
+            self.timer.mark("ipaddress")
 
+            if request.user.is_authenticated:
+                if request.user.pk != authlink.user_id:
+                    adapter.logout(request)
+
+            adapter.login(request, authlink)
+            self.timer.mark("login")
+            if using is None:
+                adapter.remember_key(key, KeyFilter.USED, authlink)
+            else:
+                transaction.on_commit(
+                    lambda: adapter.remember_key(key, KeyFilter.USED, authlink), using=using
+                )
+        # only once committed, so that no receiver can undo the claim, as a
+        # failed query would even when the exception itself is swallowed
+        self.timer.send("consumed", type(self), request=request, authlink=authlink)
+        return self.on_success(request, authlink)
+
+    def get_queryset(self):
+        """
+        The authlinks to consume from, if they are kept in the database.
+        """
+        return get_adapter().get_queryset()
+
+    def check_claimed(self, request, authlink):
+        """
+        Release the claimed `authlink` and turn it away if it is used from
+        the wrong address, or if the adapter's `is_expired` finds it expired
+        though the claim did not, as an override can be stricter.
+        """
+        adapter = get_adapter()
+        if adapter.is_expired(authlink):
+            adapter.release(authlink)
+            adapter.remember_key(authlink.key, KeyFilter.EXPIRED, authlink)
+            self.rejected(request, KeyFilter.EXPIRED, authlink)
+            return self.on_expired(request, authlink)
         if not adapter.ipaddress_matches(request, authlink):
+            adapter.release(authlink)
+            self.rejected(request, ADDRESS_MISMATCH, authlink)
             return self.on_address_mismatch(request, authlink)
+        return None
 
-        if request.user.is_authenticated:
-            if request.user != authlink.user:
-                adapter.logout(request)
+    def check_snapshot(self, request, key, snapshot):
+        """
+        Turn the link away, without claiming it, if its `snapshot` from
+        `peek` shows it has expired or is used from the wrong address.
+        """
+        adapter = get_adapter()
+        rejection = adapter.check_snapshot(request, snapshot)
+        self.timer.mark("peek")
+        if rejection == KeyFilter.EXPIRED:
+            adapter.remember_key(key, KeyFilter.EXPIRED, snapshot)
+            self.rejected(request, KeyFilter.EXPIRED, snapshot)
+            return self.on_expired(request, snapshot)
+        if rejection == ADDRESS_MISMATCH:
+            self.rejected(request, ADDRESS_MISMATCH, snapshot)
+            return self.on_address_mismatch(request, snapshot)
+        return None
 
-        adapter.use(authlink)
-        adapter.login(request, authlink)
-        return self.on_success(request, authlink)
+    def on_claim_failure(self, request, key, snapshot=None):
+        """
+        The link could not be claimed; only now read it back to find out
+        why, unless its `snapshot` already shows it exists.
+        """
+        adapter = get_adapter()
+        authlink = snapshot if snapshot is not None else adapter.get_authlink(key)
+        self.timer.mark("lookup")
+        if authlink is None:
+            adapter.remember_key(key, KeyFilter.MISSING)
+            self.rejected(request, KeyFilter.MISSING)
+            raise Http404("No AuthLink matches the given query.")
+        if adapter.is_expired(authlink):
+            adapter.remember_key(key, KeyFilter.EXPIRED, authlink)
+            self.rejected(request, KeyFilter.EXPIRED, authlink)
+            return self.on_expired(request, authlink)
+        # either already used, or claimed by a concurrent request that may
+        # yet release it, so only remember it once it's definitely used
+        if adapter.is_used(authlink):
+            adapter.remember_key(key, KeyFilter.USED, authlink)
+        self.rejected(request, KeyFilter.USED, authlink)
+        return self.on_used(request, authlink)
+
+    def on_rejected_key(self, request, key, reason):
+        """
+        The key was turned away without being looked up. The `authlink`
+        passed on to the handlers below is None in this case.
+        """
+        if reason == KeyFilter.EXPIRED:
+            return self.on_expired(request, None)
+        if reason == KeyFilter.USED:
+            return self.on_used(request, None)
+        raise Http404("No AuthLink matches the given query.")
+
+    def rejected(self, request, reason, authlink=None):
+        self.timer.send("rejected", type(self), request=request, authlink=authlink, reason=reason)
 
     def on_expired(self, request, authlink):
-        get_adapter().error(request, _("Link has expired."))
-        return self.on_non_success(request, authlink)
+        return self.on_failure(request, authlink, KeyFilter.EXPIRED, _("Link has expired."))
 
     def on_used(self, request, authlink):
-        get_adapter().error(request, _("Link has already been used."))
-        return self.on_non_success(request, authlink)
+        return self.on_failure(request, authlink, KeyFilter.USED, _("Link has already been used."))
 
     def on_address_mismatch(self, request, authlink):
-        get_adapter().error(
+        return self.on_failure(
             request,
+            authlink,
+            ADDRESS_MISMATCH,
             _("Mismatch between generation IP address and consumption IP address."),
         )
-        return self.on_non_success(request, authlink)
+
+    def on_failure(self, request, authlink, reason, message):
+        return get_adapter().report_failure(
+            request, self.on_non_success(request, authlink), reason, message
+        )
+
+    def on_rate_limited(self, request, retry_after):
+        return HttpResponse(
+            _("Too many requests."), status=429, headers={"Retry-After": str(retry_after)}
+        )
 
     def on_non_success(self, request, authlink):
         return HttpResponseRedirect(
@@ -58,3 +187,114 @@ class AuthLinkView(View):
 
     def on_success(self, request, authlink):
         return HttpResponseRedirect(authlink.url, status=301)
+
+
+class AsyncAuthLinkView(AuthLinkView):
+    """
+    `AuthLinkView` for ASGI deployments, consuming the link through the
+    async ORM. Claiming is atomic by itself, but there's no transaction to
+    roll a claim back in, so the link is checked before it is claimed.
+    """
+
+    async def get(self, request, key):
+        adapter = get_adapter()
+        retry_after = await adapter.acheck_rate_limit(request, "consume")
+        if retry_after is not None:
+            await self.arejected(request, RATE_LIMITED)
+            return self.on_rate_limited(request, retry_after)
+        rejection = await adapter.acheck_key(key)
+        self.timer.mark("check")
+        if rejection is not None:
+            await self.arejected(request, rejection)
+            return self.on_rejected_key(request, key, rejection)
+
+        queryset = self.get_queryset()
+        snapshot = await self.apeek(key, queryset)
+        if snapshot is None:
+            # missing, or left out of the queryset, so it can't be claimed
+            return await self.aon_claim_failure(request, key)
+        response = await self.acheck_snapshot(request, key, snapshot)
+        if response is not None:
+            return response
+
+        authlink = await adapter.aclaim(key, queryset=queryset, authlink=snapshot)
+        self.timer.mark("claim")
+        if authlink is None:
+            return await self.aon_claim_failure(request, key, snapshot)
+
+        response = await self.acheck_claimed(request, authlink)
+        if response is not None:
+            return response
+        self.timer.mark("ipaddress")
+
+        user = await request.auser()
+        if user.is_authenticated:
+            if user.pk != authlink.user_id:
+                await adapter.alogout(request)
+
+        await adapter.alogin(request, authlink)
+        self.timer.mark("login")
+        await self.timer.asend("consumed", type(self), request=request, authlink=authlink)
+        await adapter.aremember_key(key, KeyFilter.USED, authlink)
+        return self.on_success(request, authlink)
+
+    async def apeek(self, key, queryset=None):
+        """
+        The link for `key` to check before claiming it: its snapshot, else
+        the link itself as read from `queryset`, which the claim then
+        returns. A claim from the wrong address would otherwise make the
+        link look used to its owner until it was released again.
+        """
+        adapter = get_adapter()
+        snapshot = await adapter.apeek(key, queryset)
+        if snapshot is None:
+            snapshot = await adapter.aget_authlink(key, queryset)
+        return snapshot
+
+    async def acheck_claimed(self, request, authlink):
+        adapter = get_adapter()
+        if await adapter.ais_expired(authlink):
+            await adapter.arelease(authlink)
+            await adapter.aremember_key(authlink.key, KeyFilter.EXPIRED, authlink)
+            await self.arejected(request, KeyFilter.EXPIRED, authlink)
+            return self.on_expired(request, authlink)
+        if not await adapter.aipaddress_matches(request, authlink):
+            await adapter.arelease(authlink)
+            await self.arejected(request, ADDRESS_MISMATCH, authlink)
+            return self.on_address_mismatch(request, authlink)
+        return None
+
+    async def acheck_snapshot(self, request, key, snapshot):
+        adapter = get_adapter()
+        rejection = await adapter.acheck_snapshot(request, snapshot)
+        self.timer.mark("peek")
+        if rejection == KeyFilter.EXPIRED:
+            await adapter.aremember_key(key, KeyFilter.EXPIRED, snapshot)
+            await self.arejected(request, KeyFilter.EXPIRED, snapshot)
+            return self.on_expired(request, snapshot)
+        if rejection == ADDRESS_MISMATCH:
+            await self.arejected(request, ADDRESS_MISMATCH, snapshot)
+            return self.on_address_mismatch(request, snapshot)
+        return None
+
+    async def aon_claim_failure(self, request, key, snapshot=None):
+        adapter = get_adapter()
+        authlink = snapshot if snapshot is not None else await adapter.aget_authlink(key)
+        self.timer.mark("lookup")
+        if authlink is None:
+            await adapter.aremember_key(key, KeyFilter.MISSING)
+            await self.arejected(request, KeyFilter.MISSING)
+            raise Http404("No AuthLink matches the given query.")
+        if await adapter.ais_expired(authlink):
+            await adapter.aremember_key(key, KeyFilter.EXPIRED, authlink)
+            await self.arejected(request, KeyFilter.EXPIRED, authlink)
+            return self.on_expired(request, authlink)
+        if await adapter.ais_used(authlink):
+            await adapter.aremember_key(key, KeyFilter.USED, authlink)
+        await self.arejected(request, KeyFilter.USED, authlink)
+        return self.on_used(request, authlink)
+
+    async def arejected(self, request, reason, authlink=None):
+        await self.timer.asend(
+            "rejected", type(self), request=request, authlink=authlink, reason=reason
+        )
@@ -0,0 +1,58 @@
+import functools
+import re
+
+from django.conf import settings
+
+from .utils import cached_until_setting_changed
+
+
+# numbered backreferences and conditionals change meaning once a pattern is
+# embedded in a larger alternation, as do leading global flags such as (?i)
+UNCOMBINABLE_RE = re.compile(r"\\[1-9]|\(\?\(|^\(\?[aiLmsux]+\)")
+
+
+class UrlWhitelist:
+    """
+    Matches URLs against a list of regular expressions, as `re.match` would
+    for each in turn, but with the patterns compiled once into a single
+    alternation and recent decisions remembered in an LRU cache.
+    """
+
+    def __init__(self, patterns, cache_size=256):
+        self.patterns = tuple(patterns)
+        self.matchers = self.compile(self.patterns)
+        self.match = functools.lru_cache(maxsize=cache_size)(self._match)
+
+    @staticmethod
+    def compile(patterns):
+        compiled = [re.compile(pattern) for pattern in patterns]
+        combinable = [
+            pattern
+            for pattern in patterns
+            if isinstance(pattern, str) and not UNCOMBINABLE_RE.search(pattern)
+        ]
+        if len(combinable) < 2:
+            return tuple(compiled)
+        try:
+            combined = re.compile("|".join(f"(?:{pattern})" for pattern in combinable))
+        except re.error:
+            # e.g. named groups repeated across patterns
+            return tuple(compiled)
+        return (combined,) + tuple(
+            matcher for pattern, matcher in zip(patterns, compiled) if pattern not in combinable
+        )
+
+    def _match(self, url):
+        return any(matcher.match(url) for matcher in self.matchers)
+
+
+@cached_until_setting_changed("AUTHLINK_URL_WHITELIST", "AUTHLINK_URL_WHITELIST_CACHE_SIZE")
+def get_url_whitelist():
+    """
+    Return the `UrlWhitelist` for `AUTHLINK_URL_WHITELIST`, compiling it on
+    first use only.
+    """
+    return UrlWhitelist(
+        getattr(settings, "AUTHLINK_URL_WHITELIST", []),
+        cache_size=getattr(settings, "AUTHLINK_URL_WHITELIST_CACHE_SIZE", 256),
+    )
@@ -0,0 +1,264 @@
+import datetime
+import json
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from authlink.models import AuthLink
+from authlink.utils import generate_authlink_key, generate_authlink_keys
+
+
+IPADDRESS = "201.21.121.1"
+TEST_URL = "/very/specific/url/"
+WHITELIST_MIDDLEWARE = "authlink.middleware.AuthLinkWhitelistMiddleware"
+
+
+class Benchmark:
+    """
+    One hot path to time. `setup` runs once, `prepare` before each timed
+    call of `run`, which is given what `prepare` returned.
+    """
+
+    name = None
+
+    def get_settings(self):
+        return {
+            "PASSWORD_HASHERS": ["django.contrib.auth.hashers.MD5PasswordHasher"],
+            "AUTHLINK_URL_WHITELIST": [TEST_URL],
+        }
+
+    def enable(self):
+        self.override = override_settings(**self.get_settings())
+        self.override.enable()
+        self.setup()
+
+    def disable(self):
+        self.override.disable()
+
+    def setup(self):
+        self.user, _ = get_user_model().objects.get_or_create(username="bench")
+
+    def prepare(self):
+        return None
+
+    def run(self, prepared):
+        raise NotImplementedError
+
+    def create_authlink(self, expires_in=60, **kwargs):
+        now = timezone.now()
+        return AuthLink.objects.create(
+            user=self.user,
+            ipaddress=IPADDRESS,
+            expires=now + datetime.timedelta(seconds=expires_in),
+            url=TEST_URL,
+            **kwargs,
+        )
+
+
+class ConsumeBenchmark(Benchmark):
+    name = "consume_success"
+    ipaddress = IPADDRESS
+    status_code = 301
+
+    def prepare(self):
+        return reverse("authlink_use", kwargs={"key": self.get_key()})
+
+    def get_key(self):
+        return self.create_authlink().key
+
+    def run(self, url):
+        response = Client().get(url, REMOTE_ADDR=self.ipaddress)
+        assert response.status_code == self.status_code, response.status_code
+
+
+class AsyncConsumeBenchmark(ConsumeBenchmark):
+    name = "async_consume_success"
+
+    def prepare(self):
+        return reverse("async_authlink_use", kwargs={"key": self.get_key()})
+
+
+class ConsumeExpiredBenchmark(ConsumeBenchmark):
+    name = "consume_expired"
+
+    def get_key(self):
+        return self.create_authlink(expires_in=-1).key
+
+
+class ConsumeUsedBenchmark(ConsumeBenchmark):
+    name = "consume_used"
+
+    def setup(self):
+        super().setup()
+        self.key = self.create_authlink(used=timezone.now()).key
+
+    def get_key(self):
+        return self.key
+
+
+class ConsumeMissingBenchmark(ConsumeBenchmark):
+    name = "consume_missing"
+    status_code = 404
+
+    def get_key(self):
+        return generate_authlink_key()
+
+
+class ConsumeMalformedBenchmark(ConsumeMissingBenchmark):
+    name = "consume_malformed"
+
+    def get_key(self):
+        return "not-a-key"
+
+
+class ConsumeAddressMismatchBenchmark(ConsumeUsedBenchmark):
+    name = "consume_address_mismatch"
+    ipaddress = "201.21.121.2"
+
+    def setup(self):
+        # mismatches release the link, so one will do
+        Benchmark.setup(self)
+        self.key = self.create_authlink().key
+
+
+class CreateBenchmark(Benchmark):
+    name = "create_json"
+    url_name = "authlink_generate_json"
+    data = {"url": TEST_URL}
+
+    def setup(self):
+        super().setup()
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def run(self, prepared):
+        response = self.client.post(
+            reverse(self.url_name),
+            data=json.dumps(self.data),
+            content_type="application/json",
+            REMOTE_ADDR=IPADDRESS,
+        )
+        assert response.status_code == 201, response.status_code
+
+
+class BulkCreateBenchmark(CreateBenchmark):
+    name = "bulk_create_json_10"
+    url_name = "authlink_bulk_generate_json"
+    data = {"urls": [TEST_URL] * 10}
+
+
+class CreateRestFrameworkBenchmark(CreateBenchmark):
+    name = "create_rest_framework"
+    url_name = "authlink_generate"
+
+    def setup(self):
+        Benchmark.setup(self)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+
+class MiddlewareBenchmark(Benchmark):
+    """
+    A request from a session established by an authlink, through
+    `AuthLinkWhitelistMiddleware`, to the last of the whitelisted URLs.
+    """
+
+    name = "middleware_small_whitelist"
+    whitelist_size = 3
+    whitelist_cache_size = 256
+
+    def get_settings(self):
+        whitelist = [rf"^/other/{i}/(?P<pk>\d+)/$" for i in range(self.whitelist_size - 1)]
+        return {
+            **super().get_settings(),
+            "MIDDLEWARE": settings.MIDDLEWARE + (WHITELIST_MIDDLEWARE,),
+            "AUTHLINK_URL_WHITELIST": whitelist + [r"^/authenticatedview/$"],
+            "AUTHLINK_URL_WHITELIST_CACHE_SIZE": self.whitelist_cache_size,
+        }
+
+    def setup(self):
+        super().setup()
+        self.client = Client()
+        key = self.create_authlink().key
+        self.client.get(reverse("authlink_use", kwargs={"key": key}), REMOTE_ADDR=IPADDRESS)
+
+    def run(self, prepared):
+        response = self.client.get("/authenticatedview/")
+        assert response.status_code == 200, response.status_code
+
+
+class LargeWhitelistMiddlewareBenchmark(MiddlewareBenchmark):
+    name = "middleware_large_whitelist"
+    whitelist_size = 500
+
+
+class LargeWhitelistUncachedMiddlewareBenchmark(LargeWhitelistMiddlewareBenchmark):
+    name = "middleware_large_whitelist_uncached"
+    whitelist_cache_size = 0
+
+
+class MarkedSessionMiddlewareBenchmark(MiddlewareBenchmark):
+    """
+    A request from a session established by password, carrying the cookie
+    marking it as such, through `AuthLinkWhitelistMiddleware` to a view
+    that doesn't need the session.
+    """
+
+    name = "middleware_marked_session"
+
+    def get_settings(self):
+        return {**super().get_settings(), "AUTHLINK_SESSION_MARKER_COOKIE": "authlink_marker"}
+
+    def setup(self):
+        Benchmark.setup(self)
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.run(None)
+        assert "authlink_marker" in self.client.cookies
+
+    def run(self, prepared):
+        response = self.client.get(reverse("authlink_use", kwargs={"key": "not-a-key"}))
+        assert response.status_code == 404, response.status_code
+
+
+class KeyGenerationBenchmark(Benchmark):
+    name = "generate_key"
+
+    def setup(self):
+        pass
+
+    def run(self, prepared):
+        generate_authlink_key()
+
+
+class KeyBatchGenerationBenchmark(KeyGenerationBenchmark):
+    name = "generate_keys_100"
+
+    def run(self, prepared):
+        generate_authlink_keys(100)
+
+
+BENCHMARKS = [
+    ConsumeBenchmark,
+    AsyncConsumeBenchmark,
+    ConsumeExpiredBenchmark,
+    ConsumeUsedBenchmark,
+    ConsumeMissingBenchmark,
+    ConsumeMalformedBenchmark,
+    ConsumeAddressMismatchBenchmark,
+    CreateBenchmark,
+    BulkCreateBenchmark,
+    CreateRestFrameworkBenchmark,
+    MiddlewareBenchmark,
+    LargeWhitelistMiddlewareBenchmark,
+    LargeWhitelistUncachedMiddlewareBenchmark,
+    MarkedSessionMiddlewareBenchmark,
+    KeyGenerationBenchmark,
+    KeyBatchGenerationBenchmark,
+]
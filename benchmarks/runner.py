@@ -0,0 +1,146 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import django
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# left out of query counts, as they vary with whether a test case's
+# transaction is wrapped around the benchmark
+TRANSACTION_CONTROL = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE")
+
+
+def measure(benchmark, iterations=500, warmup=20):
+    """
+    Time `iterations` runs of `benchmark` after `warmup` untimed ones and
+    count the queries, other than transaction control, made by one more.
+    """
+    benchmark.enable()
+    try:
+        for _ in range(warmup):
+            benchmark.run(benchmark.prepare())
+        timings = []
+        for _ in range(iterations):
+            prepared = benchmark.prepare()
+            start = time.perf_counter_ns()
+            benchmark.run(prepared)
+            timings.append(time.perf_counter_ns() - start)
+        prepared = benchmark.prepare()
+        with CaptureQueriesContext(connection) as queries:
+            benchmark.run(prepared)
+    finally:
+        benchmark.disable()
+    timings.sort()
+    return {
+        "queries": sum(
+            not query["sql"].startswith(TRANSACTION_CONTROL) for query in queries.captured_queries
+        ),
+        "ops_per_sec": round(1e9 / statistics.fmean(timings), 1),
+        "p50_ms": round(percentile(timings, 50) / 1e6, 4),
+        "p99_ms": round(percentile(timings, 99) / 1e6, 4),
+    }
+
+
+def percentile(ordered, percent):
+    return ordered[max(-(-len(ordered) * percent // 100) - 1, 0)]
+
+
+def compare(results, baseline, tolerance=None):
+    """
+    Return a description of each way `results` are worse than `baseline`:
+    any more queries and, if `tolerance` is given, a p50 latency more than
+    `tolerance` times that of the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result["queries"] > expected["queries"]:
+            regressions.append(
+                f"{name}: {result['queries']} queries, baseline {expected['queries']}"
+            )
+        if tolerance and result["p50_ms"] > expected["p50_ms"] * tolerance:
+            regressions.append(f"{name}: p50 {result['p50_ms']}ms, baseline {expected['p50_ms']}ms")
+    return regressions
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmark the authlink hot paths against SQLite and the locmem cache.",
+    )
+    parser.add_argument("names", nargs="*", help="Only run these benchmarks.")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=None,
+        help="Also fail if a p50 latency exceeds this multiple of the baseline's.",
+    )
+    parser.add_argument(
+        "--update-baseline", action="store_true", help="Write the results as the new baseline."
+    )
+    return parser
+
+
+def setup_django():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path[:0] = [root, os.path.join(root, "tests")]
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
+    django.setup()
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    setup_django()
+    from .cases import BENCHMARKS
+
+    results = {}
+    for benchmark_class in BENCHMARKS:
+        if args.names and benchmark_class.name not in args.names:
+            continue
+        result = measure(benchmark_class(), args.iterations, args.warmup)
+        results[benchmark_class.name] = result
+        print(
+            f"{benchmark_class.name:40} {result['ops_per_sec']:>10.1f} ops/s"
+            f"  p50 {result['p50_ms']:>8.3f}ms  p99 {result['p99_ms']:>8.3f}ms"
+            f"  {result['queries']:>2} queries"
+        )
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {
+                    "environment": {
+                        "python": platform.python_version(),
+                        "django": django.get_version(),
+                        "machine": platform.machine(),
+                    },
+                    "benchmarks": results,
+                },
+                f,
+                indent=2,
+            )
+            f.write("\n")
+        return 0
+
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f)["benchmarks"], args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
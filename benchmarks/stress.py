@@ -0,0 +1,226 @@
+"""
+Races many consumptions of the same authlink against each other, from a
+pool of threads or of processes, to show that exactly one ever succeeds
+and what the locking involved costs.
+
+    python -m benchmarks.stress --workers 16 --rounds 20 --mode process
+
+By default this runs against a SQLite database in a temporary file, which
+every worker shares. Pass `--settings` to use the database of a settings
+module of your own instead; it must be a scratch database, already
+migrated, that all workers can reach. Links are created through the
+storage its `AUTHLINK_STORAGE_CLASS` sets, whose cache, if any, must also
+be shared by all workers. Pass `--async` to consume them through
+`AsyncAuthLinkView`.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+import django
+
+
+IPADDRESS = "201.21.121.1"
+TEST_URL = "/very/specific/url/"
+
+SUCCEEDED = "succeeded"
+REJECTED = "rejected"
+LOCKED = "locked"
+ERROR = "error"
+
+
+def setup_django(settings_module=None, database=None):
+    """
+    Configure Django in this process, as `main` does, for pool workers.
+    """
+    from django.apps import apps
+
+    if apps.ready:
+        return
+    if settings_module is None:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        sys.path[:0] = [root, os.path.join(root, "tests")]
+        settings_module = "settings"
+    os.environ["DJANGO_SETTINGS_MODULE"] = settings_module
+
+    from django.conf import settings
+
+    settings.ROOT_URLCONF = "benchmarks.urls"
+    settings.PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+    if database:
+        settings.DATABASES = {
+            "default": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": database,
+                # wait on, rather than fail at, the write lock
+                "OPTIONS": {"timeout": 30},
+            }
+        }
+    django.setup()
+
+
+def consume(url, start_at):
+    """
+    Wait until `start_at`, so that all workers go at once, then consume the
+    authlink at `url`. Returns the outcome and how long it took in seconds.
+    """
+    from django.db import OperationalError, connection
+    from django.test import Client
+
+    client = Client()
+    time.sleep(max(start_at - time.time(), 0))
+    start = time.perf_counter()
+    try:
+        response = client.get(url, REMOTE_ADDR=IPADDRESS)
+    except OperationalError as e:
+        outcome = LOCKED if "locked" in str(e) else ERROR
+    else:
+        outcome = SUCCEEDED if response.get("Location") == TEST_URL else REJECTED
+    finally:
+        elapsed = time.perf_counter() - start
+        connection.close()
+    return outcome, elapsed
+
+
+def create_authlink():
+    from django.contrib.auth import get_user_model
+    from django.utils import timezone
+
+    from authlink.adapter import get_adapter
+
+    user, _ = get_user_model().objects.get_or_create(username="stress")
+    storage = get_adapter().get_storage()
+    authlink = storage.build(
+        user=user,
+        ipaddress=IPADDRESS,
+        expires=timezone.now() + datetime.timedelta(minutes=5),
+        url=TEST_URL,
+    )
+    storage.save(authlink)
+    return authlink
+
+
+def is_used(key):
+    from authlink.adapter import get_adapter
+
+    storage = get_adapter().get_storage()
+    authlink = storage.get(key)
+    if authlink is None:
+        # deleted as it was consumed, as nothing else removes it
+        return storage.delete_on_consume()
+    return authlink.used is not None
+
+
+def run_round(executor, workers, delay=0.2, use_async=False):
+    """
+    Have `workers` requests race to consume one new authlink. Returns their
+    outcomes and latencies, and whether the authlink ended up used.
+    """
+    from django.db import connections
+    from django.urls import reverse
+
+    authlink = create_authlink()
+    url_name = "async_authlink_use" if use_async else "authlink_use"
+    url = reverse(url_name, kwargs={"key": authlink.key})
+    # inherited connections must not be shared with forked workers
+    connections.close_all()
+    start_at = time.time() + delay
+    results = list(executor.map(consume, [url] * workers, [start_at] * workers))
+    return results, is_used(authlink.key)
+
+
+def percentile(ordered, percent):
+    return ordered[max(-(-len(ordered) * percent // 100) - 1, 0)]
+
+
+def summarise(rounds):
+    """
+    Sum up the results of several `run_round`s.
+    """
+    outcomes = {SUCCEEDED: 0, REJECTED: 0, LOCKED: 0, ERROR: 0}
+    latencies = []
+    successes_per_round = []
+    for results, used in rounds:
+        for outcome, elapsed in results:
+            outcomes[outcome] += 1
+            latencies.append(elapsed)
+        successes_per_round.append(sum(outcome == SUCCEEDED for outcome, _ in results))
+    latencies.sort()
+    return {
+        "rounds": len(rounds),
+        "requests": len(latencies),
+        **outcomes,
+        "rounds_with_one_success": successes_per_round.count(1),
+        "rounds_with_many_successes": sum(count > 1 for count in successes_per_round),
+        "rounds_used_without_success": sum(
+            used and count == 0 for (_, used), count in zip(rounds, successes_per_round)
+        ),
+        "latency_ms": {
+            name: round(percentile(latencies, percent) * 1000, 3)
+            for name, percent in (("min", 0), ("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))
+        },
+    }
+
+
+def is_correct(summary):
+    """
+    Whether every round ended with exactly one consumer succeeding.
+    """
+    return summary["rounds_with_one_success"] == summary["rounds"]
+
+
+def stress(
+    workers=8, rounds=10, mode="thread", settings_module=None, database=None, use_async=False
+):
+    if mode == "process":
+        executor = ProcessPoolExecutor(
+            workers, initializer=setup_django, initargs=(settings_module, database)
+        )
+    else:
+        executor = ThreadPoolExecutor(workers)
+    with executor:
+        return summarise([run_round(executor, workers, use_async=use_async) for _ in range(rounds)])
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.stress",
+        description="Race concurrent consumptions of the same authlinks.",
+    )
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--mode", choices=("thread", "process"), default="thread")
+    parser.add_argument("--settings", help="A settings module whose database to use.")
+    parser.add_argument(
+        "--async",
+        action="store_true",
+        dest="use_async",
+        help="Consume through AsyncAuthLinkView rather than AuthLinkView.",
+    )
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    with tempfile.TemporaryDirectory() as directory:
+        database = None if args.settings else os.path.join(directory, "stress.sqlite3")
+        setup_django(args.settings, database)
+        if database:
+            from django.core.management import call_command
+
+            call_command("migrate", verbosity=0)
+        summary = stress(
+            args.workers, args.rounds, args.mode, args.settings, database, args.use_async
+        )
+    print(json.dumps(summary, indent=2))
+    return 0 if is_correct(summary) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,13 @@
+from django.urls import re_path
+
+from authlink.views import AsyncAuthLinkView, AuthLinkView
+
+
+urlpatterns = [
+    re_path(r"^authlink/(?P<key>[\w.:-]+)$", AuthLinkView.as_view(), name="authlink_use"),
+    re_path(
+        r"^async/authlink/(?P<key>[\w.:-]+)$",
+        AsyncAuthLinkView.as_view(),
+        name="async_authlink_use",
+    ),
+]
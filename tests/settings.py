@@ -16,7 +16,12 @@ DATABASES = {
         "NAME": ":memory:",
         "USER": "",
         "PASSWORD": "",
-    }
+    },
+    # only used by tests that ask for it, to stand in for a lagging replica
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": ":memory:",
+    },
 }
 
 
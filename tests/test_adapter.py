@@ -1,9 +1,11 @@
 import datetime
 from importlib import import_module
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import BACKEND_SESSION_KEY, SESSION_KEY, get_user_model
 from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.db import IntegrityError
 from django.test import RequestFactory, TestCase
 from django.test.utils import override_settings
@@ -19,6 +21,11 @@ class TestAdapter(DefaultAuthLinkAdapter):
     pass
 
 
+class UseAdapter(DefaultAuthLinkAdapter):
+    def use(self, authlink):
+        super().use(authlink)
+
+
 class AdapterTestCase(TestCase):
     def setUp(self):
         self.user = get_user_model().objects.create_user(
@@ -43,6 +50,20 @@ class AdapterTestCase(TestCase):
         adapter = get_adapter()
         self.assertEqual(TestAdapter, adapter.__class__)
 
+    def test_get_adapter_use_overridden(self):
+        with self.assertWarnsRegex(DeprecationWarning, r"UseAdapter\.use\(\) is not called"):
+            with override_settings(AUTHLINK_ADAPTER_CLASS="tests.test_adapter.UseAdapter"):
+                get_adapter()
+
+    def test_get_adapter_cached(self):
+        self.assertIs(get_adapter(), self.adapter)
+
+    def test_get_adapter_reset_on_setting_change(self):
+        with override_settings(AUTHLINK_ADAPTER_CLASS="tests.test_adapter.TestAdapter"):
+            self.assertIsInstance(get_adapter(), TestAdapter)
+            self.assertIs(get_adapter(), get_adapter())
+        self.assertEqual(DefaultAuthLinkAdapter, get_adapter().__class__)
+
     def test_create_ok(self):
         request = self.factory.get("/some/url")
         request.user = self.user
@@ -70,6 +91,66 @@ class AdapterTestCase(TestCase):
         with self.assertRaises(RuntimeError):
             self.adapter.create(**{"url": "/some/url", "request": request})
 
+    @override_settings(AUTHLINK_URL_WHITELIST=[r"^/some/"])
+    def test_bulk_create(self):
+        request = self.factory.get("/some/url")
+        request.user = self.user
+        request.META = {"REMOTE_ADDR": "177.139.233.133"}
+        with self.assertNumQueries(1):
+            authlinks = self.adapter.bulk_create(
+                [{"url": f"/some/url/{i}"} for i in range(10)], request=request
+            )
+        self.assertEqual(len({authlink.key for authlink in authlinks}), 10)
+        for authlink in AuthLink.objects.filter(url__startswith="/some/url/"):
+            self.assertEqual(authlink.user, self.user)
+            self.assertEqual(authlink.ipaddress, "177.139.233.133")
+            self.assertEqual(
+                authlink.expires,
+                authlink.created + datetime.timedelta(seconds=settings.AUTHLINK_TTL_SECONDS),
+            )
+        self.assertEqual(AuthLink.objects.count(), 11)
+
+    @override_settings(AUTHLINK_URL_WHITELIST=[r"^/some/"])
+    def test_bulk_create_without_request(self):
+        another_user = get_user_model().objects.create(username="another")
+        self.adapter.bulk_create(
+            [
+                {"url": "/some/url/1", "user": self.user, "ipaddress": "177.139.233.133"},
+                {"url": "/some/url/2", "user": another_user, "ipaddress": "::ffff:177.139.233.134"},
+            ]
+        )
+        authlink = AuthLink.objects.get(url="/some/url/2")
+        self.assertEqual(authlink.user, another_user)
+        self.assertEqual(authlink.ipaddress, "177.139.233.134")
+
+    @override_settings(AUTHLINK_URL_WHITELIST=[r"^/some/"])
+    def test_bulk_create_not_whitelisted(self):
+        request = self.factory.get("/some/url")
+        request.user = self.user
+        request.META = {"REMOTE_ADDR": "177.139.233.133"}
+        with self.assertRaises(ValidationError) as cm:
+            self.adapter.bulk_create(
+                [{"url": "/some/url"}, {"url": "/other/b"}, {"url": "/other/a"}], request=request
+            )
+        self.assertEqual(
+            cm.exception.messages,
+            [
+                "URL specified is not whitelisted: /other/a",
+                "URL specified is not whitelisted: /other/b",
+            ],
+        )
+        self.assertEqual(AuthLink.objects.count(), 1)
+
+    @override_settings(AUTHLINK_URL_WHITELIST=[r"^/some/"])
+    def test_bulk_create_user_not_authenticated(self):
+        request = self.factory.get("/some/url")
+        request.user = AnonymousUser()
+        request.META = {"REMOTE_ADDR": "177.139.233.133"}
+        with self.assertRaises(RuntimeError):
+            self.adapter.bulk_create([{"url": "/some/url"}], request=request)
+        with self.assertRaises(RuntimeError):
+            self.adapter.bulk_create([{"url": "/some/url", "ipaddress": "177.139.233.133"}])
+
     def test_calculate_expiry(self):
         now = timezone.now()
         expires = self.adapter.calculate_expiry(now)
@@ -133,9 +214,136 @@ class AdapterTestCase(TestCase):
 
     def test_use(self):
         self.assertFalse(self.authlink.used)
-        self.adapter.use(self.authlink)
+        with self.assertWarns(DeprecationWarning):
+            self.adapter.use(self.authlink)
         self.assertTrue(self.authlink.used)
 
+    def test_claim_ok(self):
+        with self.assertNumQueries(1):
+            authlink = self.adapter.claim(self.authlink.key)
+            self.assertEqual(authlink.user, self.user)
+            self.assertEqual(authlink.user.last_login, self.user.last_login)
+        self.assertEqual(authlink, self.authlink)
+        self.assertEqual(authlink.expires, self.authlink.expires)
+        self.assertTrue(authlink.used)
+        self.assertTrue(AuthLink.objects.get(pk=self.authlink.pk).used)
+
+    @mock.patch("authlink.models.supports_update_returning", return_value=False)
+    def test_claim_ok_without_returning(self, _):
+        with self.assertNumQueries(2):
+            authlink = self.adapter.claim(self.authlink.key)
+            self.assertEqual(authlink.user, self.user)
+        self.assertEqual(authlink, self.authlink)
+        self.assertTrue(AuthLink.objects.get(pk=self.authlink.pk).used)
+
+    def test_claim_queryset(self):
+        queryset = AuthLink.objects.select_related("user").only(
+            "key", "user", "ipaddress", "url", "user__id", "user__password"
+        )
+        with self.assertNumQueries(1):
+            authlink = self.adapter.claim(self.authlink.key, queryset=queryset)
+            self.assertEqual(authlink.url, "/some/url")
+            self.assertEqual(authlink.user.password, self.user.password)
+        with self.assertNumQueries(0):
+            self.assertTrue(authlink.used)
+        self.assertEqual(authlink.get_deferred_fields(), {"created", "expires"})
+        self.assertIn("username", authlink.user.get_deferred_fields())
+        self.assertNotIn("password", authlink.user.get_deferred_fields())
+
+    @mock.patch("authlink.models.supports_update_returning", return_value=False)
+    def test_claim_queryset_without_returning(self, _):
+        queryset = AuthLink.objects.only("key", "url")
+        authlink = self.adapter.claim(self.authlink.key, queryset=queryset)
+        with self.assertNumQueries(0):
+            self.assertTrue(authlink.used)
+
+    def test_claim_queryset_without_user(self):
+        with self.assertNumQueries(1):
+            authlink = self.adapter.claim(self.authlink.key, queryset=AuthLink.objects.all())
+        self.assertFalse(AuthLink.user.is_cached(authlink))
+
+    def test_claim_filtered_queryset(self):
+        queryset = AuthLink.objects.select_related("user").filter(user__is_active=True)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.adapter.claim(self.authlink.key, queryset=queryset))
+        self.assertFalse(AuthLink.objects.get(pk=self.authlink.pk).used)
+        self.user.is_active = True
+        self.user.save()
+        authlink = self.adapter.claim(self.authlink.key, queryset=queryset)
+        self.assertEqual(authlink.user, self.user)
+        self.assertTrue(AuthLink.objects.get(pk=self.authlink.pk).used)
+
+    @mock.patch("authlink.models.supports_update_returning", return_value=False)
+    def test_claim_filtered_queryset_without_returning(self, _):
+        self.test_claim_filtered_queryset()
+
+    async def test_aclaim_filtered_queryset(self):
+        queryset = AuthLink.objects.select_related("user").filter(user__is_active=False)
+        self.assertIsNone(await self.adapter.aclaim(self.authlink.key, queryset=queryset))
+        queryset = AuthLink.objects.select_related("user").filter(user__is_active=True)
+        authlink = await self.adapter.aclaim(self.authlink.key, queryset=queryset)
+        self.assertEqual(authlink.user, self.user)
+        self.assertTrue(authlink.used)
+        self.assertIsNone(await self.adapter.aclaim(self.authlink.key, queryset=queryset))
+
+    async def test_aclaim_read_authlink(self):
+        queryset = self.adapter.get_queryset()
+        authlink = await self.adapter.aget_authlink(self.authlink.key, queryset)
+        claimed = await self.adapter.aclaim(self.authlink.key, queryset=queryset, authlink=authlink)
+        # the link already read is marked used, not read again
+        self.assertIs(claimed, authlink)
+        self.assertTrue(AuthLink.user.is_cached(claimed))
+        self.assertTrue(claimed.used)
+        self.assertIsNone(
+            await self.adapter.aclaim(self.authlink.key, queryset=queryset, authlink=authlink)
+        )
+
+    def test_claim_used(self):
+        self.assertIsNotNone(self.adapter.claim(self.authlink.key))
+        self.assertIsNone(self.adapter.claim(self.authlink.key))
+
+    def test_claim_expired(self):
+        AuthLink.objects.filter(pk=self.authlink.pk).update(expires=timezone.now())
+        self.assertIsNone(self.adapter.claim(self.authlink.key))
+        self.assertFalse(AuthLink.objects.get(pk=self.authlink.pk).used)
+
+    def test_claim_missing(self):
+        self.assertIsNone(self.adapter.claim("doesnotexist"))
+
+    def test_release(self):
+        authlink = self.adapter.claim(self.authlink.key)
+        self.adapter.release(authlink)
+        self.assertFalse(authlink.used)
+        self.assertFalse(AuthLink.objects.get(pk=self.authlink.pk).used)
+        self.assertIsNotNone(self.adapter.claim(self.authlink.key))
+
+    async def test_async_consume(self):
+        self.assertIsNone(await self.adapter.aclaim("doesnotexist"))
+        authlink = await self.adapter.aclaim(self.authlink.key)
+        self.assertTrue(await self.adapter.ais_used(authlink))
+        self.assertFalse(await self.adapter.ais_expired(authlink))
+        await self.adapter.arelease(authlink)
+        authlink = await self.adapter.aget_authlink(self.authlink.key)
+        self.assertFalse(authlink.used)
+        with self.assertWarns(DeprecationWarning):
+            await self.adapter.ause(authlink)
+        self.assertTrue((await self.adapter.aget_authlink(self.authlink.key)).used)
+
+    async def test_alogin(self):
+        request = self.factory.get("/some/url")
+        engine = import_module(settings.SESSION_ENGINE)
+        request.session = engine.SessionStore()
+        await self.adapter.alogin(request, await AuthLink.objects.aget(pk=self.authlink.pk))
+        self.assertEqual(int(await request.session.aget(SESSION_KEY)), self.user.pk)
+        self.assertEqual(
+            await request.session.aget(BACKEND_SESSION_KEY),
+            "authlink.auth_backends.AuthLinkBackend",
+        )
+        await self.adapter.alogout(request)
+        self.assertIsNone(await request.session.aget(SESSION_KEY))
+
     @mock_now
     def test_is_expired_false(self):
         now = timezone.now()
@@ -156,7 +364,7 @@ class AdapterTestCase(TestCase):
 
     def test_is_used(self):
         self.assertFalse(self.adapter.is_used(self.authlink))
-        self.adapter.use(self.authlink)
+        self.authlink.used = timezone.now()
         self.assertTrue(self.adapter.is_used(self.authlink))
 
     def test_ipaddress_matches_cannot_extract(self):
@@ -176,6 +384,60 @@ class AdapterTestCase(TestCase):
         request.META = {"REMOTE_ADDR": "177.139.233.133"}
         self.assertTrue(self.adapter.ipaddress_matches(request, self.authlink))
 
+    def test_ipaddress_matches_normalised(self):
+        self.authlink.ipaddress = "2a00:1450::1"
+        request = self.factory.get("/some/url", REMOTE_ADDR="2a00:1450:0000::0001")
+        self.assertTrue(self.adapter.ipaddress_matches(request, self.authlink))
+        self.authlink.ipaddress = "177.139.233.133"
+        request = self.factory.get("/some/url", REMOTE_ADDR="::ffff:177.139.233.133")
+        self.assertEqual(self.adapter.extract_ipaddress(request), "177.139.233.133")
+        self.assertTrue(self.adapter.ipaddress_matches(request, self.authlink))
+
+    def test_ipaddress_matches_other_version(self):
+        request = self.factory.get("/some/url", REMOTE_ADDR="2a00:1450::1")
+        self.assertFalse(self.adapter.ipaddress_matches(request, self.authlink))
+
+    @override_settings(AUTHLINK_IP_MATCH_PREFIX=(24, 64))
+    def test_ipaddress_matches_prefix(self):
+        for ipaddress, matches in (
+            ("177.139.233.1", True),
+            ("177.139.233.255", True),
+            ("177.139.234.133", False),
+        ):
+            request = self.factory.get("/some/url", REMOTE_ADDR=ipaddress)
+            self.assertIs(self.adapter.ipaddress_matches(request, self.authlink), matches)
+        self.authlink.ipaddress = "2a00:1450:0:1::1"
+        for ipaddress, matches in (
+            ("2a00:1450:0:1:ffff::2", True),
+            ("2a00:1450:0:2::1", False),
+        ):
+            request = self.factory.get("/some/url", REMOTE_ADDR=ipaddress)
+            self.assertIs(self.adapter.ipaddress_matches(request, self.authlink), matches)
+
+    @override_settings(AUTHLINK_IP_MATCH_PREFIX=24)
+    def test_ipaddress_matches_ipv4_prefix(self):
+        request = self.factory.get("/some/url", REMOTE_ADDR="177.139.233.1")
+        self.assertTrue(self.adapter.ipaddress_matches(request, self.authlink))
+        self.authlink.ipaddress = "2a00:1450:0:1::1"
+        request = self.factory.get("/some/url", REMOTE_ADDR="2a00:1450:0:1::2")
+        self.assertFalse(self.adapter.ipaddress_matches(request, self.authlink))
+
+    def test_ipaddress_match_prefix_invalid(self):
+        request = self.factory.get("/some/url", REMOTE_ADDR="177.139.233.133")
+        for prefix in (33, (24,), (24, 129), "24", (24, None)):
+            with self.settings(AUTHLINK_IP_MATCH_PREFIX=prefix):
+                with self.assertRaises(ImproperlyConfigured):
+                    self.adapter.ipaddress_matches(request, self.authlink)
+
+    def test_extract_ipaddress_once(self):
+        request = self.factory.get("/some/url", REMOTE_ADDR="177.139.233.133")
+        with mock.patch(
+            "authlink.adapter.get_client_ip", return_value=("177.139.233.133", True)
+        ) as get_client_ip:
+            self.adapter.extract_ipaddress(request)
+            self.assertTrue(self.adapter.ipaddress_matches(request, self.authlink))
+        get_client_ip.assert_called_once()
+
     def test_get_full_url(self):
         # produces an url with embedded key
         self.assertIn(self.authlink.key, self.adapter.get_full_url(self.authlink))
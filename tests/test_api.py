@@ -55,3 +55,180 @@ class APITestCase(TestCase):
         )
         self.assertEqual(response.status_code, 403)
         self.assertEqual(AuthLink.objects.count(), 0)
+
+
+@override_settings(AUTHLINK_URL_WHITELIST=[r"^/very/specific/url/$"])
+class JSONAPITestCase(TestCase):
+    """
+    Ensure the plain Django generation API behaves like the REST framework one.
+    """
+
+    url_name = "authlink_generate_json"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="luke", email="luke@...", password="top_secret"
+        )
+        self.ipaddress = "201.21.121.1"
+
+    def post(self, data, **kwargs):
+        return self.client.post(
+            reverse(self.url_name),
+            data=data,
+            content_type="application/json",
+            REMOTE_ADDR=self.ipaddress,
+            **kwargs,
+        )
+
+    def test_generate_ok_url(self):
+        self.client.force_login(self.user)
+        response = self.post({"url": "/very/specific/url/"})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {"url": "/very/specific/url/"})
+        authlink = AuthLink.objects.get()
+        self.assertEqual(authlink.user, self.user)
+        self.assertEqual(authlink.ipaddress, self.ipaddress)
+        self.assertEqual(response["Location"], f"/authlink/{authlink.key}")
+
+    def test_generate_ok_url_form_encoded(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse(self.url_name), data={"url": "/very/specific/url/"}, REMOTE_ADDR=self.ipaddress
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(AuthLink.objects.count(), 1)
+
+    def test_generate_invalid_url(self):
+        self.client.force_login(self.user)
+        response = self.post({"url": "/very/specific/but/wrong/url/"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"url": ["URL specified is not whitelisted"]})
+        self.assertEqual(AuthLink.objects.count(), 0)
+
+    def test_generate_missing_url(self):
+        self.client.force_login(self.user)
+        response = self.post({})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"url": ["This field is required."]})
+
+    def test_generate_malformed(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.post("not json").status_code, 400)
+        self.assertEqual(self.post(["/very/specific/url/"]).status_code, 400)
+        self.assertEqual(AuthLink.objects.count(), 0)
+
+    def test_generate_not_authenticated(self):
+        response = self.post({"url": "/very/specific/url/"})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(AuthLink.objects.count(), 0)
+
+    def test_generate_get_not_allowed(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse(self.url_name)).status_code, 405)
+
+
+class AsyncJSONAPITestCase(JSONAPITestCase):
+    url_name = "authlink_generate_json_async"
+
+
+@override_settings(AUTHLINK_URL_WHITELIST=[r"^/very/specific/url/", r"^/another/url/$"])
+class BulkAPITestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient(format="json")
+        self.user = get_user_model().objects.create_user(
+            username="luke", email="luke@...", password="top_secret"
+        )
+        self.ipaddress = "201.21.121.1"
+
+    def post(self, data):
+        self.client.force_authenticate(user=self.user)
+        return self.client.post(
+            reverse("authlink_bulk_generate"), data=data, REMOTE_ADDR=self.ipaddress
+        )
+
+    def test_generate_ok(self):
+        response = self.post({"urls": ["/very/specific/url/", "/another/url/"]})
+        self.assertEqual(response.status_code, 201)
+        keys = AuthLink.objects.filter(user=self.user, ipaddress=self.ipaddress).values_list(
+            "key", flat=True
+        )
+        self.assertCountEqual(response.json()["locations"], [f"/authlink/{key}" for key in keys])
+        self.assertEqual(len(keys), 2)
+
+    def test_generate_invalid_url(self):
+        response = self.post({"urls": ["/very/specific/url/", "/wrong/"]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"urls": ["URL specified is not whitelisted: /wrong/"]})
+        self.assertEqual(AuthLink.objects.count(), 0)
+
+    @override_settings(AUTHLINK_BULK_CREATE_MAX_URLS=1)
+    def test_generate_too_many(self):
+        response = self.post({"urls": ["/very/specific/url/", "/another/url/"]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(AuthLink.objects.count(), 0)
+
+    def test_generate_empty(self):
+        self.assertEqual(self.post({"urls": []}).status_code, 400)
+
+    def test_generate_not_authenticated(self):
+        response = self.client.post(
+            reverse("authlink_bulk_generate"), data={"urls": ["/another/url/"]}
+        )
+        self.assertEqual(response.status_code, 403)
+
+
+@override_settings(AUTHLINK_URL_WHITELIST=[r"^/very/specific/url/", r"^/another/url/$"])
+class JSONBulkAPITestCase(TestCase):
+    url_name = "authlink_bulk_generate_json"
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="luke", email="luke@...", password="top_secret"
+        )
+        self.ipaddress = "201.21.121.1"
+        self.client.force_login(self.user)
+
+    def post(self, data):
+        return self.client.post(
+            reverse(self.url_name),
+            data=data,
+            content_type="application/json",
+            REMOTE_ADDR=self.ipaddress,
+        )
+
+    def test_generate_ok(self):
+        response = self.post({"urls": ["/very/specific/url/", "/another/url/"]})
+        self.assertEqual(response.status_code, 201)
+        keys = AuthLink.objects.values_list("key", flat=True)
+        self.assertCountEqual(response.json()["locations"], [f"/authlink/{key}" for key in keys])
+        self.assertEqual(len(keys), 2)
+
+    def test_generate_form_encoded(self):
+        response = self.client.post(
+            reverse(self.url_name),
+            data={"urls": ["/very/specific/url/", "/another/url/"]},
+            REMOTE_ADDR=self.ipaddress,
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(AuthLink.objects.count(), 2)
+
+    def test_generate_invalid(self):
+        for data, error in (
+            ({"urls": ["/wrong/"]}, "URL specified is not whitelisted: /wrong/"),
+            ({"urls": []}, "This field is required."),
+            ({"urls": "/another/url/"}, "Expected a list of URLs."),
+            ({"urls": ["/another/url/", 1]}, "Expected a list of URLs."),
+        ):
+            response = self.post(data)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json(), {"urls": [error]})
+        self.assertEqual(AuthLink.objects.count(), 0)
+
+    @override_settings(AUTHLINK_BULK_CREATE_MAX_URLS=1)
+    def test_generate_too_many(self):
+        response = self.post({"urls": ["/very/specific/url/", "/another/url/"]})
+        self.assertEqual(response.json(), {"urls": ["No more than 1 URLs may be given."]})
+
+
+class AsyncJSONBulkAPITestCase(JSONBulkAPITestCase):
+    url_name = "authlink_bulk_generate_json_async"
@@ -0,0 +1,26 @@
+import json
+
+from django.test import TestCase
+
+from benchmarks.cases import BENCHMARKS
+from benchmarks.runner import BASELINE, compare, measure
+
+
+class BenchmarksTestCase(TestCase):
+    def test_queries_within_baseline(self):
+        with open(BASELINE) as f:
+            baseline = json.load(f)["benchmarks"]
+        results = {
+            benchmark_class.name: measure(benchmark_class(), iterations=2, warmup=1)
+            for benchmark_class in BENCHMARKS
+        }
+        self.assertEqual(set(results), set(baseline))
+        self.assertEqual(compare(results, baseline), [])
+
+    def test_compare(self):
+        baseline = {"a": {"queries": 2, "p50_ms": 1.0}}
+        self.assertEqual(compare({"a": {"queries": 2, "p50_ms": 1.4}}, baseline, 1.5), [])
+        self.assertEqual(
+            compare({"a": {"queries": 3, "p50_ms": 1.6}, "b": {}}, baseline, 1.5),
+            ["a: 3 queries, baseline 2", "a: p50 1.6ms, baseline 1.0ms"],
+        )
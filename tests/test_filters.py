@@ -0,0 +1,120 @@
+import datetime
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from authlink.filters import KeyFilter, get_key_filter
+from authlink.models import AuthLink
+from authlink.utils import generate_authlink_key, is_valid_authlink_key
+
+
+class KeyFilterTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_get_set(self):
+        key_filter = KeyFilter()
+        self.assertIsNone(key_filter.get("a"))
+        key_filter.set("a", KeyFilter.USED)
+        self.assertEqual(key_filter.get("a"), KeyFilter.USED)
+
+    def test_bounded(self):
+        key_filter = KeyFilter(max_entries=2)
+        key_filter.set("a", KeyFilter.USED)
+        key_filter.set("b", KeyFilter.USED)
+        key_filter.get("a")
+        key_filter.set("c", KeyFilter.USED)
+        # "b" was least recently used
+        self.assertEqual(list(key_filter.entries), ["a", "c"])
+
+    @mock.patch("authlink.filters.time.monotonic", return_value=100)
+    def test_expiry(self, monotonic):
+        key_filter = KeyFilter(timeout=10)
+        key_filter.set("a", KeyFilter.MISSING)
+        key_filter.set("b", KeyFilter.USED, timeout=20)
+        monotonic.return_value = 110
+        self.assertIsNone(key_filter.get("a"))
+        self.assertEqual(key_filter.get("b"), KeyFilter.USED)
+        self.assertNotIn("a", key_filter.entries)
+
+    def test_shared(self):
+        KeyFilter(cache_alias="default").set("a", KeyFilter.EXPIRED)
+        other = KeyFilter(cache_alias="default")
+        self.assertEqual(other.get("a"), KeyFilter.EXPIRED)
+        self.assertIn("a", other.entries)
+        self.assertIsNone(KeyFilter().get("a"))
+
+    async def test_async(self):
+        await KeyFilter(cache_alias="default").aset("a", KeyFilter.USED)
+        self.assertEqual(await KeyFilter(cache_alias="default").aget("a"), KeyFilter.USED)
+
+    def test_get_key_filter(self):
+        self.assertIsNone(get_key_filter())
+        with override_settings(AUTHLINK_KEY_FILTER=True, AUTHLINK_KEY_FILTER_MAX_ENTRIES=5):
+            self.assertEqual(get_key_filter().max_entries, 5)
+
+    def test_is_valid_authlink_key(self):
+        self.assertTrue(is_valid_authlink_key(generate_authlink_key()))
+        self.assertFalse(is_valid_authlink_key(generate_authlink_key()[1:]))
+        self.assertFalse(is_valid_authlink_key(generate_authlink_key()[1:] + "A"))
+        self.assertFalse(is_valid_authlink_key(""))
+
+
+@override_settings(AUTHLINK_KEY_FILTER=True)
+class KeyFilterViewTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = get_user_model().objects.create_user(
+            username="luke", email="luke@...", password="top_secret"
+        )
+        self.ipaddress = "201.21.121.1"
+        now = timezone.now()
+        self.authlink = AuthLink.objects.create(
+            user=self.user,
+            ipaddress=self.ipaddress,
+            created=now,
+            expires=now + datetime.timedelta(seconds=settings.AUTHLINK_TTL_SECONDS),
+            url="/very/specific/url/",
+        )
+
+    def get(self, key):
+        return Client().get(
+            reverse("authlink_use", kwargs={"key": key}), REMOTE_ADDR=self.ipaddress
+        )
+
+    def test_malformed_key(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get("doesnotexist").status_code, 404)
+
+    def test_missing_key(self):
+        key = generate_authlink_key()
+        self.assertEqual(self.get(key).status_code, 404)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(key).status_code, 404)
+
+    def test_used_key(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.get(self.authlink.key).get("Location"), "/very/specific/url/")
+        self.assertEqual(get_key_filter().get(self.authlink.key), KeyFilter.USED)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(self.authlink.key).get("Location"), "/")
+
+    def test_expired_key(self):
+        AuthLink.objects.filter(pk=self.authlink.pk).update(expires=timezone.now())
+        self.assertEqual(self.get(self.authlink.key).get("Location"), "/")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(self.authlink.key).get("Location"), "/")
+
+    def test_mismatch_not_remembered(self):
+        Client().get(
+            reverse("authlink_use", kwargs={"key": self.authlink.key}), REMOTE_ADDR="201.21.121.2"
+        )
+        self.assertIsNone(get_key_filter().get(self.authlink.key))
+        self.assertEqual(self.get(self.authlink.key).get("Location"), "/very/specific/url/")
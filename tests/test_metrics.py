@@ -0,0 +1,257 @@
+import datetime
+import socket
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from authlink.adapter import get_adapter
+from authlink.metrics import (
+    NULL_TIMER,
+    MemoryMetricsSink,
+    StatsdMetricsSink,
+    Timer,
+    get_metrics_sink,
+    start_timer,
+)
+from authlink.models import AuthLink
+from authlink.signals import authlink_consumed, authlink_created, authlink_rejected
+
+
+def failing_receiver(**kwargs):
+    raise RuntimeError
+
+
+class SignalCatcher:
+    def __init__(self, signal):
+        self.signal = signal
+        self.calls = []
+
+    def __call__(self, **kwargs):
+        self.calls.append(kwargs)
+
+    def __enter__(self):
+        self.signal.connect(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.signal.disconnect(self)
+
+
+@override_settings(AUTHLINK_URL_WHITELIST=[r"^/very/specific/url/$"])
+class InstrumentationTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="luke", email="luke@...", password="top_secret"
+        )
+        self.ipaddress = "201.21.121.1"
+        now = timezone.now()
+        self.authlink = AuthLink.objects.create(
+            user=self.user,
+            ipaddress=self.ipaddress,
+            expires=now + datetime.timedelta(seconds=60),
+            url="/very/specific/url/",
+        )
+        self.url = reverse("authlink_use", kwargs={"key": self.authlink.key})
+
+    def test_consumed(self):
+        with SignalCatcher(authlink_consumed) as consumed:
+            Client().get(self.url, REMOTE_ADDR=self.ipaddress)
+        (call,) = consumed.calls
+        self.assertEqual(call["authlink"], self.authlink)
+        self.assertEqual(list(call["timings"]), ["check", "claim", "ipaddress", "login", "total"])
+        self.assertGreaterEqual(call["timings"]["total"], sum(list(call["timings"].values())[:-1]))
+
+    def test_failing_receiver(self):
+        authlink_consumed.connect(failing_receiver)
+        self.addCleanup(authlink_consumed.disconnect, failing_receiver)
+        with self.assertLogs("django.dispatch", "ERROR"):
+            response = Client().get(self.url, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.get("Location"), "/very/specific/url/")
+        self.assertTrue(AuthLink.objects.get(pk=self.authlink.pk).used)
+
+    async def test_failing_receiver_async(self):
+        authlink_consumed.connect(failing_receiver)
+        self.addCleanup(authlink_consumed.disconnect, failing_receiver)
+        url = reverse("async_authlink_use", kwargs={"key": self.authlink.key})
+        with self.assertLogs("django.dispatch", "ERROR"):
+            response = await self.async_client.get(url, headers={"x-forwarded-for": self.ipaddress})
+        self.assertEqual(response.get("Location"), "/very/specific/url/")
+
+    def test_rejected(self):
+        Client().get(self.url, REMOTE_ADDR=self.ipaddress)
+        with SignalCatcher(authlink_rejected) as rejected:
+            Client().get(self.url, REMOTE_ADDR=self.ipaddress)
+            Client().get(self.url.replace(self.authlink.key, "x" * 64))
+            Client().get(self.url.replace(self.authlink.key, "bad"))
+        self.assertEqual(
+            [call["reason"] for call in rejected.calls], ["used", "missing", "missing"]
+        )
+        self.assertEqual(rejected.calls[0]["authlink"], self.authlink)
+        self.assertEqual(list(rejected.calls[0]["timings"]), ["check", "claim", "lookup", "total"])
+        self.assertIsNone(rejected.calls[2]["authlink"])
+        self.assertEqual(list(rejected.calls[2]["timings"]), ["check", "total"])
+
+    def test_rejected_address_mismatch(self):
+        with SignalCatcher(authlink_rejected) as rejected:
+            Client().get(self.url, REMOTE_ADDR="201.21.121.2")
+        self.assertEqual(rejected.calls[0]["reason"], "address_mismatch")
+
+    async def test_async(self):
+        url = reverse("async_authlink_use", kwargs={"key": self.authlink.key})
+        with SignalCatcher(authlink_rejected) as rejected:
+            await self.async_client.get(url, headers={"x-forwarded-for": "201.21.121.2"})
+        with SignalCatcher(authlink_consumed) as consumed:
+            await self.async_client.get(url, headers={"x-forwarded-for": self.ipaddress})
+        self.assertEqual(rejected.calls[0]["reason"], "address_mismatch")
+        self.assertEqual(consumed.calls[0]["authlink"], self.authlink)
+
+    def test_created(self):
+        client = Client()
+        client.force_login(self.user)
+        with SignalCatcher(authlink_created) as created:
+            client.post(
+                reverse("authlink_generate_json"),
+                data={"url": "/very/specific/url/"},
+                content_type="application/json",
+                REMOTE_ADDR=self.ipaddress,
+            )
+        (call,) = created.calls
+        self.assertEqual(call["authlinks"], [AuthLink.objects.latest("created")])
+        self.assertEqual(list(call["timings"]), ["build", "save", "total"])
+
+    def test_bulk_created(self):
+        request = RequestFactory().post("/", REMOTE_ADDR=self.ipaddress)
+        request.user = self.user
+        with SignalCatcher(authlink_created) as created:
+            authlinks = get_adapter().bulk_create(
+                [{"url": "/very/specific/url/"}] * 2, request=request
+            )
+        self.assertEqual(created.calls[0]["authlinks"], authlinks)
+
+    @override_settings(AUTHLINK_METRICS_SINK="authlink.metrics.MemoryMetricsSink")
+    def test_sink(self):
+        sink = get_metrics_sink()
+        Client().get(self.url, REMOTE_ADDR=self.ipaddress)
+        Client().get(self.url, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(sink.counters, {"consumed": 1, "rejected,reason=used": 1})
+        self.assertEqual(len(sink.timings["consumed.claim"]), 1)
+        self.assertEqual(len(sink.timings["rejected.lookup,reason=used"]), 1)
+
+    @override_settings(AUTHLINK_METRICS_SINK="authlink.metrics.MemoryMetricsSink")
+    def test_failing_sink(self):
+        with mock.patch.object(MemoryMetricsSink, "record", side_effect=RuntimeError):
+            with self.assertLogs("authlink.metrics", "ERROR"):
+                response = Client().get(self.url, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.get("Location"), "/very/specific/url/")
+
+    def test_disabled(self):
+        with mock.patch("authlink.metrics.Timer") as timer:
+            Client().get(self.url, REMOTE_ADDR=self.ipaddress)
+        timer.assert_not_called()
+
+
+class FailingReceiverTransactionTestCase(TransactionTestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="luke")
+        self.ipaddress = "201.21.121.1"
+        self.authlink = AuthLink.objects.create(
+            user=self.user,
+            ipaddress=self.ipaddress,
+            expires=timezone.now() + datetime.timedelta(seconds=60),
+            url="/very/specific/url/",
+        )
+        self.url = reverse("authlink_use", kwargs={"key": self.authlink.key})
+
+    def test_failed_query_keeps_claim(self):
+        def receiver(**kwargs):
+            get_user_model().objects.create(username="luke")
+
+        authlink_consumed.connect(receiver)
+        self.addCleanup(authlink_consumed.disconnect, receiver)
+        with self.assertLogs("django.dispatch", "ERROR"):
+            response = Client().get(self.url, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.get("Location"), "/very/specific/url/")
+        self.assertTrue(AuthLink.objects.get(pk=self.authlink.pk).used)
+        response = Client().get(self.url, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.get("Location"), "/")
+
+
+class TimerTestCase(SimpleTestCase):
+    def test_start_timer(self):
+        self.assertIs(start_timer("consumed"), NULL_TIMER)
+        with SignalCatcher(authlink_consumed):
+            self.assertIsInstance(start_timer("consumed"), Timer)
+            self.assertIs(start_timer("created"), NULL_TIMER)
+        with override_settings(AUTHLINK_METRICS_SINK="authlink.metrics.MemoryMetricsSink"):
+            self.assertIsInstance(start_timer("created"), Timer)
+
+    @mock.patch("authlink.metrics.time.monotonic", side_effect=[10, 10.5, 12, 12.25])
+    def test_marks(self, _):
+        timer = Timer()
+        timer.mark("a")
+        timer.mark("b")
+        with SignalCatcher(authlink_created) as created:
+            timer.send("created", None, authlinks=[])
+        self.assertEqual(created.calls[0]["timings"], {"a": 0.5, "b": 1.5, "total": 2.25})
+
+
+class MemoryMetricsSinkTestCase(SimpleTestCase):
+    def test_percentile(self):
+        sink = MemoryMetricsSink()
+        self.assertIsNone(sink.percentile("x", 99))
+        for i in range(1, 101):
+            sink.timing("x", i / 1000)
+        self.assertEqual(sink.percentile("x", 50), 0.05)
+        self.assertEqual(sink.percentile("x", 99), 0.099)
+        self.assertEqual(sink.percentile("x", 0), 0.001)
+
+
+class StatsdMetricsSinkTestCase(SimpleTestCase):
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.settimeout(1)
+        self.addCleanup(self.server.close)
+        self.sink = StatsdMetricsSink(port=self.server.getsockname()[1], host="127.0.0.1")
+
+    def receive(self):
+        return self.server.recv(4096).decode()
+
+    def test_record(self):
+        self.sink.record("rejected", {"lookup": 0.0012, "total": 0.002}, reason="used")
+        self.assertEqual(
+            self.receive(),
+            "authlink.rejected:1|c|#reason:used\n"
+            "authlink.rejected.lookup:1.200|ms|#reason:used\n"
+            "authlink.rejected.total:2.000|ms|#reason:used",
+        )
+
+    def test_timing_and_increment(self):
+        self.sink.timing("consumed.total", 0.5)
+        self.assertEqual(self.receive(), "authlink.consumed.total:500.000|ms")
+        self.sink.increment("consumed")
+        self.assertEqual(self.receive(), "authlink.consumed:1|c")
+
+    def test_send_errors_ignored(self):
+        self.sink.increment("consumed")
+        self.receive()
+        self.sink.socket.close()
+        self.sink.increment("consumed")
+
+    @mock.patch("authlink.metrics.socket.getaddrinfo", side_effect=socket.gaierror)
+    def test_host_unresolvable(self, getaddrinfo):
+        with override_settings(
+            AUTHLINK_METRICS_SINK="authlink.metrics.StatsdMetricsSink",
+            AUTHLINK_METRICS_SINK_OPTIONS={"host": "statsd.invalid"},
+        ):
+            timer = start_timer("consumed")
+            self.assertIsInstance(timer, Timer)
+            with self.assertLogs("authlink.metrics", "WARNING"):
+                timer.send("consumed", None)
+            # not looked up again on every request
+            timer.send("consumed", None)
+        getaddrinfo.assert_called_once()
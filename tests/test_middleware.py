@@ -1,13 +1,19 @@
 import datetime
 
 from django.conf import settings
-from django.contrib.auth import SESSION_KEY, get_user_model
+from django.contrib.auth import BACKEND_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.middleware import SessionMiddleware
 from django.core.exceptions import ImproperlyConfigured
-from django.test import Client, TestCase
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase
 from django.test.utils import override_settings
 from django.urls import reverse
 from django.utils import timezone
 
+from asgiref.sync import async_to_sync, iscoroutinefunction
+
+from authlink.middleware import AuthLinkWhitelistMiddleware
 from authlink.models import AuthLink
 
 from .utils import mock_now
@@ -81,6 +87,24 @@ class AuthLinkMiddlewareTestCase(TestCase):
             "That URL is not whitelisted for your authentication method.",
         )
 
+    @override_settings(
+        MIDDLEWARE=settings.MIDDLEWARE + ("authlink.middleware.AuthLinkWhitelistMiddleware",),
+        AUTHLINK_URL_WHITELIST=[],
+        AUTHLINK_SESSION_MARKER_COOKIE="authlink_marker",
+    )
+    def test_middleware_active_marked_session(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("authenticated_view"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("authlink_marker", self.client.cookies)
+        self.client.get(
+            reverse("authlink_use", kwargs={"key": self.authlink.key}),
+            REMOTE_ADDR=self.ipaddress,
+        )
+        # the marker no longer vouches for the session logging in cycled
+        response = self.client.get(reverse("authenticated_view"))
+        self.assertEqual(response.status_code, 403)
+
     @override_settings(MIDDLEWARE=("authlink.middleware.AuthLinkWhitelistMiddleware",))
     def test_middleware_after_session_middleware(self):
         with self.assertRaises(ImproperlyConfigured) as ic:
@@ -93,3 +117,116 @@ class AuthLinkMiddlewareTestCase(TestCase):
                 ic.exception.message,
                 "ImproperlyConfigured: Please ensure you place AuthLinkWhitelistMiddleware middleware after your session middlware.",
             )
+
+
+@override_settings(AUTHLINK_URL_WHITELIST=[])
+class AuthLinkMiddlewareSessionTestCase(TestCase):
+    """
+    The session is only loaded when it could have been established with an
+    authlink.
+    """
+
+    def setUp(self):
+        self.middleware = AuthLinkWhitelistMiddleware(lambda request: HttpResponse())
+
+    def create_session(self, backend):
+        session = SessionStore()
+        session[BACKEND_SESSION_KEY] = backend
+        session.create()
+        return session.session_key
+
+    def get(self, **cookies):
+        request = RequestFactory().get("/some/path/")
+        request.COOKIES.update(cookies)
+        SessionMiddleware(self.middleware).process_request(request)
+        return request, self.call(request)
+
+    def call(self, request):
+        return self.middleware(request)
+
+    def test_no_session_cookie(self):
+        request, response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(request.session.accessed)
+
+    def test_other_session(self):
+        session_key = self.create_session("django.contrib.auth.backends.ModelBackend")
+        request, response = self.get(sessionid=session_key)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(request.session.accessed)
+        self.assertFalse(response.cookies)
+
+    def test_authlink_session(self):
+        session_key = self.create_session(AuthLinkWhitelistMiddleware.backend)
+        request, response = self.get(sessionid=session_key)
+        self.assertEqual(response.status_code, 403)
+
+    def test_session_key_not_from_cookie(self):
+        # as with session middleware taking the key from a header instead
+        session_key = self.create_session(AuthLinkWhitelistMiddleware.backend)
+        request = RequestFactory().get("/some/path/")
+        request.session = SessionStore(session_key)
+        self.assertEqual(self.call(request).status_code, 403)
+
+    @override_settings(AUTHLINK_SESSION_MARKER_COOKIE="authlink_marker")
+    def test_marker(self):
+        session_key = self.create_session("django.contrib.auth.backends.ModelBackend")
+        request, response = self.get(sessionid=session_key)
+        marker = response.cookies["authlink_marker"]
+        self.assertTrue(marker["httponly"])
+        request, response = self.get(sessionid=session_key, authlink_marker=marker.value)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(request.session.accessed)
+        self.assertFalse(response.cookies)
+        # markers are bound to their session
+        session_key = self.create_session(AuthLinkWhitelistMiddleware.backend)
+        request, response = self.get(sessionid=session_key, authlink_marker=marker.value)
+        self.assertEqual(response.status_code, 403)
+        request, response = self.get(sessionid=session_key, authlink_marker="forged")
+        self.assertEqual(response.status_code, 403)
+
+
+class AsyncAuthLinkMiddlewareSessionTestCase(AuthLinkMiddlewareSessionTestCase):
+    def setUp(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        self.middleware = AuthLinkWhitelistMiddleware(get_response)
+
+    def call(self, request):
+        return async_to_sync(self.middleware)(request)
+
+    def test_async_mode(self):
+        self.assertTrue(iscoroutinefunction(self.middleware))
+        sync_middleware = AuthLinkWhitelistMiddleware(lambda request: HttpResponse())
+        self.assertFalse(iscoroutinefunction(sync_middleware))
+
+
+@mock_now
+@override_settings(
+    MIDDLEWARE=settings.MIDDLEWARE + ("authlink.middleware.AuthLinkWhitelistMiddleware",),
+    AUTHLINK_URL_WHITELIST=[],
+)
+class AsyncAuthLinkMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="luke", email="luke@...", password="top_secret"
+        )
+        self.ipaddress = "201.21.121.1"
+        now = timezone.now()
+        self.authlink = AuthLink.objects.create(
+            user=self.user,
+            ipaddress=self.ipaddress,
+            created=now,
+            expires=now + datetime.timedelta(seconds=settings.AUTHLINK_TTL_SECONDS),
+            url=TEST_URL,
+        )
+
+    async def test_url_not_whitelisted(self):
+        response = await self.async_client.get(
+            reverse("async_authlink_use", kwargs={"key": self.authlink.key}),
+            headers={"x-forwarded-for": self.ipaddress},
+        )
+        self.assertEqual(response.status_code, 301)
+        response = await self.async_client.get(reverse("authenticated_view"))
+        self.assertEqual(response.status_code, 403)
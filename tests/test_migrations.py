@@ -0,0 +1,25 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+
+from authlink.models import HashedAuthLink
+
+
+class MigrationsTestCase(TestCase):
+    def test_no_missing_migrations(self):
+        call_command("makemigrations", "authlink", check=True, dry_run=True, stdout=StringIO())
+
+    def test_digest_column_sql(self):
+        field = HashedAuthLink._meta.get_field("digest")
+        sql, _ = connection.schema_editor().column_sql(HashedAuthLink, field)
+        self.assertEqual(sql, "BLOB NOT NULL PRIMARY KEY")
+
+    def test_digest_column_types(self):
+        # BLOB types can't be primary keys on MySQL and Oracle
+        field = HashedAuthLink._meta.get_field("digest")
+        for vendor, db_type in (("mysql", "varbinary(32)"), ("oracle", "RAW(32)")):
+            with self.subTest(vendor=vendor):
+                self.assertEqual(field.db_type(mock.Mock(vendor=vendor)), db_type)
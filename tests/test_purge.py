@@ -0,0 +1,84 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from authlink.models import AuthLink, HashedAuthLink
+from authlink.purge import purge_authlinks
+
+
+class PurgeTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="luke", email="luke@...", password="top_secret"
+        )
+        now = timezone.now()
+        for expires, used in (
+            (now + datetime.timedelta(seconds=60), None),
+            (now + datetime.timedelta(seconds=60), None),
+            (now + datetime.timedelta(seconds=60), now),
+            (now - datetime.timedelta(seconds=1), None),
+            (now - datetime.timedelta(seconds=1), None),
+            (now - datetime.timedelta(seconds=1), now),
+            (now, None),
+        ):
+            AuthLink.objects.create(
+                user=self.user,
+                ipaddress="177.139.233.133",
+                expires=expires,
+                used=used,
+                url="/some/url",
+            )
+
+    def test_purge(self):
+        self.assertEqual(purge_authlinks(), 5)
+        self.assertEqual(AuthLink.objects.count(), 2)
+        self.assertFalse(AuthLink.objects.filter(used__isnull=False).exists())
+
+    def test_purge_batched(self):
+        with self.assertNumQueries(6):
+            # three selects, three deletes
+            self.assertEqual(purge_authlinks(batch_size=2), 5)
+        self.assertEqual(AuthLink.objects.count(), 2)
+
+    def test_purge_dry_run(self):
+        self.assertEqual(purge_authlinks(dry_run=True), 5)
+        self.assertEqual(AuthLink.objects.count(), 7)
+
+    @mock.patch("authlink.purge.time.sleep")
+    def test_purge_sleep(self, sleep):
+        purge_authlinks(batch_size=2, sleep=0.5)
+        self.assertEqual(sleep.call_args_list, [mock.call(0.5), mock.call(0.5)])
+
+    @mock.patch("authlink.purge.time.monotonic", side_effect=[0, 5, 11])
+    def test_purge_max_runtime(self, _):
+        self.assertEqual(purge_authlinks(batch_size=2, max_runtime=10), 4)
+        self.assertEqual(AuthLink.objects.count(), 3)
+
+    def test_command(self):
+        stdout = StringIO()
+        call_command("purge_authlinks", "--batch-size=2", stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "Deleted 5 authlinks.\n")
+
+    def test_command_dry_run(self):
+        stdout = StringIO()
+        call_command("purge_authlinks", "--dry-run", stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "5 authlinks would be deleted.\n")
+        self.assertEqual(AuthLink.objects.count(), 7)
+
+    @override_settings(AUTHLINK_STORAGE_CLASS="authlink.storage.HashedModelAuthLinkStorage")
+    def test_command_after_hashing(self):
+        call_command("hash_authlinks", stdout=StringIO())
+        self.assertEqual(HashedAuthLink.objects.count(), 2)
+        HashedAuthLink.objects.update(used=timezone.now())
+        stdout = StringIO()
+        call_command("purge_authlinks", stdout=stdout)
+        # the used and expired links hash_authlinks left behind go too
+        self.assertEqual(stdout.getvalue(), "Deleted 7 authlinks.\n")
+        self.assertFalse(AuthLink.objects.exists())
+        self.assertFalse(HashedAuthLink.objects.exists())
@@ -0,0 +1,255 @@
+import datetime
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from authlink.models import AuthLink
+from authlink.ratelimit import (
+    CacheRateLimitStore,
+    LocalRateLimitStore,
+    RateLimiter,
+    get_rate_limiter,
+    get_rate_limiters,
+    parse_rate,
+)
+from authlink.signals import authlink_rejected
+
+
+TEST_URL = "/very/specific/url/"
+
+
+class RateLimiterTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate("10/s"), (10, 1))
+        self.assertEqual(parse_rate("10/m"), (10, 60))
+        self.assertEqual(parse_rate("100/5m"), (100, 300))
+        self.assertEqual(parse_rate("1/d"), (1, 86400))
+        with self.assertRaises(ImproperlyConfigured):
+            parse_rate("10 per minute")
+        with self.assertRaises(ImproperlyConfigured):
+            parse_rate("10/0m")
+
+    @mock.patch("authlink.ratelimit.time.time", return_value=6000)
+    def test_hit(self, now):
+        limiter = RateLimiter("2/m", LocalRateLimitStore())
+        self.assertTrue(limiter.hit("a"))
+        self.assertTrue(limiter.hit("a"))
+        self.assertFalse(limiter.hit("a"))
+        self.assertTrue(limiter.hit("b"))
+
+    @mock.patch("authlink.ratelimit.time.time", return_value=6000)
+    def test_check_cost(self, now):
+        for store in (LocalRateLimitStore(), CacheRateLimitStore("default")):
+            limiter = RateLimiter("4/m", store)
+            self.assertIsNone(limiter.check("a", 3))
+            self.assertIsNone(limiter.check("a"))
+            self.assertIsNotNone(limiter.check("a", 2))
+            self.assertIsNotNone(limiter.check("b", 5))
+
+    @mock.patch("authlink.ratelimit.time.time", return_value=6000)
+    def test_sliding_window(self, now):
+        limiter = RateLimiter("4/m", CacheRateLimitStore("default"))
+        for _ in range(4):
+            self.assertTrue(limiter.hit("a"))
+        # a quarter into the next period, three of the last four count
+        now.return_value = 6075
+        self.assertTrue(limiter.hit("a"))
+        self.assertFalse(limiter.hit("a"))
+        # two periods on, the first has left the window
+        now.return_value = 6180
+        self.assertTrue(limiter.hit("a"))
+
+    @mock.patch("authlink.ratelimit.time.time", return_value=6000)
+    def test_check_retry_after(self, now):
+        limiter = RateLimiter("2/m", LocalRateLimitStore())
+        self.assertIsNone(limiter.check("a"))
+        self.assertIsNone(limiter.check("a"))
+        # 3 hits this period, so the next is allowed 40s into the next one
+        self.assertEqual(limiter.check("a"), 100)
+
+    @mock.patch("authlink.ratelimit.time.time", return_value=6000)
+    def test_check_retry_after_sliding(self, now):
+        limiter = RateLimiter("4/m", LocalRateLimitStore())
+        for _ in range(4):
+            limiter.check("a")
+        now.return_value = 6075
+        self.assertIsNone(limiter.check("a"))
+        # allowed again once only a quarter of the previous period counts
+        self.assertEqual(limiter.check("a"), 30)
+        now.return_value = 6105
+        self.assertIsNone(limiter.check("a"))
+
+    @mock.patch("authlink.ratelimit.time.monotonic", return_value=100)
+    def test_local_store(self, monotonic):
+        store = LocalRateLimitStore(max_entries=2)
+        self.assertEqual(store.incr("a", 10), 1)
+        self.assertEqual(store.incr("a", 10), 2)
+        self.assertEqual(store.get("a"), 2)
+        monotonic.return_value = 110
+        self.assertEqual(store.get("a"), 0)
+        self.assertEqual(store.incr("a", 10), 1)
+        store.incr("b", 10)
+        store.incr("c", 10)
+        self.assertEqual(list(store.entries), ["b", "c"])
+
+    def test_cache_store(self):
+        store = CacheRateLimitStore("default")
+        self.assertEqual(store.incr("a", 10), 1)
+        self.assertEqual(store.incr("a", 10), 2)
+        self.assertEqual(store.get("a"), 2)
+        self.assertEqual(store.get("b"), 0)
+
+    async def test_async(self):
+        limiter = RateLimiter("1/m", CacheRateLimitStore("default"))
+        self.assertTrue(await limiter.ahit("a"))
+        self.assertFalse(await limiter.ahit("a"))
+
+    def test_get_rate_limiter(self):
+        self.assertIsNone(get_rate_limiter("create"))
+        with override_settings(AUTHLINK_RATELIMIT_CREATE="5/h"):
+            limiter = get_rate_limiter("create")
+            self.assertEqual((limiter.limit, limiter.period), (5, 3600))
+            self.assertIsInstance(limiter.store, LocalRateLimitStore)
+            self.assertIs(get_rate_limiter("create"), limiter)
+            self.assertIsNone(get_rate_limiter("consume"))
+        with override_settings(
+            AUTHLINK_RATELIMIT_CONSUME="5/h", AUTHLINK_RATELIMIT_CACHE_ALIAS="default"
+        ):
+            self.assertIsInstance(get_rate_limiter("consume").store, CacheRateLimitStore)
+
+
+@override_settings(
+    AUTHLINK_URL_WHITELIST=[r"^/very/specific/url/$"],
+    AUTHLINK_RATELIMIT_CREATE="1/m",
+    AUTHLINK_RATELIMIT_CONSUME="1/m",
+)
+class RateLimitViewTestCase(TestCase):
+    def setUp(self):
+        get_rate_limiters.cache_clear()
+        self.user = get_user_model().objects.create_user(
+            username="luke", email="luke@...", password="top_secret"
+        )
+        self.ipaddress = "201.21.121.1"
+
+    def create_authlink(self):
+        now = timezone.now()
+        return AuthLink.objects.create(
+            user=self.user,
+            ipaddress=self.ipaddress,
+            expires=now + datetime.timedelta(seconds=60),
+            url=TEST_URL,
+        )
+
+    def assertRetryAfter(self, response):
+        # the rejected request counts too, so it's into the next period
+        self.assertTrue(60 <= int(response["Retry-After"]) <= 120)
+
+    def assertConsumeLimited(self, url_name):
+        keys = [self.create_authlink().key for _ in range(2)]
+        urls = [reverse(url_name, kwargs={"key": key}) for key in keys]
+        response = self.client.get(urls[0], REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.get("Location"), TEST_URL)
+        receiver = mock.Mock()
+        authlink_rejected.connect(receiver)
+        self.addCleanup(authlink_rejected.disconnect, receiver)
+        response = self.client.get(urls[1], REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.status_code, 429)
+        self.assertRetryAfter(response)
+        self.assertEqual(receiver.call_args.kwargs["reason"], "rate_limited")
+        self.assertFalse(AuthLink.objects.get(pk=keys[1]).used)
+        # limits are per IP address
+        response = self.client.get(urls[1], REMOTE_ADDR="201.21.121.2")
+        self.assertNotEqual(response.status_code, 429)
+
+    def test_consume(self):
+        self.assertConsumeLimited("authlink_use")
+
+    def test_consume_async(self):
+        self.assertConsumeLimited("async_authlink_use")
+
+    def test_consume_unknown_address(self):
+        # private addresses can't be told apart, so don't share one limit
+        url = reverse("authlink_use", kwargs={"key": self.create_authlink().key})
+        for _ in range(2):
+            response = self.client.get(url, REMOTE_ADDR="10.0.0.1")
+            self.assertNotEqual(response.status_code, 429)
+
+    def assertCreateLimited(self, url_name):
+        self.client.force_login(self.user)
+        data = {"url": TEST_URL}
+        response = self.client.post(reverse(url_name), data=data, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(reverse(url_name), data=data, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.status_code, 429)
+        self.assertRetryAfter(response)
+        self.assertEqual(AuthLink.objects.count(), 1)
+        # limits are per user
+        other = get_user_model().objects.create_user(username="leia")
+        self.client.force_login(other)
+        response = self.client.post(reverse(url_name), data=data, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.status_code, 201)
+
+    def test_create_json(self):
+        self.assertCreateLimited("authlink_generate_json")
+
+    def test_create_json_async(self):
+        self.assertCreateLimited("authlink_generate_json_async")
+
+    def test_create_rest_framework(self):
+        client = APIClient(format="json")
+        client.force_authenticate(user=self.user)
+        url = reverse("authlink_generate")
+        response = client.post(url, data={"url": TEST_URL}, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.status_code, 201)
+        response = client.post(url, data={"url": TEST_URL}, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.status_code, 429)
+        self.assertRetryAfter(response)
+        response = client.post(
+            reverse("authlink_bulk_generate"), data={"urls": [TEST_URL]}, REMOTE_ADDR=self.ipaddress
+        )
+        self.assertEqual(response.status_code, 429)
+
+    def assertBulkCreateLimited(self, client, url_name):
+        url = reverse(url_name)
+        data = {"urls": [TEST_URL] * 2}
+        response = client.post(url, data=data, format="json", REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.status_code, 201)
+        # each link counts, not each request
+        response = client.post(url, data=data, format="json", REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response["Retry-After"]), 0)
+        self.assertEqual(AuthLink.objects.count(), 2)
+        client.force_login(get_user_model().objects.create_user(username="leia"))
+        data = {"urls": [TEST_URL] * 4}
+        response = client.post(url, data=data, format="json", REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(AuthLink.objects.count(), 2)
+
+    @override_settings(AUTHLINK_RATELIMIT_CREATE="3/m")
+    def test_bulk_create_json(self):
+        client = APIClient()
+        client.force_login(self.user)
+        self.assertBulkCreateLimited(client, "authlink_bulk_generate_json")
+
+    @override_settings(AUTHLINK_RATELIMIT_CREATE="3/m")
+    def test_bulk_create_json_async(self):
+        client = APIClient()
+        client.force_login(self.user)
+        self.assertBulkCreateLimited(client, "authlink_bulk_generate_json_async")
+
+    @override_settings(AUTHLINK_RATELIMIT_CREATE="3/m")
+    def test_bulk_create_rest_framework(self):
+        client = APIClient()
+        client.force_login(self.user)
+        self.assertBulkCreateLimited(client, "authlink_bulk_generate")
@@ -0,0 +1,106 @@
+import datetime
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.db import connections
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from authlink.models import AuthLink
+from authlink.purge import purge_authlinks
+from authlink.routers import AuthLinkRouter, get_read_database
+from authlink.storage import get_storage
+
+
+TEST_URL = "/very/specific/url/"
+
+
+class ReplicaRouter:
+    """
+    Sends every read to a replica that never catches up.
+    """
+
+    def db_for_read(self, model, **hints):
+        return "replica"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+class AuthLinkRouterTestCase(SimpleTestCase):
+    def setUp(self):
+        self.router = AuthLinkRouter()
+
+    def test_unconfigured(self):
+        self.assertIsNone(self.router.db_for_read(AuthLink))
+        self.assertIsNone(self.router.db_for_write(AuthLink))
+        self.assertIsNone(self.router.allow_migrate("default", "authlink"))
+
+    @override_settings(AUTHLINK_DATABASE="authlinks")
+    def test_configured(self):
+        self.assertEqual(self.router.db_for_read(AuthLink), "authlinks")
+        self.assertEqual(self.router.db_for_write(AuthLink), "authlinks")
+        self.assertIsNone(self.router.db_for_read(get_user_model()))
+        self.assertTrue(self.router.allow_migrate("authlinks", "authlink"))
+        self.assertFalse(self.router.allow_migrate("default", "authlink"))
+        self.assertIsNone(self.router.allow_migrate("default", "auth"))
+        user = get_user_model()(pk=1)
+        self.assertTrue(self.router.allow_relation(AuthLink(), user))
+        self.assertIsNone(self.router.allow_relation(user, Session()))
+
+    @override_settings(
+        AUTHLINK_DATABASE="authlinks", DATABASE_ROUTERS=["authlink.routers.AuthLinkRouter"]
+    )
+    def test_storage(self):
+        self.assertEqual(get_storage().get_database(), "authlinks")
+        self.assertEqual(get_storage().get_queryset().db, "authlinks")
+        self.assertEqual(get_read_database(AuthLink), "authlinks")
+        with self.settings(AUTHLINK_READ_DATABASE="replica"):
+            self.assertEqual(get_read_database(AuthLink), "replica")
+
+
+@override_settings(DATABASE_ROUTERS=["tests.test_routers.ReplicaRouter"])
+class ReplicaTestCase(TestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="luke", email="luke@...", password="top_secret"
+        )
+        self.ipaddress = "201.21.121.1"
+        self.authlink = AuthLink.objects.create(
+            user=self.user,
+            ipaddress=self.ipaddress,
+            expires=timezone.now() + datetime.timedelta(seconds=60),
+            url=TEST_URL,
+        )
+
+    def test_consume_reads_primary(self):
+        url = reverse("authlink_use", kwargs={"key": self.authlink.key})
+        with CaptureQueriesContext(connections["replica"]) as replica:
+            response = self.client.get(url, REMOTE_ADDR=self.ipaddress)
+            self.assertEqual(response.get("Location"), TEST_URL)
+            # looked up on the primary to tell it's used, not missing
+            response = self.client.get(url, REMOTE_ADDR=self.ipaddress)
+            self.assertEqual(response.status_code, 301)
+            self.assertEqual(response.get("Location"), "/")
+        # only sessions are read from the replica
+        self.assertFalse(any("authlink" in query["sql"] for query in replica))
+
+    async def test_aget_reads_primary(self):
+        self.assertIsNotNone(await get_storage().aget(self.authlink.key))
+
+    def test_purge_scans_read_database(self):
+        AuthLink.objects.filter(pk=self.authlink.pk).update(used=timezone.now())
+        # the replica has yet to see it
+        self.assertEqual(purge_authlinks(), 0)
+        with self.settings(AUTHLINK_READ_DATABASE="default"):
+            self.assertEqual(purge_authlinks(dry_run=True), 1)
+            with self.assertNumQueries(0, using="replica"):
+                self.assertEqual(purge_authlinks(), 1)
+        self.assertFalse(AuthLink.objects.using("default").exists())
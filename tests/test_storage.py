@@ -0,0 +1,494 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import SESSION_KEY, get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from authlink.models import AuthLink, HashedAuthLink
+from authlink.storage import (
+    CacheAuthLinkStorage,
+    CachedModelAuthLinkStorage,
+    HashedModelAuthLinkStorage,
+    ModelAuthLinkStorage,
+    SignedAuthLinkStorage,
+    get_storage,
+    hash_authlinks,
+)
+from authlink.utils import hash_authlink_key
+
+from .utils import mock_now
+
+
+class StorageTestMixin:
+    storage_class = None
+
+    def setUp(self):
+        cache.clear()
+        self.storage = self.storage_class()
+        self.user = get_user_model().objects.create_user(
+            username="luke", email="luke@...", password="top_secret"
+        )
+        self.now = timezone.now().replace(microsecond=0)
+        self.authlink = self.storage.build(
+            user=self.user,
+            ipaddress="177.139.233.133",
+            created=self.now,
+            expires=self.now + datetime.timedelta(seconds=60),
+            url="/some/url",
+        )
+        self.storage.save(self.authlink)
+
+    def test_get(self):
+        authlink = self.storage.get(self.authlink.key)
+        self.assertEqual(authlink.key, self.authlink.key)
+        self.assertEqual(authlink.user, self.user)
+        self.assertEqual(authlink.url, "/some/url")
+        self.assertEqual(authlink.ipaddress, "177.139.233.133")
+        self.assertEqual(authlink.expires, self.authlink.expires)
+        self.assertIsNone(authlink.used)
+
+    def test_get_missing(self):
+        self.assertIsNone(self.storage.get("doesnotexist"))
+
+    def test_claim(self):
+        authlink = self.storage.claim(self.authlink.key, self.now)
+        self.assertEqual(authlink.key, self.authlink.key)
+        self.assertEqual(authlink.used, self.now)
+        self.assertEqual(self.storage.get(self.authlink.key).used, self.now)
+        self.assertIsNone(self.storage.claim(self.authlink.key, self.now))
+
+    def test_claim_expired(self):
+        self.assertIsNone(self.storage.claim(self.authlink.key, self.authlink.expires))
+        self.assertIsNone(self.storage.get(self.authlink.key).used)
+
+    def test_claim_missing(self):
+        self.assertIsNone(self.storage.claim("doesnotexist", self.now))
+
+    def test_release(self):
+        authlink = self.storage.claim(self.authlink.key, self.now)
+        self.storage.release(authlink)
+        self.assertIsNone(authlink.used)
+        self.assertIsNone(self.storage.get(self.authlink.key).used)
+        self.assertIsNotNone(self.storage.claim(self.authlink.key, self.now))
+
+    def test_use(self):
+        self.storage.use(self.authlink, self.now)
+        self.assertEqual(self.storage.get(self.authlink.key).used, self.now)
+        self.assertIsNone(self.storage.claim(self.authlink.key, self.now))
+
+    def test_bulk_save(self):
+        authlinks = [
+            self.storage.build(
+                user=self.user,
+                ipaddress="177.139.233.133",
+                created=self.now,
+                expires=self.now + datetime.timedelta(seconds=60),
+                url=f"/bulk/{i}",
+            )
+            for i in range(3)
+        ]
+        self.storage.bulk_save(authlinks)
+        for i, authlink in enumerate(authlinks):
+            self.assertEqual(self.storage.get(authlink.key).url, f"/bulk/{i}")
+
+    async def test_async(self):
+        authlink = self.storage.build(
+            user_id=self.user.pk,
+            ipaddress="177.139.233.133",
+            created=self.now,
+            expires=self.now + datetime.timedelta(seconds=60),
+            url="/other/url",
+        )
+        await self.storage.asave(authlink)
+        self.assertEqual((await self.storage.aget(authlink.key)).url, "/other/url")
+        self.assertIsNone(await self.storage.aget("doesnotexist"))
+        self.assertIsNone(await self.storage.aclaim(authlink.key, authlink.expires))
+        claimed = await self.storage.aclaim(authlink.key, self.now)
+        self.assertEqual(claimed.used, self.now)
+        self.assertIsNone(await self.storage.aclaim(authlink.key, self.now))
+        await self.storage.arelease(claimed)
+        self.assertIsNone((await self.storage.aget(authlink.key)).used)
+        await self.storage.ause(claimed, self.now)
+        self.assertEqual((await self.storage.aget(authlink.key)).used, self.now)
+        bulk = self.storage.build(
+            user_id=self.user.pk,
+            ipaddress="177.139.233.133",
+            created=self.now,
+            expires=self.now + datetime.timedelta(seconds=60),
+            url="/bulk/url",
+        )
+        await self.storage.abulk_save([bulk])
+        self.assertEqual((await self.storage.aget(bulk.key)).url, "/bulk/url")
+
+
+class ModelAuthLinkStorageTestCase(StorageTestMixin, TestCase):
+    storage_class = ModelAuthLinkStorage
+
+    def test_save(self):
+        self.assertTrue(AuthLink.objects.filter(key=self.authlink.key).exists())
+
+
+class HashedModelAuthLinkStorageTestCase(StorageTestMixin, TestCase):
+    storage_class = HashedModelAuthLinkStorage
+
+    def test_save(self):
+        self.assertFalse(AuthLink.objects.exists())
+        hashed = HashedAuthLink.objects.get()
+        self.assertEqual(bytes(hashed.digest), hash_authlink_key(self.authlink.key))
+        self.assertIsNone(hashed.key)
+
+    @override_settings(AUTHLINK_KEY_DIGEST_SIZE=16)
+    def test_truncated_digest(self):
+        authlink = self.storage.build(
+            user=self.user, ipaddress="177.139.233.133", expires=self.now, url="/some/url"
+        )
+        self.storage.save(authlink)
+        self.assertEqual(len(bytes(HashedAuthLink.objects.get(pk=authlink.digest).digest)), 16)
+        self.assertEqual(self.storage.get(authlink.key).url, "/some/url")
+
+    def test_hash_authlinks(self):
+        created = [
+            AuthLink.objects.create(
+                user=self.user,
+                ipaddress="177.139.233.133",
+                expires=self.now + datetime.timedelta(seconds=60),
+                url=f"/old/{i}",
+                used=self.now if i == 2 else None,
+            )
+            for i in range(3)
+        ]
+        self.assertEqual(hash_authlinks(batch_size=1), 2)
+        self.assertEqual(list(AuthLink.objects.all()), [created[2]])
+        for i, authlink in enumerate(created[:2]):
+            self.assertEqual(self.storage.get(authlink.key).url, f"/old/{i}")
+            self.assertIsNotNone(self.storage.claim(authlink.key, self.now))
+
+    def test_hash_authlinks_command(self):
+        AuthLink.objects.create(
+            user=self.user,
+            ipaddress="177.139.233.133",
+            expires=self.now + datetime.timedelta(seconds=60),
+            url="/old/",
+        )
+        stdout = StringIO()
+        call_command("hash_authlinks", stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "Moved 1 authlinks.\n")
+        self.assertEqual(HashedAuthLink.objects.count(), 2)
+
+
+@override_settings(AUTHLINK_DELETE_ON_CONSUME=True, AUTHLINK_TOMBSTONE_CACHE_ALIAS="default")
+class DeleteOnConsumeStorageTestCase(StorageTestMixin, TestCase):
+    storage_class = ModelAuthLinkStorage
+
+    def test_claim_deletes(self):
+        with self.assertNumQueries(1):
+            authlink = self.storage.claim(self.authlink.key, self.now)
+        self.assertEqual(authlink.user, self.user)
+        self.assertEqual(authlink.used, self.now)
+        self.assertFalse(self.storage.model.objects.exists())
+        tombstone = self.storage.get(self.authlink.key)
+        self.assertEqual(tombstone.user_id, self.user.pk)
+        self.assertEqual(tombstone.expires, self.authlink.expires)
+
+    @mock.patch("authlink.models.supports_update_returning", return_value=False)
+    def test_claim_without_returning(self, _):
+        authlink = self.storage.claim(self.authlink.key, self.now)
+        self.assertEqual(authlink.used, self.now)
+        self.assertFalse(self.storage.model.objects.exists())
+        self.assertIsNone(self.storage.claim(self.authlink.key, self.now))
+
+    def test_use_deletes(self):
+        self.storage.use(self.authlink, self.now)
+        self.assertFalse(self.storage.model.objects.exists())
+
+    def test_without_tombstones(self):
+        with self.settings(AUTHLINK_TOMBSTONE_CACHE_ALIAS=None):
+            self.assertIsNotNone(self.storage.claim(self.authlink.key, self.now))
+            self.assertIsNone(self.storage.get(self.authlink.key))
+
+    def test_tombstone_failure(self):
+        with self.assertLogs("authlink.storage", "WARNING"):
+            with mock.patch.object(cache, "set", side_effect=ConnectionError):
+                self.assertIsNotNone(self.storage.claim(self.authlink.key, self.now))
+        self.assertIsNone(self.storage.get(self.authlink.key))
+
+
+class DeleteOnConsumeHashedStorageTestCase(DeleteOnConsumeStorageTestCase):
+    storage_class = HashedModelAuthLinkStorage
+
+
+class CachedModelAuthLinkStorageTestCase(StorageTestMixin, TestCase):
+    storage_class = CachedModelAuthLinkStorage
+
+    def build(self):
+        return self.storage.build(
+            user=self.user,
+            ipaddress="177.139.233.133",
+            created=self.now,
+            expires=self.now + datetime.timedelta(seconds=60),
+            url="/other/url",
+        )
+
+    def test_save(self):
+        self.assertTrue(AuthLink.objects.filter(key=self.authlink.key).exists())
+        # not until the transaction commits
+        self.assertIsNone(self.storage.peek(self.authlink.key))
+
+    def test_peek(self):
+        authlink = self.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.storage.save(authlink)
+        with self.assertNumQueries(0):
+            snapshot = self.storage.peek(authlink.key)
+        self.assertEqual(snapshot.key, authlink.key)
+        self.assertEqual(snapshot.user_id, self.user.pk)
+        self.assertEqual(snapshot.url, "/other/url")
+        self.assertEqual(snapshot.ipaddress, "177.139.233.133")
+        self.assertEqual(snapshot.expires, authlink.expires)
+        self.assertIsNone(snapshot.used)
+        self.assertIsNone(self.storage.peek("doesnotexist"))
+
+    def test_bulk_peek(self):
+        authlinks = [self.build() for _ in range(2)]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.storage.bulk_save(authlinks)
+        for authlink in authlinks:
+            self.assertEqual(self.storage.peek(authlink.key).url, "/other/url")
+
+    def test_cache_failure(self):
+        authlink = self.build()
+        with self.assertLogs("authlink.storage", "WARNING"):
+            with mock.patch.object(cache, "set_many", side_effect=ConnectionError):
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.storage.save(authlink)
+        self.assertEqual(self.storage.get(authlink.key).url, "/other/url")
+        self.assertIsNone(self.storage.peek(authlink.key))
+        with self.assertLogs("authlink.storage", "WARNING"):
+            with mock.patch.object(cache, "get", side_effect=ConnectionError):
+                self.assertIsNone(self.storage.peek(self.authlink.key))
+
+    async def test_apeek(self):
+        authlink = self.build()
+        authlink.user = None
+        authlink.user_id = self.user.pk
+        await self.storage.asave(authlink)
+        self.assertEqual((await self.storage.apeek(authlink.key)).url, "/other/url")
+        self.assertIsNone(await self.storage.apeek("doesnotexist"))
+        with self.assertLogs("authlink.storage", "WARNING"):
+            with mock.patch.object(cache, "aget", side_effect=ConnectionError):
+                self.assertIsNone(await self.storage.apeek(authlink.key))
+
+
+class CacheAuthLinkStorageTestCase(StorageTestMixin, TestCase):
+    storage_class = CacheAuthLinkStorage
+
+    def test_save(self):
+        self.assertFalse(AuthLink.objects.exists())
+
+    def test_save_duplicate_key(self):
+        with self.assertRaises(IntegrityError):
+            self.storage.save(self.authlink)
+
+    def test_save_ipaddress_missing(self):
+        self.authlink.ipaddress = None
+        with self.assertRaises(ValidationError):
+            self.storage.save(self.authlink)
+
+    def test_timeout(self):
+        self.assertEqual(self.storage.timeout(self.authlink, self.now), 60 + 60)
+        self.assertEqual(
+            self.storage.timeout(self.authlink, self.authlink.expires + datetime.timedelta(1)),
+            60,
+        )
+
+
+class SignedAuthLinkStorageTestCase(StorageTestMixin, TestCase):
+    storage_class = SignedAuthLinkStorage
+
+    def test_save(self):
+        self.assertFalse(AuthLink.objects.exists())
+        self.assertIsNone(cache.get(self.storage.record_key(self.authlink.key)))
+
+    def test_save_ipaddress_missing(self):
+        self.authlink.ipaddress = None
+        with self.assertRaises(ValidationError):
+            self.storage.save(self.authlink)
+
+    def test_claim_no_queries(self):
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(self.storage.claim(self.authlink.key, self.now))
+
+    def test_tampered(self):
+        self.assertIsNone(self.storage.get(self.authlink.key[:-1]))
+        self.assertIsNone(self.storage.claim(self.authlink.key[:-1], self.now))
+        self.assertIsNone(SignedAuthLinkStorage().get(self.authlink.key.replace(":", ":x", 1)))
+
+    def test_keys_unique(self):
+        other = self.storage.build(
+            **{
+                field: getattr(self.authlink, field)
+                for field in ("user", "url", "ipaddress", "created", "expires")
+            }
+        )
+        self.storage.save(other)
+        self.assertNotEqual(other.key, self.authlink.key)
+        self.assertNotEqual(
+            self.storage.used_key(other.key), self.storage.used_key(self.authlink.key)
+        )
+
+
+class GetStorageTestCase(TestCase):
+    def test_default(self):
+        self.assertIsInstance(get_storage(), ModelAuthLinkStorage)
+        self.assertIs(get_storage(), get_storage())
+
+    @override_settings(AUTHLINK_STORAGE_CLASS="authlink.storage.CacheAuthLinkStorage")
+    def test_configurable(self):
+        self.assertIsInstance(get_storage(), CacheAuthLinkStorage)
+
+
+@mock_now
+@override_settings(AUTHLINK_STORAGE_CLASS="authlink.storage.CacheAuthLinkStorage")
+class CacheAuthLinkStorageViewTestCase(TestCase):
+    # also run for HashedModelAuthLinkStorage and SignedAuthLinkStorage below
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = get_user_model().objects.create_user(
+            username="luke", email="luke@...", password="top_secret"
+        )
+        self.ipaddress = "201.21.121.1"
+        now = timezone.now()
+        self.authlink = get_storage().build(
+            user=self.user,
+            ipaddress=self.ipaddress,
+            created=now,
+            expires=now + datetime.timedelta(seconds=60),
+            url="/very/specific/url/",
+        )
+        get_storage().save(self.authlink)
+
+    def test_use_ok(self):
+        url = reverse("authlink_use", kwargs={"key": self.authlink.key})
+        response = self.client.get(url, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.get("Location"), "/very/specific/url/")
+        self.assertEqual(int(self.client.session[SESSION_KEY]), self.user.pk)
+        response = Client().get(url, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.get("Location"), "/")
+
+    def test_use_missing(self):
+        response = self.client.get(
+            reverse("authlink_use", kwargs={"key": "doesnotexist"}), REMOTE_ADDR=self.ipaddress
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_use_transaction(self):
+        # only storages in the database have a claim to make atomic
+        url = reverse("authlink_use", kwargs={"key": self.authlink.key})
+        with mock.patch("authlink.views.transaction") as transaction:
+            response = self.client.get(url, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.get("Location"), "/very/specific/url/")
+        self.assertEqual(transaction.atomic.called, get_storage().get_database() is not None)
+
+    @override_settings(AUTHLINK_KEY_FILTER=True)
+    def test_use_address_mismatch_not_claimed(self):
+        # a claim in the cache is seen by other requests straight away, so
+        # the right address would find the link used while one was held
+        url = reverse("authlink_use", kwargs={"key": self.authlink.key})
+        storage = get_storage()
+        with mock.patch.object(storage, "claim", wraps=storage.claim) as claim:
+            response = self.client.get(url, REMOTE_ADDR="201.21.121.2")
+            self.assertEqual(response.get("Location"), "/")
+            claim.assert_not_called()
+            response = self.client.get(url, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.get("Location"), "/very/specific/url/")
+
+
+@override_settings(AUTHLINK_STORAGE_CLASS="authlink.storage.CachedModelAuthLinkStorage")
+class CachedModelAuthLinkStorageViewTestCase(CacheAuthLinkStorageViewTestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            super().setUp()
+
+    def test_use_address_mismatch_no_queries(self):
+        url = reverse("authlink_use", kwargs={"key": self.authlink.key})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, REMOTE_ADDR="201.21.121.2")
+        self.assertEqual(response.get("Location"), "/")
+        self.assertIsNone(AuthLink.objects.get(pk=self.authlink.key).used)
+
+    def test_use_used_no_lookup(self):
+        url = reverse("authlink_use", kwargs={"key": self.authlink.key})
+        AuthLink.objects.filter(pk=self.authlink.key).update(used=timezone.now())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.get("Location"), "/")
+        # the failed claim is the only statement, no lookup follows
+        self.assertFalse(any(query["sql"].startswith("SELECT") for query in queries))
+
+    def test_use_expired_no_queries(self):
+        with mock.patch(
+            "django.utils.timezone.now",
+            return_value=self.authlink.expires + datetime.timedelta(seconds=1),
+        ):
+            url = reverse("authlink_use", kwargs={"key": self.authlink.key})
+            with self.assertNumQueries(0):
+                response = self.client.get(url, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.get("Location"), "/")
+
+
+@override_settings(AUTHLINK_STORAGE_CLASS="authlink.storage.HashedModelAuthLinkStorage")
+class HashedModelAuthLinkStorageViewTestCase(CacheAuthLinkStorageViewTestCase):
+    def test_use_address_mismatch_not_claimed(self):
+        self.skipTest("claimed in a transaction, which the mismatch rolls back")
+
+
+@override_settings(
+    AUTHLINK_STORAGE_CLASS="authlink.storage.ModelAuthLinkStorage",
+    AUTHLINK_DELETE_ON_CONSUME=True,
+    AUTHLINK_TOMBSTONE_CACHE_ALIAS="default",
+)
+class DeleteOnConsumeViewTestCase(CacheAuthLinkStorageViewTestCase):
+    def test_use_address_mismatch(self):
+        url = reverse("authlink_use", kwargs={"key": self.authlink.key})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, REMOTE_ADDR="201.21.121.2")
+        self.assertEqual(response.get("Location"), "/")
+        # checked before claiming, so never missing from the table
+        self.assertFalse(any(query["sql"].startswith("DELETE") for query in queries))
+        self.assertIsNone(AuthLink.objects.get(pk=self.authlink.key).used)
+        response = self.client.get(url, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.get("Location"), "/very/specific/url/")
+        self.assertFalse(AuthLink.objects.exists())
+
+    async def test_use_address_mismatch_async(self):
+        url = reverse("async_authlink_use", kwargs={"key": self.authlink.key})
+        with mock.patch.object(ModelAuthLinkStorage, "arelease") as arelease:
+            response = await self.async_client.get(url, headers={"x-forwarded-for": "201.21.121.2"})
+        self.assertEqual(response.get("Location"), "/")
+        arelease.assert_not_called()
+        self.assertTrue(await AuthLink.objects.filter(pk=self.authlink.key).aexists())
+
+
+@override_settings(AUTHLINK_STORAGE_CLASS="authlink.storage.SignedAuthLinkStorage")
+class SignedAuthLinkStorageViewTestCase(CacheAuthLinkStorageViewTestCase):
+    def test_use_expired(self):
+        authlink = get_storage().build(
+            user=self.user,
+            ipaddress=self.ipaddress,
+            expires=timezone.now() - datetime.timedelta(seconds=1),
+            url="/very/specific/url/",
+        )
+        get_storage().save(authlink)
+        url = reverse("authlink_use", kwargs={"key": authlink.key})
+        response = self.client.get(url, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(response.get("Location"), "/")
+        self.assertNotIn(SESSION_KEY, self.client.session)
@@ -0,0 +1,83 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import override_settings
+
+from authlink.models import AuthLink, HashedAuthLink
+from benchmarks.stress import (
+    LOCKED,
+    REJECTED,
+    SUCCEEDED,
+    create_authlink,
+    is_correct,
+    is_used,
+    summarise,
+)
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StressTestCase(SimpleTestCase):
+    def stress(self, *args):
+        process = subprocess.run(
+            [sys.executable, "-m", "benchmarks.stress", "--workers=4", "--rounds=5", *args],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            timeout=120,
+        )
+        self.assertEqual(process.returncode, 0, process.stderr)
+        return json.loads(process.stdout)
+
+    def test_threads(self):
+        summary = self.stress("--mode=thread")
+        self.assertEqual(summary["rounds_with_one_success"], 5)
+        self.assertEqual(summary[REJECTED], 15)
+
+    def test_processes(self):
+        summary = self.stress("--mode=process")
+        self.assertEqual(summary["rounds_with_one_success"], 5)
+        self.assertEqual(summary[REJECTED], 15)
+
+    def test_async(self):
+        summary = self.stress("--mode=thread", "--async")
+        self.assertEqual(summary["rounds_with_one_success"], 5)
+        self.assertEqual(summary[REJECTED], 15)
+
+
+class CreateAuthLinkTestCase(TestCase):
+    @override_settings(AUTHLINK_STORAGE_CLASS="authlink.storage.HashedModelAuthLinkStorage")
+    def test_configured_storage(self):
+        authlink = create_authlink()
+        self.assertFalse(AuthLink.objects.exists())
+        self.assertTrue(HashedAuthLink.objects.exists())
+        self.assertFalse(is_used(authlink.key))
+
+    @override_settings(AUTHLINK_DELETE_ON_CONSUME=True)
+    def test_deleted_on_consume(self):
+        authlink = create_authlink()
+        AuthLink.objects.all().delete()
+        self.assertTrue(is_used(authlink.key))
+
+
+class SummariseTestCase(SimpleTestCase):
+    def test_summarise(self):
+        summary = summarise(
+            [
+                ([(SUCCEEDED, 0.002), (REJECTED, 0.001)], True),
+                ([(SUCCEEDED, 0.004), (SUCCEEDED, 0.003)], True),
+                ([(LOCKED, 0.005), (REJECTED, 0.001)], True),
+            ]
+        )
+        self.assertEqual(summary["requests"], 6)
+        self.assertEqual(summary[SUCCEEDED], 3)
+        self.assertEqual(summary["rounds_with_one_success"], 1)
+        self.assertEqual(summary["rounds_with_many_successes"], 1)
+        self.assertEqual(summary["rounds_used_without_success"], 1)
+        self.assertEqual(summary["latency_ms"]["p50"], 2)
+        self.assertEqual(summary["latency_ms"]["max"], 5)
+        self.assertFalse(is_correct(summary))
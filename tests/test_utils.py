@@ -0,0 +1,97 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from authlink.utils import (
+    VALID_KEY_CHARSET,
+    KeyPool,
+    generate_authlink_key,
+    generate_authlink_keys,
+    get_key_pool,
+    is_valid_authlink_key,
+    random_authlink_keys,
+)
+
+
+def fixed_key():
+    return "fixed"
+
+
+class KeyGenerationTestCase(SimpleTestCase):
+    def test_generate_authlink_key(self):
+        key = generate_authlink_key()
+        self.assertEqual(len(key), 64)
+        self.assertLessEqual(set(key), VALID_KEY_CHARSET)
+
+    @override_settings(AUTHLINK_KEY_LENGTH=32)
+    def test_generate_authlink_key_length(self):
+        self.assertEqual(len(generate_authlink_key()), 32)
+
+    def test_random_authlink_keys(self):
+        keys = random_authlink_keys(1000, length=10)
+        self.assertEqual(len(keys), 1000)
+        self.assertEqual(len(set(keys)), 1000)
+        self.assertTrue(all(len(key) == 10 for key in keys))
+        self.assertLessEqual(set("".join(keys)), VALID_KEY_CHARSET)
+
+    @mock.patch("authlink.utils.os.urandom")
+    def test_random_authlink_keys_rejection_sampling(self, urandom):
+        # 252 and above would skew the distribution, so are skipped; 36 wraps
+        urandom.side_effect = [bytes([0, 252, 255, 1]), bytes([36, 35, 253] + [0] * 16)]
+        self.assertEqual(random_authlink_keys(2, length=2), ["ab", "a9"])
+
+    @override_settings(AUTHLINK_KEY_GENERATOR="tests.test_utils.fixed_key")
+    def test_generator_configurable(self):
+        self.assertEqual(generate_authlink_key(), "fixed")
+        self.assertEqual(generate_authlink_keys(2), ["fixed", "fixed"])
+        self.assertIsNone(get_key_pool())
+        self.assertTrue(is_valid_authlink_key("fixed"))
+        self.assertFalse(is_valid_authlink_key("x" * 65))
+
+    @override_settings(AUTHLINK_KEY_POOL_SIZE=10)
+    def test_pool(self):
+        pool = get_key_pool()
+        keys = generate_authlink_keys(3)
+        self.assertEqual(len(pool.keys), 7)
+        self.assertNotIn(generate_authlink_key(), keys)
+        self.assertEqual(len(pool.keys), 6)
+        self.assertEqual(len(set(generate_authlink_keys(25))), 25)
+        self.assertEqual(generate_authlink_keys(0), [])
+
+    @override_settings(AUTHLINK_KEY_POOL_SIZE=10)
+    def test_pool_key_length_changed(self):
+        generate_authlink_key()
+        with self.settings(AUTHLINK_KEY_LENGTH=32):
+            key = generate_authlink_key()
+            self.assertEqual(len(key), 32)
+            self.assertTrue(is_valid_authlink_key(key))
+
+    @mock.patch("authlink.utils.import_attribute", return_value=fixed_key)
+    def test_generator_imported_once(self, import_attribute):
+        with self.settings(AUTHLINK_KEY_GENERATOR="tests.test_utils.fixed_key"):
+            generate_authlink_keys(2)
+            generate_authlink_key()
+        import_attribute.assert_called_once_with("tests.test_utils.fixed_key")
+
+
+class KeyPoolTestCase(SimpleTestCase):
+    def test_refills(self):
+        pool = KeyPool(5)
+        keys = {pool.get() for _ in range(12)}
+        self.assertEqual(len(keys), 12)
+        self.assertEqual(len(pool.keys), 3)
+
+    def test_get_none(self):
+        pool = KeyPool(5)
+        pool.get()
+        self.assertEqual(pool.get_many(0), [])
+        self.assertEqual(len(pool.keys), 4)
+
+    def test_discarded_after_fork(self):
+        pool = KeyPool(5)
+        pool.get()
+        parent_keys = list(pool.keys)
+        with mock.patch("authlink.utils.os.getpid", return_value=-1):
+            self.assertNotIn(pool.get(), parent_keys)
+            self.assertFalse(set(pool.keys) & set(parent_keys))
@@ -1,12 +1,19 @@
 import datetime
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import SESSION_KEY, get_user_model
-from django.test import Client, TestCase
+from django.contrib.messages import get_messages
+from django.contrib.sessions.models import Session
+from django.core.exceptions import ImproperlyConfigured
+from django.test import Client, RequestFactory, TestCase
+from django.test.utils import override_settings
 from django.urls import reverse
 from django.utils import timezone
 
+from authlink.adapter import get_adapter
 from authlink.models import AuthLink
+from authlink.views import AuthLinkView
 
 from .utils import mock_now
 
@@ -92,6 +99,17 @@ class AuthLinkViewTestCase(TestCase):
         self.authlink = AuthLink.objects.get(pk=self.authlink.pk)
         self.assertFalse(self.authlink.used)
 
+    @mock.patch("authlink.adapter.DefaultAuthLinkAdapter.is_expired", return_value=True)
+    def test_use_expired_by_adapter(self, _):
+        response = self.client.get(
+            reverse("authlink_use", kwargs={"key": self.authlink.key}),
+            REMOTE_ADDR=self.ipaddress,
+        )
+        self.assertEqual(NON_SUCCESS_URL, response.get("Location"))
+        self.assertNotIn(SESSION_KEY, self.client.session)
+        # claimed, then released again
+        self.assertFalse(AuthLink.objects.get(pk=self.authlink.pk).used)
+
     def test_use_used(self):
         self.authlink.used = timezone.now()
         self.authlink.save()
@@ -111,3 +129,207 @@ class AuthLinkViewTestCase(TestCase):
         self.assertEqual(response.status_code, 301)
         self.assertEqual(NON_SUCCESS_URL, response.get("Location"))
         self.assertNotIn(SESSION_KEY, self.client.session)
+        # the link is released again rather than burnt
+        self.authlink = AuthLink.objects.get(pk=self.authlink.pk)
+        self.assertFalse(self.authlink.used)
+
+    def test_use_missing(self):
+        response = self.client.get(
+            reverse("authlink_use", kwargs={"key": "doesnotexist"}),
+            REMOTE_ADDR=self.ipaddress,
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_use_twice(self):
+        url = reverse("authlink_use", kwargs={"key": self.authlink.key})
+        response = self.client.get(url, REMOTE_ADDR=self.ipaddress)
+        self.assertIn(TEST_URL, response.get("Location"))
+        response = Client().get(url, REMOTE_ADDR=self.ipaddress)
+        self.assertEqual(NON_SUCCESS_URL, response.get("Location"))
+
+    def test_use_queryset(self):
+        with mock.patch.object(
+            AuthLinkView, "get_queryset", return_value=AuthLink.objects.all()
+        ) as get_queryset:
+            response = self.client.get(
+                reverse("authlink_use", kwargs={"key": self.authlink.key}),
+                REMOTE_ADDR=self.ipaddress,
+            )
+        get_queryset.assert_called_once_with()
+        self.assertEqual(int(self.client.session[SESSION_KEY]), self.user.pk)
+        self.assertIn(TEST_URL, response.get("Location"))
+
+
+@mock_now
+class FailureReportingTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="luke", email="luke@...", password="top_secret"
+        )
+        now = timezone.now()
+        self.authlink = AuthLink.objects.create(
+            user=self.user,
+            ipaddress="201.21.121.1",
+            created=now,
+            expires=now + datetime.timedelta(seconds=settings.AUTHLINK_TTL_SECONDS),
+            url=TEST_URL,
+            used=now,
+        )
+        self.url = reverse("authlink_use", kwargs={"key": self.authlink.key})
+
+    def test_messages(self):
+        response = self.client.get(self.url, REMOTE_ADDR="201.21.121.1")
+        self.assertEqual(response.get("Location"), NON_SUCCESS_URL)
+        self.assertEqual(
+            [str(message) for message in get_messages(response.wsgi_request)],
+            ["Link has already been used."],
+        )
+
+    @override_settings(AUTHLINK_FAILURE_REPORTING="query")
+    def test_query(self):
+        response = self.client.get(self.url, REMOTE_ADDR="201.21.121.1")
+        self.assertEqual(response.get("Location"), "/?authlink_error=used")
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertFalse(Session.objects.exists())
+        request = RequestFactory().get(response.get("Location"))
+        self.assertEqual(get_adapter().get_failure_reason(request), "used")
+
+    @override_settings(
+        AUTHLINK_FAILURE_REPORTING="query",
+        AUTHLINK_NON_SUCCESS_REDIRECT_URL="https://example.com/sorry/?next=/a/#top",
+    )
+    def test_query_appended(self):
+        AuthLink.objects.update(used=None)
+        response = self.client.get(self.url, REMOTE_ADDR="201.21.121.2")
+        self.assertEqual(
+            response.get("Location"),
+            "https://example.com/sorry/?next=%2Fa%2F&authlink_error=address_mismatch#top",
+        )
+
+    @override_settings(
+        AUTHLINK_FAILURE_REPORTING="query",
+        AUTHLINK_NON_SUCCESS_REDIRECT_URL="/login/?next=&a=1",
+    )
+    def test_query_blank_values_kept(self):
+        AuthLink.objects.update(used=None)
+        response = self.client.get(self.url, REMOTE_ADDR="201.21.121.2")
+        self.assertEqual(
+            response.get("Location"), "/login/?next=&a=1&authlink_error=address_mismatch"
+        )
+
+    @override_settings(AUTHLINK_FAILURE_REPORTING="cookie")
+    def test_cookie(self):
+        response = self.client.get(self.url, REMOTE_ADDR="201.21.121.1")
+        self.assertEqual(response.get("Location"), NON_SUCCESS_URL)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertFalse(Session.objects.exists())
+        request = RequestFactory().get("/")
+        request.COOKIES = {key: morsel.value for key, morsel in response.cookies.items()}
+        self.assertEqual(get_adapter().get_failure_reason(request), "used")
+        request.COOKIES["authlink_error"] = "expired"
+        self.assertIsNone(get_adapter().get_failure_reason(request))
+
+    def test_get_failure_reason_messages(self):
+        self.assertIsNone(get_adapter().get_failure_reason(RequestFactory().get("/")))
+
+    @override_settings(AUTHLINK_FAILURE_REPORTING="email")
+    def test_invalid(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.client.get(self.url, REMOTE_ADDR="201.21.121.1")
+
+
+@mock_now
+class AsyncAuthLinkViewTestCase(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            username="luke", email="luke@...", password="top_secret"
+        )
+        self.ipaddress = "201.21.121.1"
+        now = timezone.now()
+        self.authlink = AuthLink.objects.create(
+            user=self.user,
+            ipaddress=self.ipaddress,
+            created=now,
+            expires=now + datetime.timedelta(seconds=settings.AUTHLINK_TTL_SECONDS),
+            url=TEST_URL,
+        )
+        self.url = reverse("async_authlink_use", kwargs={"key": self.authlink.key})
+
+    # ASGI requests take REMOTE_ADDR from the scope, so use a forwarded address
+
+    async def test_use_ok_not_authenticated(self):
+        response = await self.async_client.get(
+            self.url, headers={"x-forwarded-for": self.ipaddress}
+        )
+        self.assertEqual(response.status_code, 301)
+        self.assertIn(TEST_URL, response.get("Location"))
+        authlink = await AuthLink.objects.aget(pk=self.authlink.pk)
+        self.assertTrue(authlink.used)
+        session = await self.async_client.asession()
+        self.assertEqual(int(await session.aget(SESSION_KEY)), self.user.pk)
+
+    async def test_use_ok_already_authenticated_different_user(self):
+        another_user = await get_user_model().objects.acreate(username="another")
+        await self.async_client.aforce_login(another_user)
+        response = await self.async_client.get(
+            self.url, headers={"x-forwarded-for": self.ipaddress}
+        )
+        self.assertIn(TEST_URL, response.get("Location"))
+        session = await self.async_client.asession()
+        self.assertEqual(int(await session.aget(SESSION_KEY)), self.user.pk)
+
+    async def test_use_expired(self):
+        await AuthLink.objects.filter(pk=self.authlink.pk).aupdate(expires=timezone.now())
+        response = await self.async_client.get(
+            self.url, headers={"x-forwarded-for": self.ipaddress}
+        )
+        self.assertEqual(NON_SUCCESS_URL, response.get("Location"))
+        session = await self.async_client.asession()
+        self.assertIsNone(await session.aget(SESSION_KEY))
+
+    @mock.patch("authlink.adapter.DefaultAuthLinkAdapter.is_expired", return_value=True)
+    async def test_use_expired_by_adapter(self, _):
+        response = await self.async_client.get(
+            self.url, headers={"x-forwarded-for": self.ipaddress}
+        )
+        self.assertEqual(NON_SUCCESS_URL, response.get("Location"))
+        self.assertFalse((await AuthLink.objects.aget(pk=self.authlink.pk)).used)
+
+    async def test_use_used(self):
+        await self.async_client.get(self.url, headers={"x-forwarded-for": self.ipaddress})
+        self.async_client.cookies.clear()
+        response = await self.async_client.get(
+            self.url, headers={"x-forwarded-for": self.ipaddress}
+        )
+        self.assertEqual(NON_SUCCESS_URL, response.get("Location"))
+        session = await self.async_client.asession()
+        self.assertIsNone(await session.aget(SESSION_KEY))
+
+    async def test_use_mismatched_ipaddresses(self):
+        response = await self.async_client.get(
+            self.url, headers={"x-forwarded-for": "201.21.121.2"}
+        )
+        self.assertEqual(NON_SUCCESS_URL, response.get("Location"))
+        authlink = await AuthLink.objects.aget(pk=self.authlink.pk)
+        self.assertFalse(authlink.used)
+
+    async def test_use_mismatched_ipaddresses_not_claimed(self):
+        # with no transaction around it, a claim from the wrong address would
+        # show the link as used to a concurrent request from the right one
+        with mock.patch("authlink.adapter.DefaultAuthLinkAdapter.aclaim") as aclaim:
+            response = await self.async_client.get(
+                self.url, headers={"x-forwarded-for": "201.21.121.2"}
+            )
+        self.assertEqual(NON_SUCCESS_URL, response.get("Location"))
+        aclaim.assert_not_called()
+        response = await self.async_client.get(
+            self.url, headers={"x-forwarded-for": self.ipaddress}
+        )
+        self.assertIn(TEST_URL, response.get("Location"))
+
+    async def test_use_missing(self):
+        response = await self.async_client.get(
+            reverse("async_authlink_use", kwargs={"key": "doesnotexist"}),
+            headers={"x-forwarded-for": self.ipaddress},
+        )
+        self.assertEqual(response.status_code, 404)
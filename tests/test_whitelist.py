@@ -0,0 +1,51 @@
+import re
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from authlink.whitelist import UrlWhitelist, get_url_whitelist
+
+
+class UrlWhitelistTestCase(SimpleTestCase):
+    def test_empty(self):
+        self.assertFalse(UrlWhitelist([]).match("/anything/"))
+
+    def test_combined(self):
+        whitelist = UrlWhitelist([r"^/a/$", r"/b/(\d+)/", r"^/c/"])
+        self.assertEqual(len(whitelist.matchers), 1)
+        self.assertTrue(whitelist.match("/a/"))
+        self.assertTrue(whitelist.match("/b/12/"))
+        self.assertTrue(whitelist.match("/c/whatever"))
+        self.assertFalse(whitelist.match("/a/b/"))
+        # re.match semantics: patterns are anchored at the start
+        self.assertFalse(whitelist.match("/x/b/12/"))
+
+    def test_uncombinable_patterns(self):
+        whitelist = UrlWhitelist(
+            [r"^/a/$", r"^/(\w)/\1/$", r"(?i)^/upper/$", re.compile(r"^/d/"), r"^/e/"]
+        )
+        self.assertEqual(len(whitelist.matchers), 4)
+        self.assertTrue(whitelist.match("/x/x/"))
+        self.assertFalse(whitelist.match("/x/y/"))
+        self.assertTrue(whitelist.match("/UPPER/"))
+        self.assertTrue(whitelist.match("/d/"))
+        self.assertTrue(whitelist.match("/e/"))
+
+    def test_duplicate_group_names(self):
+        whitelist = UrlWhitelist([r"^/a/(?P<pk>\d+)/$", r"^/b/(?P<pk>\d+)/$"])
+        self.assertEqual(len(whitelist.matchers), 2)
+        self.assertTrue(whitelist.match("/b/1/"))
+
+    def test_decisions_cached(self):
+        whitelist = UrlWhitelist([r"^/a/$", r"^/b/$"])
+        whitelist.match("/a/")
+        whitelist.match("/a/")
+        self.assertEqual(whitelist.match.cache_info().hits, 1)
+
+    def test_rebuilt_on_setting_change(self):
+        with override_settings(AUTHLINK_URL_WHITELIST=[r"^/a/$"]):
+            whitelist = get_url_whitelist()
+            self.assertIs(get_url_whitelist(), whitelist)
+            self.assertTrue(whitelist.match("/a/"))
+        self.assertIsNot(get_url_whitelist(), whitelist)
+        self.assertFalse(get_url_whitelist().match("/a/"))
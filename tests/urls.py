@@ -3,8 +3,9 @@ from django.http import HttpResponse
 from django.urls import re_path
 from django.views.generic import View
 
-from authlink.api.rest_framework.views import AuthLinkCreateView
-from authlink.views import AuthLinkView
+from authlink.api.django import views as django_views
+from authlink.api.rest_framework.views import AuthLinkBulkCreateView, AuthLinkCreateView
+from authlink.views import AsyncAuthLinkView, AuthLinkView
 
 
 class AuthenticatedView(View):
@@ -18,7 +19,33 @@ class AuthenticatedView(View):
 
 urlpatterns = [
     re_path(r"^api/authlink/$", AuthLinkCreateView.as_view(), name="authlink_generate"),
-    re_path(r"^authlink/(?P<key>[\w]+)$", AuthLinkView.as_view(), name="authlink_use"),
+    re_path(r"^api/authlinks/$", AuthLinkBulkCreateView.as_view(), name="authlink_bulk_generate"),
+    re_path(
+        r"^json/authlinks/$",
+        django_views.AuthLinkBulkCreateView.as_view(),
+        name="authlink_bulk_generate_json",
+    ),
+    re_path(
+        r"^async/json/authlinks/$",
+        django_views.AsyncAuthLinkBulkCreateView.as_view(),
+        name="authlink_bulk_generate_json_async",
+    ),
+    re_path(
+        r"^json/authlink/$",
+        django_views.AuthLinkCreateView.as_view(),
+        name="authlink_generate_json",
+    ),
+    re_path(
+        r"^async/json/authlink/$",
+        django_views.AsyncAuthLinkCreateView.as_view(),
+        name="authlink_generate_json_async",
+    ),
+    re_path(r"^authlink/(?P<key>[\w.:-]+)$", AuthLinkView.as_view(), name="authlink_use"),
+    re_path(
+        r"^async/authlink/(?P<key>[\w.:-]+)$",
+        AsyncAuthLinkView.as_view(),
+        name="async_authlink_use",
+    ),
     re_path(
         r"^authenticatedview/$",
         login_required(AuthenticatedView.as_view()),